@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from datastore import get_store
+
+AGG_DIR = "data/aggregates"
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+# Per-cluster group tables: name -> review column
+GROUPS = {"country": "loc_country", "roast": "roast"}
+# Per-cluster value histograms: name -> review column
+VALUES = {"rating": "rating", "price": "100g_USD"}
+KEYS = {"cluster": ["Cluster"], "country": ["Cluster", "key"], "roast": ["Cluster", "key"],
+        "rating": ["Cluster", "value"], "price": ["Cluster", "value"]}
+# Bump when the table layout changes so tables saved by an older version are rebuilt
+AGG_VERSION = 2
+
+
+# ---- Build / merge ----
+def partial_tables(df):
+    """Additive tables (counts and sums) for a set of review rows"""
+    tables = {"cluster": df.groupby("Cluster").size().rename("count").reset_index()}
+    for name, col in GROUPS.items():
+        # Ratings and prices can each be missing, so each average keeps its own count
+        table = df.groupby(["Cluster", col], observed=True).agg(
+            count=("Cluster", "size"),
+            rating_count=("rating", "count"),
+            rating_sum=("rating", "sum"),
+            price_count=("100g_USD", "count"),
+            price_sum=("100g_USD", "sum"),
+        ).reset_index().rename(columns={col: "key"})
+        table["key"] = table["key"].astype(object)
+        tables[name] = table
+    for name, col in VALUES.items():
+        table = df.groupby(["Cluster", col], observed=True).size() \
+            .rename("count").reset_index().rename(columns={col: "value"})
+        table["value"] = table["value"].astype(float)
+        tables[name] = table
+    return tables
+
+def merge_tables(a, b):
+    return {
+        name: pd.concat([a[name], b[name]], ignore_index=True)
+        .groupby(KEYS[name], as_index=False).sum()
+        for name in a
+    }
+
+def _quantiles(values, counts):
+    # Same as np.quantile(np.repeat(values, counts), q) without materializing the rows
+    order = np.argsort(values)
+    values, cum = np.asarray(values)[order], np.cumsum(np.asarray(counts)[order])
+    pos = np.asarray(QUANTILES) * (cum[-1] - 1)
+    lo = values[np.searchsorted(cum, np.floor(pos), side="right")]
+    hi = values[np.searchsorted(cum, np.ceil(pos), side="right")]
+    return lo + (hi - lo) * (pos - np.floor(pos))
+
+def cluster_stats(tables):
+    rows = []
+    for cluster_id, count in zip(tables["cluster"]["Cluster"], tables["cluster"]["count"]):
+        row = {"Cluster": int(cluster_id), "count": int(count)}
+        for name in VALUES:
+            t = tables[name][tables[name]["Cluster"] == cluster_id]
+            values, counts = t["value"].to_numpy(float), t["count"].to_numpy()
+            if not counts.sum():
+                continue
+            row[f"{name}_count"] = int(counts.sum())
+            row[f"{name}_mean"] = float((values * counts).sum() / counts.sum())
+            row[f"{name}_min"] = float(values.min())
+            row[f"{name}_max"] = float(values.max())
+            for q, v in zip(QUANTILES, _quantiles(values, counts)):
+                row[f"{name}_p{int(q * 100)}"] = float(v)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+class Aggregates:
+    """Small per-cluster tables the UI and API read instead of the review DataFrame"""
+
+    def __init__(self, tables, version):
+        self.tables = tables
+        self.version = version
+        self.stats = cluster_stats(tables)
+
+    def _group(self, name, cluster_id, col):
+        t = self.tables[name]
+        t = t[t["Cluster"] == cluster_id]
+        return pd.DataFrame({
+            col: t["key"].to_numpy(),
+            "avg_rating": (t["rating_sum"] / t["rating_count"]).to_numpy(),
+            "avg_price": (t["price_sum"] / t["price_count"]).to_numpy(),
+            "count": t["count"].to_numpy(),
+        })
+
+    def country(self, cluster_id):
+        """loc_country, avg_rating, avg_price, count for one cluster"""
+        return self._group("country", cluster_id, "loc_country")
+
+    def roast(self, cluster_id):
+        return self._group("roast", cluster_id, "roast")
+
+    def cluster(self, cluster_id):
+        row = self.stats[self.stats["Cluster"] == cluster_id]
+        return None if row.empty else row.iloc[0].to_dict()
+
+    def save(self, agg_dir=AGG_DIR):
+        os.makedirs(agg_dir, exist_ok=True)
+        for name, table in self.tables.items():
+            table.to_csv(os.path.join(agg_dir, f"{name}.csv"), index=False)
+        tmp_path = os.path.join(agg_dir, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"format": AGG_VERSION, "store_version": list(map(list, self.version))}, f)
+        os.replace(tmp_path, os.path.join(agg_dir, "meta.json"))
+
+    @classmethod
+    def load(cls, version, agg_dir=AGG_DIR):
+        """Saved tables if they were built for this store version, else None"""
+        try:
+            with open(os.path.join(agg_dir, "meta.json"), "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("format") != AGG_VERSION or tuple(map(tuple, meta["store_version"])) != version:
+            return None
+        tables = {}
+        for name in KEYS:
+            table = pd.read_csv(os.path.join(agg_dir, f"{name}.csv"), keep_default_na=False)
+            if name in GROUPS:
+                table["key"] = table["key"].astype(object)
+            tables[name] = table
+        return cls(tables, version)
+
+
+def build_aggregates(store=None):
+    store = get_store() if store is None else store
+    df = store.frame(text_cols=())
+    return Aggregates(partial_tables(df), store.version)
+
+
+_aggregates = None
+_aggregates_lock = threading.Lock()
+
+def get_aggregates(store=None):
+    """Aggregates for the current store: loaded from disk, or rebuilt when out of date"""
+    global _aggregates
+    store = get_store() if store is None else store
+    if _aggregates is None or _aggregates.version != store.version:
+        with _aggregates_lock:
+            if _aggregates is None or _aggregates.version != store.version:
+                aggregates = Aggregates.load(store.version)
+                if aggregates is None:
+                    aggregates = build_aggregates(store)
+                    aggregates.save()
+                _aggregates = aggregates
+    return _aggregates
+
+def update_aggregates(df_new, old_store, new_store, agg_dir=AGG_DIR):
+    """Merge newly ingested rows into the saved tables (no full scan)"""
+    current = Aggregates.load(old_store.version, agg_dir)
+    if current is None:
+        # Out of date anyway; get_aggregates() rebuilds on next use
+        return False
+    merged = Aggregates(merge_tables(current.tables, partial_tables(df_new)), new_store.version)
+    merged.save(agg_dir)
+    return True
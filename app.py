@@ -1,14 +1,26 @@
 import streamlit as st
-import numpy as np
-import matplotlib.pyplot as plt
-from utils import predict_rating, predict_cluster, generate_flavor_profile, plot_pca_interactive, CLUSTER_NAMES, CLUSTER_DESCRIPTIONS
+from utils import warm_up, CLUSTER_NAMES, CLUSTER_DESCRIPTIONS
 import pandas as pd
-import plotly.express as px
-import base64
-import os
+from datastore import get_store
+from registry import registry
+from name_index import lookup_coffee
+from similarity import similar_coffees
+from llm import stream_flavor_profile
+from figures import get_cluster_map, get_pca_figure
+from assets import MISSING_IMAGE, build_assets, image_src
+from history import FIELDS, get_history_db, new_history
+import metrics
+import uuid
 
 st.set_page_config(page_title="Coffee ML App", layout="centered")
 
+# Models rewritten by a refit in another process are reloaded on the next rerun
+registry.reload_stale()
+# Load models in the background so the first page renders without waiting on them
+warm_up(background=True)
+# Resized WebP images under static/; encoded once per process, not per rerun
+build_assets()
+
 st.markdown("""
 <style>
 
@@ -328,19 +340,12 @@ def text_card(title, bullets):
         unsafe_allow_html=True
     )
 
-def roast_card(title, bullets, image_path):
+def roast_card(title, bullets, image):
     """Create a roast card with left text and right image"""
     bullet_html = "".join([f"<li>{b}</li>" for b in bullets])
     
-    # Encode image to base64 for HTML display
-    img_base64 = ""
-    if os.path.exists(image_path):
-        with open(image_path, "rb") as img_file:
-            img_base64 = base64.b64encode(img_file.read()).decode()
-            img_base64 = f"data:image/jpeg;base64,{img_base64}"
-    else:
-        # Fallback if image doesn't exist
-        img_base64 = "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMjAwIiBoZWlnaHQ9IjE1MCIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48cmVjdCB3aWR0aD0iMjAwIiBoZWlnaHQ9IjE1MCIgZmlsbD0iI0Y3RjNFRiIvPjx0ZXh0IHg9IjUwJSIgeT0iNTAlIiBmb250LWZhbWlseT0iQXJpYWwiIGZvbnQtc2l6ZT0iMTQiIGZpbGw9IiM2RjRFMzciIHRleHQtYW5jaG9yPSJtaWRkbGUiIGR5PSIuM2VtIj5JbWFnZSBub3QgZm91bmQ8L3RleHQ+PC9zdmc+"
+    # Static URL of the pre-encoded WebP (see assets.py)
+    img_src = image_src(image) or MISSING_IMAGE
     
     st.markdown(
         f"""
@@ -349,23 +354,23 @@ def roast_card(title, bullets, image_path):
                 <h4>{title}</h4>
                 <ul>{bullet_html}</ul>
             </div>
-            <img src="{img_base64}" class="roast-card-img" alt="{title}">
+            <img src="{img_src}" class="roast-card-img" alt="{title}">
         </div>
         """,
         unsafe_allow_html=True
     )
 
-# Initialize history
+# Initialize history (bounded per session; persisted under ?history=<id> when COFFEE_HISTORY_PATH is set)
 if "history" not in st.session_state:
-    st.session_state.history = []
+    history_id = None
+    if get_history_db() is not None:
+        history_id = st.query_params.get("history") or uuid.uuid4().hex
+        st.query_params["history"] = history_id
+    st.session_state.history = new_history(history_id)
 
-# Data load
-df = pd.read_csv("data/df_for_pca.csv")
-
-# Load PCA data for map
-pca_data = np.load("models/pca_data.npy")
-cluster_labels = np.load("models/cluster_labels.npy")
-cluster_labels = np.array(cluster_labels, dtype=int)
+# Data load (columnar store shared by all sessions, rebuilt when the CSV changes;
+# PCA coordinates and labels are read-only memory maps)
+store = get_store()
 
 # Create tabs
 tab1, tab2, tab3 = st.tabs(["Explore", "Predict", "History"])
@@ -423,19 +428,19 @@ with tab1:
         "Bright, fruity, floral",
         "Higher acidity",
         "Highlights bean origin flavors"
-    ], "./Pictures/light.jpg")
+    ], "light")
     
     roast_card("Medium Roast", [
         "Balanced sweetness and acidity",
         "Rounder body",
         "Notes of nuts, caramel, chocolate"
-    ], "./Pictures/medium.jpg")
+    ], "medium")
     
     roast_card("Dark Roast", [
         "Bold, smoky, bitter",
         "Low acidity",
         "More \"roast flavor,\" less origin character"
-    ], "./Pictures/dark.jpg")
+    ], "dark")
     
     # =======================
     #   SECTION 3: Brew Methods
@@ -513,60 +518,12 @@ with tab1:
     
     selected_cluster = st.session_state["explore_selected_cluster"]
     
-    # Filter df by cluster
-    df_cluster = df[df["Cluster"] == selected_cluster]
+    # Cached choropleth for the selected cluster (rebuilt only when the data changes)
+    fig_cluster_map = get_cluster_map(selected_cluster, store)
     
-    if len(df_cluster) == 0:
+    if fig_cluster_map is None:
         st.warning("No country data for this cluster.")
     else:
-        df_country_cluster = df_cluster.groupby("loc_country").agg(
-            avg_rating=("rating", "mean"),
-            avg_price=("100g_USD", "mean"),
-            count=("rating", "count"),
-        ).reset_index()
-        
-        fig_cluster_map = px.choropleth(
-            df_country_cluster,
-            locations="loc_country",
-            locationmode="country names",
-            color="count",
-            hover_name="loc_country",
-            hover_data={
-                "count": True,
-                "avg_rating": ":.2f",
-                "avg_price": ":.2f",
-            },
-            color_continuous_scale="YlOrRd",
-            title=f"{cluster_names[selected_cluster]} — Global Distribution",
-        )
-        
-        fig_cluster_map.update_traces(
-            marker_line_width=0.2,
-            marker_line_color="black"
-        )
-        fig_cluster_map.update_geos(
-            showcoastlines=True,
-            coastlinecolor="black",
-            coastlinewidth=0.3, 
-            showcountries=True,
-            countrycolor="black",
-            countrywidth=0.2,   
-            showland=True,
-            landcolor="white",
-            showlakes=False,
-            showframe=False,
-        )
-        
-        fig_cluster_map.update_layout(
-            margin=dict(l=0, r=0, t=40, b=0),
-            coloraxis_colorbar=dict(
-                title="Count",
-                thickness=12,
-                len=0.4,
-                bgcolor="rgba(255,255,255,0.7)"
-            )
-        )
-        
         st.plotly_chart(fig_cluster_map, use_container_width=True)
 
 # =======================
@@ -589,11 +546,17 @@ with tab2:
     if st.session_state.get("coffee_name"):
         name = st.session_state["coffee_name"]
         
-        matches = df[df["name"].str.contains(name, case=False, na=False)]
+        matches = lookup_coffee(name, k=5, store=store)
         
         if len(matches) > 0:
             coffee_row = matches.iloc[0]   
             
+            # Fill in the catalogue description once per newly matched coffee, so later edits stick
+            # (and pre-generated LLM descriptions, keyed on this text, are found)
+            if st.session_state.get("auto_row") != coffee_row.name:
+                st.session_state["auto_row"] = coffee_row.name
+                st.session_state["desc_input"] = store.text("text", [coffee_row.name])[0] or ""
+            
             # autofill session_state
             st.session_state["auto_roast"] = coffee_row["roast"]
             st.session_state["auto_loc"] = coffee_row["loc_country"]
@@ -601,15 +564,13 @@ with tab2:
             st.session_state["auto_rating"] = coffee_row["rating"]
     
     
-    # Description
-    text = st.text_area(
-        "Description",
-        value=st.session_state.get(
+    # Description (seeded once; autofill then writes desc_input directly, so no value= here)
+    if "desc_input" not in st.session_state:
+        st.session_state["desc_input"] = st.session_state.get(
             "default_text",
             "High-toned, richly sweet. Strawberry guava, roasted cacao nib, lime zest, jasmine, almond in aroma and cup. Sweetly-tart structure with juicy, balanced acidity; plush, syrupy mouthfeel. The finish is long and resonant, with lime zest and strawberry guava in the short, rounding to cocoa-toned jasmine in the deeply sweet long."
-        ),
-        key="desc_input"
-    )
+        )
+    text = st.text_area("Description", key="desc_input")
     
     # Price
     price = st.number_input("Price（100g/USD）", min_value=0.0, value=st.session_state.get("auto_price", 10.0))
@@ -643,50 +604,50 @@ with tab2:
     # Optional rating
     user_rating = st.text_input(
         "Optional: Rating",
-        value=str(st.session_state.get("auto_rating", "")),
+        value=f"{st.session_state['auto_rating']:g}" if "auto_rating" in st.session_state else "",
     )
-    if user_rating.strip() != "":
-        rating_used = float(user_rating)
-    elif "auto_rating" in st.session_state:
-        rating_used = float(st.session_state["auto_rating"])
-    else:
-        rating_used = predict_rating(text, roast, loc, price)
+    # The model rating is only computed when Predict is pressed (see analyze)
     
     # =======================
     #   Predict Button
     # =======================
     
-    from utils import (
-        predict_cluster,
-        predict_rating,
-        get_user_pca_point
-    )
+    from utils import analyze
     
     # ---------------------------
     # 1. PREDICT BUTTON LOGIC
     # ---------------------------
     if st.button("Predict"):
         
-        # --- 1. Predict Rating ---
-        #  Determine rating (use user provided or model)
+        # --- 1. Rating ---
+        #  Use user provided or autofilled rating, otherwise analyze() predicts it
         if user_rating.strip() != "":
-            predicted_rating = float(user_rating)   # use user input
+            rating_input = float(user_rating)   # use user input
         elif "auto_rating" in st.session_state:
-            predicted_rating = float(st.session_state["auto_rating"])  # use autofill
+            rating_input = float(st.session_state["auto_rating"])  # use autofill
         else:
-            predicted_rating = predict_rating(text, roast, loc, price)  # fallback to model
+            rating_input = None  # fallback to model
         
-        # --- 2. Predict Cluster ---
-        cluster_id = predict_cluster(text, roast, loc, price, predicted_rating)
-        cluster_name = CLUSTER_NAMES[cluster_id]
-        
-        # --- 3. PCA User Point ---
-        user_xy = get_user_pca_point(text, roast, loc, price, predicted_rating)
+        # Per-stage timings of this click (only recorded when metrics are enabled)
+        with metrics.trace() as spans:
+            # --- 2. Cluster + PCA User Point (one SBERT encode) ---
+            result = analyze(text, roast, loc, price, rating_input)
+            predicted_rating = result["rating"]
+            cluster_id = result["cluster_id"]
+            cluster_name = result["cluster_name"]
+            cluster_confidence = {k: result[k] for k in ("runner_up_id", "cluster_margin", "low_confidence", "memberships")}
+            user_xy = result["pca_xy"]
+            
+            # --- 3. Most similar reviewed coffees ---
+            with metrics.stage("similar"):
+                st.session_state["similar"] = similar_coffees(text, k=5, store=store)
+        st.session_state["last_trace"] = spans
         
         # --- Save to Session State ---
         st.session_state["predicted_rating"] = predicted_rating
         st.session_state["cluster_id"] = cluster_id
         st.session_state["cluster_name"] = cluster_name
+        st.session_state["cluster_confidence"] = cluster_confidence
         st.session_state["user_xy"] = user_xy
         
         # --- Save to History ---
@@ -716,31 +677,47 @@ with tab2:
         f"<p style='color:#6e6e6e;'>{cluster_desc}</p>",
         unsafe_allow_html=True
         )
+        confidence = st.session_state.get("cluster_confidence")
+        if confidence and confidence["low_confidence"]:
+            runner_up = CLUSTER_NAMES[confidence["runner_up_id"]]
+            st.warning(
+                f"Borderline match: this coffee sits almost as close to **{runner_up}** "
+                f"(margin {confidence['cluster_margin']:.1%})."
+            )
+        
+        if "similar" in st.session_state:
+            st.subheader("🔎 Most Similar Reviewed Coffees")
+            st.dataframe(
+                st.session_state["similar"][["name", "roaster", "rating", "100g_USD", "similarity"]],
+                use_container_width=True,
+                hide_index=True,
+            )
         
         # --- Plot PCA figure ---
-        fig = plot_pca_interactive(
-            pca_data, 
-            cluster_labels,
-            df,
-            CLUSTER_NAMES,
-            st.session_state["user_xy"]
-        )
+        fig = get_pca_figure(st.session_state["user_xy"], store)
         st.plotly_chart(fig, use_container_width=True)
         
+        if metrics.enabled():
+            with st.expander("⏱️ Debug: stage timings"):
+                st.caption("Last prediction")
+                st.dataframe(pd.DataFrame(st.session_state.get("last_trace", [])), use_container_width=True)
+                st.caption("Since startup")
+                st.dataframe(pd.DataFrame(metrics.snapshot()), use_container_width=True)
+                st.code(metrics.render_prometheus(), language="text")
+        
         # ---------------------------
         # 3. GENERATE AI ANALYSIS BUTTON
         # ---------------------------
         if st.button("Generate AI Analysis"):
-            flavor_desc = generate_flavor_profile(
+            st.subheader("💡 LLM Flavor Description")
+            # Tokens are rendered as they arrive instead of after the full completion
+            st.write_stream(stream_flavor_profile(
                 text=text,
                 cluster_id=st.session_state["cluster_id"],
                 roast=roast,
                 loc=loc,
                 price=price,
-            )
-            
-            st.subheader("💡 LLM Flavor Description")
-            st.write(flavor_desc)
+            ))
 
 # =======================
 #   TAB 3: HISTORY
@@ -748,16 +725,26 @@ with tab2:
 with tab3:
     st.header("📜 Prediction History")
     
-    if len(st.session_state.history) == 0:
+    history = st.session_state.history
+    if len(history) == 0:
         st.info("No predictions yet. Make a prediction in the Predict tab to see your history here.")
     else:
-        # Display as dataframe
-        history_df = pd.DataFrame(st.session_state.history)
+        # Only the visible page is read and rendered
+        hc1, hc2 = st.columns(2)
+        per_page = hc1.selectbox("Entries per page", [10, 25, 50], key="history_per_page")
+        n_pages = (len(history) - 1) // per_page + 1
+        if st.session_state.get("history_page", 1) > n_pages:
+            st.session_state["history_page"] = n_pages  # history shrank (cleared or per_page raised)
+        page = hc2.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, step=1, key="history_page")
+        entries = history.page(page - 1, per_page)
+        
+        # Display as dataframe (the page can come back empty if another tab cleared the history meanwhile)
+        history_df = pd.DataFrame(entries, columns=FIELDS).drop(columns="created")
         st.dataframe(history_df, use_container_width=True)
         
         # Also display as cards for a more polished look
         st.subheader("📋 Detailed History")
-        for idx, entry in enumerate(reversed(st.session_state.history)):
+        for entry in entries:
             st.markdown(f"""
             <div class="coffee-card">
                 <h3>{entry['name']}</h3>
@@ -767,7 +754,21 @@ with tab3:
             </div>
             """, unsafe_allow_html=True)
         
+        # CSV export is built from the store only when asked for, then kept until the history changes
+        export = st.session_state.get("history_export")
+        if export is not None and export[0] != history.version:
+            export = st.session_state["history_export"] = None
+        if st.button("Prepare CSV Export"):
+            export = st.session_state["history_export"] = (history.version, history.csv_file().getvalue())
+        if export is not None:
+            st.download_button(
+                "Download History (CSV)",
+                data=export[1],
+                file_name="coffee_history.csv",
+                mime="text/csv",
+            )
+        
         # Clear history button
         if st.button("Clear History"):
-            st.session_state.history = []
+            history.clear()
             st.rerun()
@@ -0,0 +1,139 @@
+"""Page images, resized and re-encoded once instead of on every rerun.
+
+    python assets.py build                 # write static/*.webp ahead of deploy
+
+Sources in Pictures/ are cover-cropped to their display size (2x for HiDPI,
+never upscaled) and saved as WebP under static/ with a content hash in the
+file name. With server.enableStaticServing (see .streamlit/config.toml) the
+page references them as app/static/<file>, so browsers download each image
+once and revalidate by ETag; otherwise the small WebP is inlined as a data
+URI that is encoded once per process.
+
+The page background is not bundled: its source image is not in the
+repository, so the stylesheet in app.py still loads it from the CDN.
+"""
+import argparse
+import base64
+import hashlib
+import io
+import os
+import threading
+
+STATIC_DIR = "static"
+STATIC_URL = "app/static"
+
+# name -> (source, display size in CSS pixels, WebP quality)
+ASSETS = {
+    "light": ("Pictures/light.jpg", (200, 150), 80),
+    "medium": ("Pictures/medium.jpg", (200, 150), 80),
+    "dark": ("Pictures/dark.jpg", (200, 150), 80),
+}
+# Bump when the resize / encode settings change
+ASSET_VERSION = 1
+
+MISSING_IMAGE = "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMjAwIiBoZWlnaHQ9IjE1MCIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48cmVjdCB3aWR0aD0iMjAwIiBoZWlnaHQ9IjE1MCIgZmlsbD0iI0Y3RjNFRiIvPjx0ZXh0IHg9IjUwJSIgeT0iNTAlIiBmb250LWZhbWlseT0iQXJpYWwiIGZvbnQtc2l6ZT0iMTQiIGZpbGw9IiM2RjRFMzciIHRleHQtYW5jaG9yPSJtaWRkbGUiIGR5PSIuM2VtIj5JbWFnZSBub3QgZm91bmQ8L3RleHQ+PC9zdmc+"
+
+
+def encode_webp(source, size, quality, scale=2):
+    """WebP bytes of source cropped to size's aspect ratio at up to scale x size"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as im:
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        w, h = size
+        # Largest scale x size box that fits inside the source, keeping the display aspect ratio
+        factor = min(scale, im.width / w, im.height / h)
+        target = (max(1, round(w * factor)), max(1, round(h * factor)))
+        im = ImageOps.fit(im, target, Image.LANCZOS)
+        buf = io.BytesIO()
+        im.save(buf, format="WEBP", quality=quality, method=6)
+    return buf.getvalue()
+
+
+class AssetCache:
+    """Encoded payloads per asset name, built at most once per process"""
+
+    def __init__(self, assets=ASSETS, static_dir=STATIC_DIR):
+        self.assets = dict(assets)
+        self.static_dir = static_dir
+        self._files = {}
+        self._uris = {}
+        self._lock = threading.Lock()
+
+    def _file(self, name):
+        with self._lock:
+            if name in self._files:
+                return self._files[name]
+            source, size, quality = self.assets[name]
+            if not os.path.exists(source):
+                self._files[name] = None
+                return None
+            with open(source, "rb") as f:
+                digest = hashlib.sha1(f.read() + repr((ASSET_VERSION, size, quality)).encode()).hexdigest()[:12]
+            path = os.path.join(self.static_dir, f"{name}.{digest}.webp")
+            if not os.path.exists(path):
+                data = encode_webp(source, size, quality)
+                os.makedirs(self.static_dir, exist_ok=True)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            self._files[name] = path
+            return path
+
+    def path(self, name):
+        """Path of the encoded file under static/, or None when the source is missing"""
+        return self._file(name)
+
+    def data_uri(self, name):
+        path = self._file(name)
+        if path is None:
+            return None
+        with self._lock:
+            uri = self._uris.get(name)
+            if uri is None:
+                with open(path, "rb") as f:
+                    uri = self._uris[name] = "data:image/webp;base64," + base64.b64encode(f.read()).decode()
+        return uri
+
+    def build(self):
+        return {name: self.path(name) for name in self.assets}
+
+
+asset_cache = AssetCache()
+
+def _static_serving():
+    try:
+        import streamlit as st
+        return bool(st.get_option("server.enableStaticServing"))
+    except Exception:
+        return False
+
+def image_src(name, static=None):
+    """Value for <img src> / CSS url(): static URL when served, else a cached data URI.
+
+    None when the source is missing.
+    """
+    static = _static_serving() if static is None else static
+    path = asset_cache.path(name)
+    if path is None:
+        return None
+    if static:
+        return f"{STATIC_URL}/{os.path.basename(path)}"
+    return asset_cache.data_uri(name)
+
+def build_assets():
+    return asset_cache.build()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the page's static image assets")
+    parser.add_argument("command", choices=["build"], help="resize and encode every image under static/")
+    parser.parse_args()
+
+    for name, path in build_assets().items():
+        source = ASSETS[name][0]
+        if path is None:
+            print(f"{name:<11} missing source {source}")
+        else:
+            print(f"{name:<11} {os.path.getsize(source) / 1024:7.1f} KB -> {os.path.getsize(path) / 1024:6.1f} KB  {path}")
@@ -0,0 +1,196 @@
+"""Benchmarks for the inference and rendering hot paths.
+
+    python bench.py --out bench/results.json
+    python bench.py --compare bench/results.json   # flag regressions against a saved run
+
+Runs offline against models/ and data/df_for_pca.csv (SBERT must already be in
+the local Hugging Face cache). Memoization caches are cleared before every
+call so single-item numbers measure real work.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import utils
+from datastore import SOURCE_CSV, get_store
+
+
+def summarize(latencies, items_per_call=1):
+    lat = np.asarray(latencies)
+    return {
+        "calls": len(lat),
+        "items_per_call": items_per_call,
+        "mean_ms": float(lat.mean() * 1000),
+        "p50_ms": float(np.percentile(lat, 50) * 1000),
+        "p90_ms": float(np.percentile(lat, 90) * 1000),
+        "p99_ms": float(np.percentile(lat, 99) * 1000),
+        "items_per_s": float(items_per_call * len(lat) / lat.sum()),
+    }
+
+def timed(fn, args_list, setup=None, warmup=2):
+    for args in args_list[:warmup]:
+        fn(*args)
+    latencies = []
+    for args in args_list:
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def clear_caches():
+    utils.predict_rating.cache_clear()
+    utils.embed_text.cache_clear()
+
+
+# ---- Cases ----
+def single_cases(rows):
+    rating_args = [(r.text, r.roast, r.loc_country, r.price) for r in rows]
+    cluster_args = [(r.text, r.roast, r.loc_country, r.price, r.rating) for r in rows]
+    return {
+        "encode_for_rating": (utils.encode_for_rating, rating_args),
+        "predict_rating": (utils.predict_rating, rating_args),
+        "encode_for_cluster": (utils.encode_for_cluster, cluster_args),
+        "predict_cluster": (utils.predict_cluster, cluster_args),
+        "get_user_pca_point": (utils.get_user_pca_point, cluster_args),
+        "analyze": (utils.analyze, cluster_args),
+    }
+
+def batch_cases():
+    return {
+        "predict_rating_batch": lambda chunk: utils.predict_rating_batch(chunk),
+        "predict_cluster_batch": lambda chunk: utils.predict_cluster_batch(chunk),
+        "analyze_batch": lambda chunk: utils.analyze_batch(chunk),
+    }
+
+def bench_plots(store, n):
+    from figures import get_pca_figure
+
+    df = store.frame()
+    xy = np.asarray(store.pca_data[0])
+    results = {}
+    latencies = timed(
+        lambda: utils.plot_pca_interactive(store.pca_data, store.cluster_labels, df, utils.CLUSTER_NAMES, xy),
+        [()] * n,
+    )
+    results["plot_pca_interactive"] = summarize(latencies)
+    latencies = timed(lambda: get_pca_figure(xy, store), [()] * n)
+    results["get_pca_figure"] = summarize(latencies)
+    return results
+
+def bench_app(n):
+    """Full scripted reruns of app.py: a plain rerun, then a Predict click"""
+    from streamlit.testing.v1 import AppTest
+
+    results = {}
+    at = AppTest.from_file("app.py", default_timeout=120)
+    start = time.perf_counter()
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"app.py failed: {at.exception[0].message}")
+    results["app_first_run"] = summarize([time.perf_counter() - start])
+
+    latencies = timed(lambda: at.run(), [()] * n, warmup=1)
+    results["app_rerun"] = summarize(latencies)
+
+    predict = next(b for b in at.button if b.label == "Predict")
+    latencies = []
+    for _ in range(n):
+        clear_caches()
+        start = time.perf_counter()
+        predict.click().run()
+        latencies.append(time.perf_counter() - start)
+    results["app_predict_click"] = summarize(latencies)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(n_single=50, batch_sizes=(1, 32, 256, 2095), n_batch=3, n_plot=10, n_app=5, skip_app=False):
+    df = pd.read_csv(SOURCE_CSV)
+    df["text"] = df["text"].fillna("")
+    sample = df.sample(n=min(n_single, len(df)), random_state=0)
+    rows = [
+        pd.Series({"text": t, "roast": r, "loc_country": l, "price": p, "rating": float(y)})
+        for t, r, l, p, y in zip(sample["text"], sample["roast"], sample["loc_country"],
+                                 sample["100g_USD"], sample["rating"])
+    ]
+
+    results = {}
+    for name, (fn, args_list) in single_cases(rows).items():
+        results[f"single/{name}"] = summarize(timed(fn, args_list, setup=clear_caches))
+
+    for name, fn in batch_cases().items():
+        for size in batch_sizes:
+            chunk = df.head(size)
+            results[f"batch/{name}/{size}"] = summarize(timed(fn, [(chunk,)] * n_batch, warmup=1), size)
+
+    for name, stats in bench_plots(get_store(), n_plot).items():
+        results[f"render/{name}"] = stats
+
+    if not skip_app:
+        for name, stats in bench_app(n_app).items():
+            results[f"app/{name}"] = stats
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+def compare(current, baseline, threshold):
+    """Print p50 ratios against a baseline run; returns the names that regressed"""
+    regressed = []
+    for name, stats in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = stats["p50_ms"] / base["p50_ms"] if base["p50_ms"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressed.append(name)
+        print(f"{name:<40} {base['p50_ms']:10.2f} -> {stats['p50_ms']:10.2f} ms  x{ratio:5.2f}{flag}")
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark inference and rendering")
+    parser.add_argument("--out", default=None, help="write results JSON here")
+    parser.add_argument("--compare", default=None, help="baseline results JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p50 slowdown (0.2 = 20%%)")
+    parser.add_argument("--n-single", type=int, default=50)
+    parser.add_argument("--batch-sizes", default="1,32,256,2095")
+    parser.add_argument("--skip-app", action="store_true", help="skip the Streamlit rerun benchmark")
+    args = parser.parse_args()
+
+    current = run(
+        n_single=args.n_single,
+        batch_sizes=tuple(int(b) for b in args.batch_sizes.split(",")),
+        skip_app=args.skip_app,
+    )
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressed = compare(current, json.load(f), args.threshold)
+        sys.exit(1 if regressed else 0)
+    for name, stats in current["results"].items():
+        print(f"{name:<40} p50 {stats['p50_ms']:9.2f} ms  p99 {stats['p99_ms']:9.2f} ms  "
+              f"{stats['items_per_s']:10.1f} items/s")
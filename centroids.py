@@ -0,0 +1,137 @@
+"""Nearest-centroid cluster assignment with distances and confidence.
+
+    python centroids.py check      # labels vs kmeans.predict on the stored corpus, margin spread
+
+CentroidAssigner keeps the KMeans centers (transposed, contiguous) and their
+squared norms, so a batch of rows costs one matrix multiply:
+
+    ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2
+
+Besides the hard label it returns every cluster's distance, soft memberships
+(softmax of -d^2 / temperature, the temperature being the model's mean squared
+distance to the own centroid) and a margin, 1 - d_nearest / d_runner_up. A
+margin near 0 means the row sits on the border between two clusters; those
+are flagged low confidence.
+"""
+import argparse
+import sys
+import threading
+
+import numpy as np
+
+from registry import registry
+
+# Rows whose nearest centroid is less than 5% closer than the runner-up
+LOW_CONFIDENCE_MARGIN = 0.05
+
+
+class CentroidAssigner:
+    """kmeans.predict plus per-cluster distances, memberships and margin"""
+
+    def __init__(self, kmeans, temperature=None, low_margin=LOW_CONFIDENCE_MARGIN):
+        self.kmeans = kmeans
+        centers = np.asarray(kmeans.cluster_centers_, dtype=np.float64)
+        self.n_clusters, self.n_features = centers.shape
+        self.centers_t = np.ascontiguousarray(centers.T)
+        self.center_sq = np.einsum("ij,ij->i", centers, centers)
+        if temperature is None:
+            labels = getattr(kmeans, "labels_", None)
+            inertia = getattr(kmeans, "inertia_", None)
+            temperature = inertia / len(labels) if labels is not None and inertia else 1.0
+        self.temperature = float(temperature)
+        self.low_margin = low_margin
+
+    def squared_distances(self, X, dots=None):
+        """(n, n_clusters) squared Euclidean distances; dots is X @ centers_t when already computed"""
+        X = np.asarray(X, dtype=np.float64)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, the centroids have {self.n_features}")
+        # A NaN row would otherwise land on cluster 0, where kmeans.predict raises
+        bad = ~np.isfinite(X).all(axis=1)
+        if bad.any():
+            raise ValueError(f"X contains NaN or infinity in row(s) {np.nonzero(bad)[0][:10].tolist()}")
+        d2 = X @ self.centers_t if dots is None else np.array(dots, dtype=np.float64)
+        d2 *= -2.0
+        d2 += self.center_sq
+        d2 += np.einsum("ij,ij->i", X, X)[:, None]
+        # Cancellation can leave tiny negatives for rows sitting on a centroid
+        return np.maximum(d2, 0.0, out=d2)
+
+    def assign(self, X, dots=None):
+        """Dict of label, runner_up, distances, memberships, margin and low_confidence arrays"""
+        d2 = self.squared_distances(X, dots)
+        rows = np.arange(len(d2))
+        order = np.argsort(d2, axis=1, kind="stable")[:, :2]
+        labels, runner_up = order[:, 0], order[:, -1]
+        distances = np.sqrt(d2)
+
+        logits = -(d2 - d2[rows, labels][:, None]) / self.temperature
+        memberships = np.exp(logits)
+        memberships /= memberships.sum(axis=1, keepdims=True)
+
+        nearest, second = distances[rows, labels], distances[rows, runner_up]
+        margin = np.where(second > 0, 1.0 - nearest / np.where(second > 0, second, 1.0), 0.0)
+        return {
+            "label": labels.astype(int),
+            "runner_up": runner_up.astype(int),
+            "distances": distances,
+            "memberships": memberships,
+            "margin": margin,
+            "low_confidence": margin < self.low_margin,
+        }
+
+    def predict(self, X):
+        return self.assign(X)["label"]
+
+
+_assigner = None
+_build_lock = threading.Lock()
+
+def get_centroid_assigner():
+    """Assigner for the currently loaded kmeans (rebuilt after registry.invalidate)"""
+    global _assigner
+    kmeans = registry.get("kmeans")
+    assigner = _assigner
+    if assigner is None or assigner.kmeans is not kmeans:
+        with _build_lock:
+            assigner = _assigner = CentroidAssigner(kmeans)
+    return assigner
+
+
+# ---- Parity ----
+def check_parity(store=None):
+    """Labels of the stored corpus features vs kmeans.predict, plus the margin spread"""
+    from datastore import get_store
+    from ingest import cluster_features
+
+    store = get_store() if store is None else store
+    df = store.frame(text_cols=("text",))
+    df["text"] = df["text"].fillna("")
+    emb = registry.get("sbert").encode(df["text"].tolist(), batch_size=64)
+    X = cluster_features(df, emb, registry.get("ohe_cols"), registry.get("scaler_cluster"))
+
+    assigner = get_centroid_assigner()
+    result = assigner.assign(X)
+    expected = registry.get("kmeans").predict(X)
+    single = np.array([assigner.assign(X[i:i + 1])["label"][0] for i in range(min(len(X), 100))])
+    return {
+        "rows": len(X),
+        "mismatches": int((result["label"] != expected).sum()),
+        "single_mismatches": int((single != expected[:len(single)]).sum()),
+        "membership_sum_err": float(np.abs(result["memberships"].sum(axis=1) - 1).max()),
+        "margin_percentiles": np.percentile(result["margin"], [5, 25, 50]).tolist(),
+        "low_confidence": float(result["low_confidence"].mean()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Centroid assignment parity check")
+    parser.add_argument("command", choices=["check"])
+    args = parser.parse_args()
+
+    result = check_parity()
+    p5, p25, p50 = result["margin_percentiles"]
+    print(f"{result['rows']} rows: {result['mismatches']} label mismatches vs kmeans.predict "
+          f"({result['single_mismatches']} single-row); margin p5 {p5:.3f} p25 {p25:.3f} p50 {p50:.3f}; "
+          f"{result['low_confidence'] * 100:.1f}% low confidence")
+    sys.exit(1 if result["mismatches"] or result["single_mismatches"] else 0)
@@ -0,0 +1,299 @@
+import io
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+from filelock import FileLock
+
+SOURCE_CSV = "data/df_for_pca.csv"
+PCA_PATH = "models/pca_data.npy"
+LABELS_PATH = "models/cluster_labels.npy"
+STORE_DIR = "data/store"
+
+CATEGORICAL_COLS = ["roaster", "roast", "loc_country", "origin_1", "origin_2", "review_date"]
+NUMERIC_COLS = ["100g_USD", "rating", "Cluster"]
+# Ingest fills missing ratings with model predictions, so rating holds floats even when the CSV's are whole
+FLOAT_COLS = {"100g_USD", "rating"}
+TEXT_COLS = ["name", "desc_1", "desc_2", "desc_3", "text"]
+
+STORE_VERSION = 2
+
+
+def _signature(path):
+    st = os.stat(path)
+    return {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def _sources(source_csv, pca_path, labels_path):
+    return [_signature(p) for p in (source_csv, pca_path, labels_path)]
+
+
+# ---- Lock ----
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+def store_lock(store_dir=STORE_DIR):
+    """Inter-process lock held while the source files or the store are written.
+
+    ingest takes it around its CSV / .npy / store appends and build_store around
+    its read of the sources, so no process rebuilds from half-appended files.
+    Re-entrant within a thread: one FileLock per path, held per thread.
+    """
+    path = os.path.abspath(store_dir) + ".lock"
+    with _file_locks_guard:
+        lock = _file_locks.get(path)
+        if lock is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock = _file_locks[path] = FileLock(path)
+        return lock
+
+
+# ---- Build ----
+def _write_text(store_dir, col, values):
+    # UTF-8 blob + offsets, so a single string can be sliced out of a memory map
+    is_null = values.isna().to_numpy()
+    encoded = [b"" if null else str(v).encode("utf-8") for v, null in zip(values, is_null)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(os.path.join(store_dir, f"{col}.utf8"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(store_dir, f"{col}.offsets.npy"), offsets)
+    np.save(os.path.join(store_dir, f"{col}.null.npy"), is_null)
+
+def build_store(source_csv=SOURCE_CSV, pca_path=PCA_PATH, labels_path=LABELS_PATH, store_dir=STORE_DIR):
+    """Convert the review CSV and PCA arrays into the columnar store"""
+    with store_lock(store_dir):
+        return _build_store(source_csv, pca_path, labels_path, store_dir)
+
+def _build_store(source_csv, pca_path, labels_path, store_dir):
+    df = pd.read_csv(source_csv)
+    pca_data = np.load(pca_path)
+    labels = np.load(labels_path)
+    if not len(df) == len(pca_data) == len(labels):
+        raise ValueError(
+            f"{source_csv} has {len(df)} rows but {pca_path} has {len(pca_data)} "
+            f"and {labels_path} {len(labels)}: the sources are out of step"
+        )
+    # Private to this build, so concurrent builds in other processes cannot clobber it
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=os.path.basename(store_dir) + ".tmp-")
+
+    categories = {}
+    for col in CATEGORICAL_COLS:
+        cat = pd.Categorical(df[col])
+        np.save(os.path.join(tmp_dir, f"{col}.codes.npy"), cat.codes.astype(np.int32))
+        categories[col] = [str(c) for c in cat.categories]
+    for col in NUMERIC_COLS:
+        values = df[col].to_numpy(dtype=np.float64) if col in FLOAT_COLS else df[col].to_numpy()
+        np.save(os.path.join(tmp_dir, f"{col}.npy"), values)
+    for col in TEXT_COLS:
+        _write_text(tmp_dir, col, df[col])
+
+    np.save(os.path.join(tmp_dir, "pca_data.npy"), np.ascontiguousarray(pca_data, dtype=np.float64))
+    np.save(os.path.join(tmp_dir, "cluster_labels.npy"), labels.astype(np.int64))
+
+    meta = {
+        "version": STORE_VERSION,
+        "rows": len(df),
+        "columns": list(df.columns),
+        "categories": categories,
+        "sources": _sources(source_csv, pca_path, labels_path),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    # Swap the finished store into place so readers never see a half-written one
+    old_dir = tmp_dir + ".old"
+    try:
+        os.replace(store_dir, old_dir)
+    except FileNotFoundError:
+        pass
+    try:
+        os.replace(tmp_dir, store_dir)
+    except OSError:
+        # Another process installed its build in between; it is built from the same sources
+        _rmtree(tmp_dir)
+    _rmtree(old_dir)
+    return meta
+
+def _rmtree(path):
+    import shutil
+    shutil.rmtree(path, ignore_errors=True)
+
+def _read_meta(store_dir):
+    try:
+        with open(os.path.join(store_dir, "meta.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_stale(meta, source_csv=SOURCE_CSV, pca_path=PCA_PATH, labels_path=LABELS_PATH):
+    if meta is None or meta.get("version") != STORE_VERSION:
+        return True
+    return meta["sources"] != _sources(source_csv, pca_path, labels_path)
+
+
+# ---- Append ----
+def append_npy(path, rows):
+    """Append rows to an .npy file along axis 0 without rewriting existing data"""
+    fmt = np.lib.format
+    with open(path, "r+b") as f:
+        major, minor = fmt.read_magic(f)
+        if (major, minor) == (1, 0):
+            shape, fortran, dtype = fmt.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = fmt.read_array_header_2_0(f)
+        header_len = f.tell()
+        rows = np.asarray(rows)
+        if not np.can_cast(rows.dtype, dtype, casting="same_kind"):
+            # e.g. predicted float ratings into an int column would be truncated for good
+            raise ValueError(f"Cannot append {rows.dtype} rows to {dtype} array {path}")
+        rows = np.ascontiguousarray(rows, dtype=dtype).reshape((-1,) + tuple(shape[1:]))
+        if fortran and rows.ndim > 1:
+            raise ValueError(f"Cannot append to Fortran-ordered array {path}")
+        new_shape = (shape[0] + len(rows),) + tuple(shape[1:])
+        header = io.BytesIO()
+        header_dict = {"descr": fmt.dtype_to_descr(dtype), "fortran_order": False, "shape": new_shape}
+        if (major, minor) == (1, 0):
+            fmt.write_array_header_1_0(header, header_dict)
+        else:
+            fmt.write_array_header_2_0(header, header_dict)
+        if header.tell() != header_len:
+            # Header padding ran out; fall back to rewriting the file
+            f.close()
+            tmp_path = path + ".tmp.npy"
+            np.save(tmp_path, np.concatenate([np.load(path), rows]))
+            os.replace(tmp_path, path)
+            return new_shape
+        f.seek(0, os.SEEK_END)
+        f.write(rows.tobytes())
+        f.seek(0)
+        f.write(header.getvalue())
+    return new_shape
+
+def append_rows(df_new, pca_new, labels_new, store_dir=STORE_DIR,
+                source_csv=SOURCE_CSV, pca_path=PCA_PATH, labels_path=LABELS_PATH):
+    """Extend the store with rows already appended to the source files"""
+    meta = _read_meta(store_dir)
+    for col in CATEGORICAL_COLS:
+        categories = meta["categories"][col]
+        lookup = {c: i for i, c in enumerate(categories)}
+        codes = []
+        for value in df_new[col]:
+            if pd.isna(value):
+                codes.append(-1)
+                continue
+            value = str(value)
+            if value not in lookup:
+                lookup[value] = len(categories)
+                categories.append(value)
+            codes.append(lookup[value])
+        append_npy(os.path.join(store_dir, f"{col}.codes.npy"), np.array(codes, dtype=np.int32))
+    for col in NUMERIC_COLS:
+        append_npy(os.path.join(store_dir, f"{col}.npy"), df_new[col].to_numpy())
+    for col in TEXT_COLS:
+        values = df_new[col]
+        is_null = values.isna().to_numpy()
+        encoded = [b"" if null else str(v).encode("utf-8") for v, null in zip(values, is_null)]
+        offsets_path = os.path.join(store_dir, f"{col}.offsets.npy")
+        last = int(np.load(offsets_path, mmap_mode="r")[-1])
+        with open(os.path.join(store_dir, f"{col}.utf8"), "ab") as f:
+            f.write(b"".join(encoded))
+        append_npy(offsets_path, last + np.cumsum([len(b) for b in encoded], dtype=np.int64))
+        append_npy(os.path.join(store_dir, f"{col}.null.npy"), is_null)
+    append_npy(os.path.join(store_dir, "pca_data.npy"), pca_new)
+    append_npy(os.path.join(store_dir, "cluster_labels.npy"), labels_new)
+
+    meta["rows"] += len(df_new)
+    meta["sources"] = _sources(source_csv, pca_path, labels_path)
+    # meta.json is written last: readers only see the new rows once it is in place
+    tmp_path = os.path.join(store_dir, "meta.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(store_dir, "meta.json"))
+    return meta
+
+
+# ---- Read ----
+class DataStore:
+    """Read-only view over the columnar store; arrays are memory-mapped"""
+
+    def __init__(self, store_dir, meta):
+        self.store_dir = store_dir
+        self.meta = meta
+        self.rows = meta["rows"]
+        # Sliced to the row count in meta.json, which an in-progress append updates last
+        self.pca_data = self._load("pca_data.npy")[:self.rows]
+        self.cluster_labels = self._load("cluster_labels.npy")[:self.rows]
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def _load(self, filename):
+        return np.load(os.path.join(self.store_dir, filename), mmap_mode="r")
+
+    @property
+    def version(self):
+        return tuple((s["size"], s["mtime_ns"]) for s in self.meta["sources"])
+
+    def column(self, col):
+        if col in NUMERIC_COLS:
+            return self._load(f"{col}.npy")[:self.rows]
+        if col in CATEGORICAL_COLS:
+            codes = self._load(f"{col}.codes.npy")[:self.rows]
+            return pd.Categorical.from_codes(codes, categories=self.meta["categories"][col])
+        if col in TEXT_COLS:
+            return self.text(col)
+        raise KeyError(col)
+
+    def text(self, col, rows=None):
+        path = os.path.join(self.store_dir, f"{col}.utf8")
+        # np.memmap refuses empty files
+        blob = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else b""
+        offsets = self._load(f"{col}.offsets.npy")
+        is_null = self._load(f"{col}.null.npy")
+        rows = range(self.rows) if rows is None else rows
+        return [
+            None if is_null[i] else bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8")
+            for i in rows
+        ]
+
+    def frame(self, text_cols=("name",)):
+        """DataFrame of the categorical/numeric columns plus the requested text columns"""
+        if text_cols == ("name",) and self._frame is not None:
+            return self._frame
+        data = {}
+        for col in self.meta["columns"]:
+            if col in TEXT_COLS and col not in text_cols:
+                continue
+            data[col] = self.column(col)
+        df = pd.DataFrame(data)
+        if text_cols == ("name",):
+            with self._lock:
+                self._frame = df
+        return df
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store(source_csv=SOURCE_CSV, pca_path=PCA_PATH, labels_path=LABELS_PATH, store_dir=STORE_DIR):
+    """Process-wide store, rebuilt when the source CSV or PCA arrays change"""
+    global _store
+    store = _store
+    if store is not None and not is_stale(store.meta, source_csv, pca_path, labels_path):
+        return store
+    # Waits out an ingest in progress, whose sources only match the store again once it is done
+    with store_lock(store_dir), _store_lock:
+        meta = _read_meta(store_dir)
+        if is_stale(meta, source_csv, pca_path, labels_path):
+            meta = _build_store(source_csv, pca_path, labels_path, store_dir)
+        _store = DataStore(store_dir, meta)
+        return _store
+
+
+if __name__ == "__main__":
+    meta = build_store()
+    print(f"Built {STORE_DIR}: {meta['rows']} rows, {len(meta['columns'])} columns")
@@ -0,0 +1,208 @@
+"""Sentence embedding backends for CPU inference.
+
+COFFEE_EMBED_BACKEND picks how all-MiniLM-L6-v2 runs:
+
+    torch   full-precision PyTorch (default)
+    onnx    exported ONNX Runtime graph
+    int8    dynamically quantized int8 ONNX graph (COFFEE_EMBED_INT8_FILE)
+
+COFFEE_EMBED_THREADS caps the intra-op threads (default: library default).
+The onnx / int8 backends need `pip install "optimum[onnxruntime]"`.
+
+    python embeddings.py parity --backend int8     # cluster assignments unchanged?
+    python embeddings.py bench --backends torch,onnx,int8 --threads 1,4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+BACKENDS = ("torch", "onnx", "int8")
+# Quantized graph shipped with the model on the Hugging Face hub; the avx2 build runs on any x86-64
+DEFAULT_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+_settings = {
+    "backend": os.getenv("COFFEE_EMBED_BACKEND", "torch"),
+    "threads": int(os.getenv("COFFEE_EMBED_THREADS", "0")) or None,
+}
+
+
+def configure(backend=None, threads=None):
+    """Override the environment settings; call before the first encode"""
+    if backend is not None:
+        _settings["backend"] = backend
+    if threads is not None:
+        _settings["threads"] = threads or None
+
+def backend_name():
+    return _settings["backend"]
+
+def _onnx_kwargs(threads, file_name=None):
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError('ONNX embedding backends need: pip install "optimum[onnxruntime]"') from e
+    options = onnxruntime.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    kwargs = {"provider": "CPUExecutionProvider", "session_options": options}
+    if file_name:
+        kwargs["file_name"] = file_name
+    return kwargs
+
+def load_embedder(name, backend=None, threads=None):
+    """SentenceTransformer for name on the requested backend; encode() is the same for all"""
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or _settings["backend"]
+    threads = threads or _settings["threads"]
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)  # process-wide
+        return SentenceTransformer(name, device="cpu")
+    if backend == "onnx":
+        return SentenceTransformer(name, device="cpu", backend="onnx", model_kwargs=_onnx_kwargs(threads))
+    if backend == "int8":
+        file_name = os.getenv("COFFEE_EMBED_INT8_FILE", DEFAULT_INT8_FILE)
+        return SentenceTransformer(
+            name, device="cpu", backend="onnx", model_kwargs=_onnx_kwargs(threads, file_name)
+        )
+    raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {BACKENDS}")
+
+
+# ---- Parity ----
+def _corpus(store):
+    df = store.frame(text_cols=("text",))
+    df["text"] = df["text"].fillna("")
+    return df
+
+def check_parity(backend, threads=None, reference="torch", batch_size=64, store=None):
+    """KMeans assignments of the stored corpus under backend vs the reference backend"""
+    from datastore import get_store
+    from ingest import cluster_features
+    from registry import ARTIFACTS, registry
+
+    store = get_store() if store is None else store
+    df = _corpus(store)
+    texts = df["text"].tolist()
+    name = ARTIFACTS["sbert"][1]
+    ohe_cols, scaler, kmeans = registry.get("ohe_cols"), registry.get("scaler_cluster"), registry.get("kmeans")
+
+    def assign(backend):
+        emb = load_embedder(name, backend, threads).encode(texts, batch_size=batch_size)
+        return emb, kmeans.predict(cluster_features(df, emb, ohe_cols, scaler)).astype(int)
+
+    ref_emb, ref_labels = assign(reference)
+    emb, labels = assign(backend)
+    cos = np.sum(ref_emb * emb, axis=1) / (
+        np.linalg.norm(ref_emb, axis=1) * np.linalg.norm(emb, axis=1)
+    )
+    changed = np.flatnonzero(labels != ref_labels)
+    return {
+        "backend": backend,
+        "reference": reference,
+        "rows": len(texts),
+        "changed": len(changed),
+        "changed_rows": changed[:20].tolist(),
+        "agree_with_stored": float(np.mean(labels == np.asarray(store.cluster_labels))),
+        "min_cosine": float(cos.min()),
+        "mean_cosine": float(cos.mean()),
+    }
+
+
+# ---- Benchmark ----
+def _rss_mb():
+    import psutil
+    return psutil.Process(os.getpid()).memory_info().rss / 1e6
+
+def _bench_one(backend, threads, texts, n_single, batch_size):
+    # Runs in a fresh process so RSS reflects this backend alone
+    from bench import summarize
+    from registry import ARTIFACTS
+
+    rss_start = _rss_mb()
+    start = time.perf_counter()
+    model = load_embedder(ARTIFACTS["sbert"][1], backend, threads)
+    load_s = time.perf_counter() - start
+    rss_loaded = _rss_mb()
+
+    model.encode(texts[:2])
+    latencies = []
+    for text in texts[:n_single]:
+        start = time.perf_counter()
+        model.encode([text])
+        latencies.append(time.perf_counter() - start)
+    single = summarize(latencies)
+
+    start = time.perf_counter()
+    model.encode(texts, batch_size=batch_size)
+    batch_s = time.perf_counter() - start
+    return {
+        "backend": backend,
+        "threads": threads,
+        "load_s": load_s,
+        "rss_model_mb": rss_loaded - rss_start,
+        "rss_peak_mb": _rss_mb(),
+        "single_p50_ms": single["p50_ms"],
+        "single_p99_ms": single["p99_ms"],
+        "batch_items_per_s": len(texts) / batch_s,
+    }
+
+def benchmark(backends=BACKENDS, threads=(None,), n_single=100, n_batch=512, batch_size=64):
+    from datastore import get_store
+
+    texts = [t for t in _corpus(get_store())["text"] if t][:max(n_single, n_batch)]
+    results = []
+    for backend in backends:
+        for n_threads in threads:
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                results.append(pool.submit(
+                    _bench_one, backend, n_threads, texts[:n_batch], n_single, batch_size
+                ).result())
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding backend parity and benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    parity = sub.add_parser("parity", help="compare KMeans assignments on the stored corpus")
+    parity.add_argument("--backend", choices=BACKENDS, required=True)
+    parity.add_argument("--reference", choices=BACKENDS, default="torch")
+    parity.add_argument("--threads", type=int, default=None)
+    parity.add_argument("--max-changed", type=int, default=0, help="allowed reassigned rows")
+    bench = sub.add_parser("bench", help="latency and memory per backend")
+    bench.add_argument("--backends", default=",".join(BACKENDS))
+    bench.add_argument("--threads", default="0", help="comma-separated; 0 = library default")
+    bench.add_argument("--n-single", type=int, default=100)
+    bench.add_argument("--n-batch", type=int, default=512)
+    bench.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.command == "parity":
+        result = check_parity(args.backend, args.threads, args.reference)
+        print(f"{result['backend']} vs {result['reference']}: {result['changed']} / {result['rows']} rows "
+              f"change cluster; cosine min {result['min_cosine']:.4f} mean {result['mean_cosine']:.4f}; "
+              f"{result['agree_with_stored'] * 100:.1f}% agree with stored labels")
+        if result["changed"]:
+            print(f"first changed rows: {result['changed_rows']}")
+        sys.exit(1 if result["changed"] > args.max_changed else 0)
+
+    results = benchmark(
+        backends=args.backends.split(","),
+        threads=tuple(int(t) or None for t in args.threads.split(",")),
+        n_single=args.n_single,
+        n_batch=args.n_batch,
+        batch_size=args.batch_size,
+    )
+    for row in results:
+        print(f"{row['backend']:<6} threads {row['threads'] or 'default':>7}  load {row['load_s']:6.2f}s  "
+              f"model {row['rss_model_mb']:7.1f} MB  peak {row['rss_peak_mb']:7.1f} MB  "
+              f"single p50 {row['single_p50_ms']:7.2f} ms  p99 {row['single_p99_ms']:7.2f} ms  "
+              f"batch {row['batch_items_per_s']:8.1f} items/s")
@@ -0,0 +1,252 @@
+"""Feature builders shared by single predictions, batch scoring and ingest.
+
+    python features.py check    # compare the rating matrix against the original per-row encoder
+
+CategoricalEncoder is compiled once from a one-hot column list (rf_cat_cols /
+kmeans_ohe_cols, named like pd.get_dummies: roast_<value>, loc_country_<value>)
+into {value: column} dicts, and folds the StandardScaler into one multiply-add.
+Unseen categories get no column and are logged once per value.
+
+The cluster encoders it replaced compared raw values against these prefixed
+names, so their one-hot block was always zero; cluster assignments of new
+rows change accordingly.
+
+RatingFeaturizer writes TF-IDF, one-hot and price entries straight into
+preallocated CSR arrays, with no dense one-hot block and no hstack round trip
+through COO.
+"""
+import argparse
+import logging
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+import metrics
+from metrics import stage
+from registry import registry
+
+logger = logging.getLogger("coffee.features")
+
+# One-hot column prefix -> request field, as produced by pd.get_dummies(df[["loc_country", "roast"]])
+PREFIXES = {"roast": "roast_", "loc": "loc_country_"}
+# Unseen values remembered (least recently seen dropped first) so each is logged once, not per request
+MAX_LOGGED_UNSEEN = 1024
+
+
+class CategoricalEncoder:
+    """(roast, loc) -> one-hot column indices, plus the fused (price, rating) scaler"""
+
+    def __init__(self, cols, scaler=None, name="one-hot"):
+        self.cols = cols
+        self.name = name
+        self.n_cols = len(cols)
+        self.index = {field: {} for field in PREFIXES}
+        for i, col in enumerate(cols):
+            for field, prefix in PREFIXES.items():
+                if col.startswith(prefix):
+                    self.index[field][col[len(prefix):]] = i
+        self.scaler = scaler
+        if scaler is not None:
+            # StandardScaler.transform as x * coef + offset
+            mean = scaler.mean_ if scaler.with_mean else 0.0
+            std = scaler.scale_ if scaler.with_std else 1.0
+            self.coef = 1.0 / np.asarray(std, dtype=np.float64)
+            self.offset = -np.asarray(mean, dtype=np.float64) * self.coef
+        self._logged = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, field, values):
+        """Column index per value, -1 for categories the models never saw"""
+        index = self.index[field]
+        pos = np.fromiter((index.get(v, -1) for v in values), dtype=np.int64)
+        if (pos < 0).any():
+            self._log_unseen(field, [v for v, p in zip(values, pos) if p < 0])
+        return pos
+
+    def _log_unseen(self, field, values):
+        metrics.count(f"unseen_{field}", len(values))
+        new = set()
+        with self._lock:
+            for v in values:
+                key = (field, v)
+                if key in self._logged:
+                    self._logged.move_to_end(key)
+                    continue
+                new.add(v)
+                self._logged[key] = None
+                if len(self._logged) > MAX_LOGGED_UNSEEN:
+                    self._logged.popitem(last=False)
+        for value in sorted(new, key=str):
+            logger.warning("unseen %s %r in %s columns: encoded as all zeros", field, value, self.name)
+
+    def onehot(self, roasts, locs, out=None):
+        """Dense (n, n_cols) one-hot block; written into out when given"""
+        n = len(roasts)
+        out = np.zeros((n, self.n_cols)) if out is None else out
+        rows = np.arange(n)
+        for pos in (self.lookup("roast", roasts), self.lookup("loc", locs)):
+            hit = pos >= 0
+            out[rows[hit], pos[hit]] = 1.0
+        return out
+
+    def scale(self, nums, out=None):
+        """Scaled (n, 2) block of [price, rating]"""
+        out = np.multiply(nums, self.coef, out=out)
+        out += self.offset
+        return out
+
+    def cluster_matrix(self, emb, roasts, locs, prices, ratings):
+        """[embedding | one-hot | scaled price, rating], the KMeans / PCA input"""
+        emb = np.asarray(emb)
+        n, d = emb.shape
+        X = np.zeros((n, d + self.n_cols + 2))
+        X[:, :d] = emb
+        self.onehot(roasts, locs, out=X[:, d:d + self.n_cols])
+        nums = np.column_stack([np.asarray(prices, dtype=np.float64), np.asarray(ratings, dtype=np.float64)])
+        self.scale(nums, out=X[:, d + self.n_cols:])
+        return X
+
+
+class RatingFeaturizer:
+    """Same columns as the training matrix: [tfidf..., rf_cat_cols..., price]"""
+
+    def __init__(self, tfidf, rating_ohe_cols):
+        self.tfidf = tfidf
+        self.cols = rating_ohe_cols
+        self.encoder = CategoricalEncoder(rating_ohe_cols, name="rating")
+        self.n_text = len(tfidf.vocabulary_)
+        self.price_col = self.n_text + len(rating_ohe_cols)
+        self.n_features = self.price_col + 1
+
+    def _lookup(self, field, values):
+        pos = self.encoder.lookup(field, values)
+        return np.where(pos >= 0, pos + self.n_text, -1)
+
+    def transform(self, texts, roasts, locs, prices):
+        with stage("tfidf"):
+            T = self.tfidf.transform(texts).tocsr()
+        T.sort_indices()
+        n = T.shape[0]
+        prices = np.asarray(prices, dtype=np.float64).reshape(-1)
+
+        # Up to three extra entries per row, all to the right of the text block.
+        # Missing ones sort last, so present indices stay ascending within the row
+        missing = np.iinfo(np.int64).max
+        extra = np.column_stack([
+            self._lookup("roast", roasts),
+            self._lookup("loc", locs),
+            np.where(prices != 0, self.price_col, -1),  # hstack drops explicit zeros too
+        ])
+        extra = np.sort(np.where(extra < 0, missing, extra), axis=1)
+        has = extra != missing
+        n_extra = has.sum(axis=1)
+
+        text_len = np.diff(T.indptr)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(text_len + n_extra, out=indptr[1:])
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        data = np.empty(indptr[-1], dtype=np.float64)
+
+        # Text entries shift right by the extras of earlier rows
+        shift = np.repeat(indptr[:-1] - T.indptr[:-1], text_len)
+        dest = np.arange(T.nnz) + shift
+        indices[dest] = T.indices
+        data[dest] = T.data
+
+        rows, slots = np.nonzero(has)
+        dest = indptr[rows] + text_len[rows] + slots
+        cols = extra[rows, slots]
+        indices[dest] = cols
+        data[dest] = np.where(cols == self.price_col, prices[rows], 1.0)
+        return csr_matrix((data, indices, indptr), shape=(n, self.n_features))
+
+
+_featurizer = None
+_cluster_encoder = None
+_build_lock = threading.Lock()
+
+def get_rating_featurizer():
+    """Featurizer for the currently loaded tfidf / rf_cat_cols (rebuilt after registry.invalidate)"""
+    global _featurizer
+    tfidf, cols = registry.get("tfidf"), registry.get("rating_ohe_cols")
+    featurizer = _featurizer
+    if featurizer is None or featurizer.tfidf is not tfidf or featurizer.cols is not cols:
+        with _build_lock:
+            featurizer = _featurizer = RatingFeaturizer(tfidf, cols)
+    return featurizer
+
+def get_cluster_encoder():
+    """Encoder for the currently loaded kmeans_ohe_cols / scaler"""
+    global _cluster_encoder
+    cols, scaler = registry.get("ohe_cols"), registry.get("scaler_cluster")
+    encoder = _cluster_encoder
+    if encoder is None or encoder.cols is not cols or encoder.scaler is not scaler:
+        with _build_lock:
+            encoder = _cluster_encoder = CategoricalEncoder(cols, scaler, name="cluster")
+    return encoder
+
+
+# ---- Parity ----
+def _reference_row(text, roast, loc, price):
+    # The original per-row encoder: dense one-hot loop + hstack
+    from scipy.sparse import hstack
+
+    rating_ohe_cols = registry.get("rating_ohe_cols")
+    text_vec = registry.get("tfidf").transform([text])
+    ohe = np.zeros(len(rating_ohe_cols))
+    for i, col in enumerate(rating_ohe_cols):
+        if col == f"roast_{roast}" or col == f"loc_country_{loc}":
+            ohe[i] = 1
+    return hstack([text_vec, ohe.reshape(1, -1), csr_matrix([[price]])]).tocsr()
+
+def check_parity(n_rows=None):
+    """Mismatches of the rating featurizer (single and batch) and the cluster encoder"""
+    import pandas as pd
+    from scipy.sparse import vstack
+
+    from datastore import SOURCE_CSV
+
+    df = pd.read_csv(SOURCE_CSV, nrows=n_rows)
+    df["text"] = df["text"].fillna("")
+    # Unknown categories and a zero price exercise the missing-entry paths
+    df.loc[df.index[:3], "roast"] = "Unknown Roast"
+    df.loc[df.index[3:6], "loc_country"] = "Atlantis"
+    df.loc[df.index[6:9], "100g_USD"] = 0.0
+    args = (df["text"].tolist(), df["roast"].tolist(), df["loc_country"].tolist(), df["100g_USD"].to_numpy())
+
+    expected = vstack([_reference_row(*row) for row in zip(*args)]).tocsr()
+    featurizer = get_rating_featurizer()
+    batch = featurizer.transform(*args)
+    single = vstack([featurizer.transform([t], [r], [l], [p]) for t, r, l, p in zip(*args)]).tocsr()
+
+    # Cluster block (everything after the embedding) against the notebook's get_dummies + scaler
+    cat = pd.get_dummies(df[["loc_country", "roast"]], dtype=float).reindex(columns=registry.get("ohe_cols"), fill_value=0)
+    nums = registry.get("scaler_cluster").transform(df[["100g_USD", "rating"]].astype(float))
+    expected_cluster = np.hstack([cat.to_numpy(), nums])
+    cluster = get_cluster_encoder().cluster_matrix(np.zeros((len(df), 0)), *args[1:3], df["100g_USD"], df["rating"])
+    return {
+        "rows": len(df),
+        "shape_ok": batch.shape == expected.shape,
+        "batch_mismatches": int((abs(batch - expected) > 0).sum()),
+        "single_mismatches": int((abs(single - expected) > 0).sum()),
+        "cluster_max_abs_diff": float(np.abs(cluster - expected_cluster).max()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Feature builder parity check")
+    parser.add_argument("command", choices=["check"])
+    parser.add_argument("--rows", type=int, default=None)
+    parser.add_argument("--tolerance", type=float, default=1e-12, help="for the fused scaler")
+    args = parser.parse_args()
+
+    result = check_parity(args.rows)
+    print(f"{result['rows']} rows: rating shape ok {result['shape_ok']}, "
+          f"batch mismatches {result['batch_mismatches']}, single mismatches {result['single_mismatches']}; "
+          f"cluster max |diff| {result['cluster_max_abs_diff']:.3g}")
+    ok = result["shape_ok"] and not result["batch_mismatches"] and not result["single_mismatches"] \
+        and result["cluster_max_abs_diff"] <= args.tolerance
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import metrics
+from aggregates import get_aggregates
+from datastore import get_store
+from utils import CLUSTER_NAMES, add_user_point, build_pca_base_figure
+
+FIGURE_DIR = "data/figures"
+# Bump when the figure code changes so stale JSON on disk is ignored
+FIGURE_VERSION = 1
+
+
+def build_cluster_map(df_country_cluster, cluster_id):
+    import plotly.express as px
+
+    fig_cluster_map = px.choropleth(
+        df_country_cluster,
+        locations="loc_country",
+        locationmode="country names",
+        color="count",
+        hover_name="loc_country",
+        hover_data={
+            "count": True,
+            "avg_rating": ":.2f",
+            "avg_price": ":.2f",
+        },
+        color_continuous_scale="YlOrRd",
+        title=f"{CLUSTER_NAMES[cluster_id]} — Global Distribution",
+    )
+
+    fig_cluster_map.update_traces(
+        marker_line_width=0.2,
+        marker_line_color="black"
+    )
+    fig_cluster_map.update_geos(
+        showcoastlines=True,
+        coastlinecolor="black",
+        coastlinewidth=0.3,
+        showcountries=True,
+        countrycolor="black",
+        countrywidth=0.2,
+        showland=True,
+        landcolor="white",
+        showlakes=False,
+        showframe=False,
+    )
+
+    fig_cluster_map.update_layout(
+        margin=dict(l=0, r=0, t=40, b=0),
+        coloraxis_colorbar=dict(
+            title="Count",
+            thickness=12,
+            len=0.4,
+            bgcolor="rgba(255,255,255,0.7)"
+        )
+    )
+    return fig_cluster_map
+
+
+class FigureCache:
+    """Serialized figure JSON per dataset version, in memory and on disk"""
+
+    def __init__(self, figure_dir=FIGURE_DIR):
+        self.figure_dir = figure_dir
+        self._json = {}
+        self._specs = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _dir(self, version):
+        digest = hashlib.sha1(json.dumps([FIGURE_VERSION, version]).encode()).hexdigest()[:16]
+        return os.path.join(self.figure_dir, digest)
+
+    def _prune(self, version):
+        # Figure sets of other dataset versions (e.g. before an ingest) are never read again
+        keep = os.path.basename(self._dir(version))
+        try:
+            names = os.listdir(self.figure_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.figure_dir, name)
+            if name != keep and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def get_json(self, store, name, build):
+        """Figure JSON for name, building it with build(store) at most once per version"""
+        with self._lock:
+            if self._version != store.version:
+                self._json = {}
+                self._specs = {}
+                self._version = store.version
+                self._prune(store.version)
+            cached = self._json.get(name)
+        if cached is not None:
+            metrics.count("figure_cache_hit")
+            return cached
+
+        path = os.path.join(self._dir(store.version), f"{name}.json")
+        if os.path.exists(path):
+            metrics.count("figure_cache_disk")
+            with open(path, "r") as f:
+                fig_json = f.read()
+        else:
+            metrics.count("figure_cache_miss")
+            with metrics.stage("figure_build"):
+                fig = build(store)
+            fig_json = None if fig is None else fig.to_json()
+            if fig_json is not None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(fig_json)
+                os.replace(tmp_path, path)
+        if fig_json is not None:
+            metrics.observe_size(f"figure_{name}", len(fig_json))
+        with self._lock:
+            if self._version == store.version and fig_json is not None:
+                self._json[name] = fig_json
+        return fig_json
+
+    def get_spec(self, store, name, build):
+        """Figure dict for name, parsed from the cached JSON once per version"""
+        with self._lock:
+            if self._version == store.version and name in self._specs:
+                return self._specs[name]
+        fig_json = self.get_json(store, name, build)
+        spec = None if fig_json is None else json.loads(fig_json)
+        with self._lock:
+            if self._version == store.version:
+                self._specs[name] = spec
+        return spec
+
+
+figure_cache = FigureCache()
+
+def _from_spec(spec):
+    import plotly.graph_objects as go
+
+    # The spec came out of fig.to_json(), so it is already valid; re-validating every
+    # property (pio.from_json, go.Figure(dict)) costs ~18 ms per rerun for the PCA scatter.
+    # The dict is not modified by later add_trace / update_layout calls on the figure
+    return go.Figure(spec, _validate=False)
+
+def _build_pca(store):
+    return build_pca_base_figure(store.pca_data, store.cluster_labels, store.frame(), CLUSTER_NAMES)
+
+def get_pca_figure(user_xy=None, store=None):
+    """PCA scatter from the cached base figure, plus the "Your Coffee" marker"""
+    store = get_store() if store is None else store
+    spec = figure_cache.get_spec(store, "pca", _build_pca)
+    with metrics.stage("plot"):
+        fig = _from_spec(spec)
+        if user_xy is not None:
+            add_user_point(fig, user_xy)
+    return fig
+
+def get_cluster_map(cluster_id, store=None):
+    """Cached choropleth for one cluster, or None if the cluster has no rows"""
+    store = get_store() if store is None else store
+
+    def build(store):
+        stats = get_aggregates(store).country(cluster_id)
+        return build_cluster_map(stats, cluster_id) if len(stats) else None
+
+    spec = figure_cache.get_spec(store, f"cluster_map_{cluster_id}", build)
+    return None if spec is None else _from_spec(spec)
+
+def warm_figures(store=None):
+    store = get_store() if store is None else store
+    get_pca_figure(store=store)
+    for cluster_id in CLUSTER_NAMES:
+        get_cluster_map(cluster_id, store)
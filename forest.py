@@ -0,0 +1,224 @@
+"""RandomForest rating model compiled to flat node arrays.
+
+    python forest.py export     # models/rf_rating.pkl -> models/rf_compiled/
+    python forest.py check      # compare against rf_model.predict on the corpus
+
+Every tree is concatenated into one set of .npy arrays (feature, threshold,
+children, value) that np.load memory-maps, so worker processes share the pages
+instead of each unpickling the forest. predict() advances all (row, tree)
+pairs one level per step with numpy gathers. Leaves point back at themselves,
+so pairs that finished early just stay put; every few steps those are
+dropped, keeping the work close to the total path length rather than
+rows x trees x depth. Only the columns the forest actually splits on are
+densified.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import issparse
+
+RF_PATH = "models/rf_rating.pkl"
+COMPILED_DIR = "models/rf_compiled"
+ARRAYS = ("feature", "threshold", "children", "is_leaf", "value", "roots", "used_features")
+# Rows densified per traversal step in predict(); bounds memory on big batches
+CHUNK_ROWS = 1024
+# Levels advanced between drops of finished (row, tree) pairs
+COMPACT_EVERY = 4
+
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def export_forest(rf, out_dir=COMPILED_DIR, source=RF_PATH):
+    """Write rf (a fitted RandomForestRegressor) as flat arrays under out_dir"""
+    trees = [est.tree_ for est in rf.estimators_]
+    if any(tree.n_outputs != 1 for tree in trees):
+        raise ValueError("only single-output regression forests can be compiled")
+
+    sizes = np.array([tree.node_count for tree in trees])
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+    used_features = np.unique(np.concatenate([tree.feature[tree.feature >= 0] for tree in trees]))
+    if len(used_features) == 0:
+        used_features = np.array([0])
+    remap = np.zeros(rf.n_features_in_, dtype=np.int32)
+    remap[used_features] = np.arange(len(used_features), dtype=np.int32)
+
+    feature, threshold, children, is_leaf, value = [], [], [], [], []
+    for root, tree in zip(roots, trees):
+        leaf = tree.children_left == -1
+        nodes = np.arange(tree.node_count) + root
+        # Children are global node ids (column 0 left, 1 right); leaves loop on themselves
+        feature.append(np.where(leaf, 0, remap[np.maximum(tree.feature, 0)]))
+        threshold.append(np.where(leaf, np.inf, tree.threshold))
+        children.append(np.where(leaf[:, None], nodes[:, None], np.column_stack(
+            [tree.children_left + root, tree.children_right + root]
+        )))
+        is_leaf.append(leaf)
+        value.append(tree.value[:, 0, 0])
+
+    arrays = {
+        "feature": np.concatenate(feature).astype(np.int32),
+        "threshold": np.concatenate(threshold).astype(np.float64),
+        "children": np.concatenate(children).astype(np.int32),
+        "is_leaf": np.concatenate(is_leaf),
+        "value": np.concatenate(value).astype(np.float64),
+        "roots": roots,
+        "used_features": used_features.astype(np.int32),
+    }
+    meta = {
+        "n_trees": len(trees),
+        "n_nodes": int(sizes.sum()),
+        "n_features": int(rf.n_features_in_),
+        "max_depth": int(max(tree.max_depth for tree in trees)),
+        "source": source,
+        "source_stamp": _source_stamp(source) if os.path.exists(source) else None,
+    }
+
+    tmp_dir = out_dir + ".tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(arr))
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    return meta
+
+
+class CompiledForest:
+    """predict() compatible stand-in for the RandomForestRegressor"""
+
+    def __init__(self, arrays, meta):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.meta = meta
+        self.n_trees = meta["n_trees"]
+        self.max_depth = meta["max_depth"]
+        self.n_features_in_ = meta["n_features"]
+
+    @classmethod
+    def load(cls, path=COMPILED_DIR, mmap=True):
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        # Plain ndarray views of the maps: np.memmap subclass overhead shows up on every gather
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode).view(np.ndarray)
+            for name in ARRAYS
+        }
+        return cls(arrays, meta)
+
+    def _dense(self, X):
+        # sklearn compares float32 features against float64 thresholds; do the same
+        X = X.tocsr()[:, self.used_features] if issparse(X) else np.asarray(X)[:, self.used_features]
+        X = np.asarray(X.toarray() if issparse(X) else X, dtype=np.float32)
+        # A NaN compares False against every threshold and would quietly go left
+        if not np.isfinite(X).all():
+            raise ValueError("Input X contains NaN or infinity")
+        return X
+
+    def _predict_dense(self, Xd):
+        n, n_cols = Xd.shape
+        flat = np.ascontiguousarray(Xd).ravel()
+        nodes = np.tile(self.roots, n)  # (row, tree) pairs, row-major
+        pos = np.arange(nodes.size)
+        offsets = (pos // self.n_trees) * n_cols
+        leaves = np.empty_like(nodes)
+        while len(nodes):
+            for _ in range(COMPACT_EVERY):
+                go_right = flat[offsets + self.feature[nodes]] > self.threshold[nodes]
+                nodes = self.children[nodes, go_right.view(np.int8)]
+            done = self.is_leaf[nodes]
+            leaves[pos[done]] = nodes[done]
+            active = ~done
+            pos, offsets, nodes = pos[active], offsets[active], nodes[active]
+        # Summed per row in tree order, like RandomForestRegressor.predict
+        return self.value[leaves].reshape(n, self.n_trees).sum(axis=1) / self.n_trees
+
+    def predict(self, X):
+        """Batch prediction; X is the (sparse or dense) rating feature matrix"""
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[1]} features, the forest expects {self.n_features_in_}")
+        if issparse(X):
+            X = X.tocsr()
+        out = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], CHUNK_ROWS):
+            out[start:start + CHUNK_ROWS] = self._predict_dense(self._dense(X[start:start + CHUNK_ROWS]))
+        return out
+
+    def predict_one(self, X):
+        """Single-row prediction as a float"""
+        X = X.tocsr() if issparse(X) else np.asarray(X)
+        return float(self._predict_dense(self._dense(X[:1]))[0])
+
+
+def load_rating_model(path=COMPILED_DIR, source=RF_PATH):
+    """The compiled forest when it is exported and current, else the pickled RandomForest"""
+    import joblib
+
+    try:
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = None
+    if meta is not None and os.path.exists(source) and meta["source_stamp"] == _source_stamp(source):
+        return CompiledForest.load(path)
+    return joblib.load(source)
+
+
+# ---- Parity ----
+def check_parity(compiled=None, rf=None, n_rows=None):
+    """Max |compiled - rf_model.predict| over the corpus rating features"""
+    import pandas as pd
+
+    from datastore import SOURCE_CSV
+    from registry import registry
+    from utils import encode_for_rating, encode_for_rating_batch
+
+    compiled = CompiledForest.load() if compiled is None else compiled
+    rf = registry.get("rf_model") if rf is None else rf
+    df = pd.read_csv(SOURCE_CSV, nrows=n_rows)
+    df["text"] = df["text"].fillna("")
+    X = encode_for_rating_batch(df["text"].tolist(), df["roast"].tolist(),
+                                df["loc_country"].tolist(), df["100g_USD"].to_numpy())
+    expected = rf.predict(X)
+    batch_diff = np.abs(compiled.predict(X) - expected)
+    single = [
+        compiled.predict_one(encode_for_rating(t, r, l, p))
+        for t, r, l, p in zip(df["text"][:100], df["roast"][:100], df["loc_country"][:100], df["100g_USD"][:100])
+    ]
+    return {
+        "rows": len(df),
+        "max_abs_diff": float(batch_diff.max()),
+        "max_abs_diff_single": float(np.max(np.abs(np.array(single) - expected[:len(single)]))),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the rating RandomForest to flat arrays")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="write models/rf_compiled/ from models/rf_rating.pkl")
+    export.add_argument("--out", default=COMPILED_DIR)
+    check = sub.add_parser("check", help="compare against rf_model.predict on the corpus")
+    check.add_argument("--tolerance", type=float, default=1e-9)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        import joblib
+
+        start = time.perf_counter()
+        meta = export_forest(joblib.load(RF_PATH), args.out)
+        print(f"Compiled {meta['n_trees']} trees / {meta['n_nodes']} nodes (max depth {meta['max_depth']}) "
+              f"in {time.perf_counter() - start:.2f}s")
+    else:
+        result = check_parity()
+        print(f"{result['rows']} rows: max |diff| batch {result['max_abs_diff']:.3g}, "
+              f"single {result['max_abs_diff_single']:.3g}")
+        sys.exit(0 if max(result["max_abs_diff"], result["max_abs_diff_single"]) <= args.tolerance else 1)
@@ -0,0 +1,241 @@
+"""Per-session prediction history with bounded memory and optional SQLite persistence.
+
+Configured through the environment:
+COFFEE_HISTORY_MAX (entries kept in memory per session, default 500),
+COFFEE_HISTORY_PATH (SQLite file; default "" keeps history in memory only),
+COFFEE_HISTORY_MAX_STORED (entries kept on disk per session, default 10000).
+
+With a database the app keys each session's history on an id in the page URL
+(?history=<id>), so reloading that URL after a restart brings it back, e.g.
+
+    COFFEE_HISTORY_PATH=data/history.sqlite streamlit run app.py
+
+Newest entries live in a ring buffer; pages beyond it and CSV exports are
+read from SQLite in batches. iter_csv() streams the export, but the app's
+download button needs the whole file in memory (see csv_file).
+"""
+import csv
+import io
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+FIELDS = ("name", "roast", "loc", "price", "rating", "cluster", "created")
+EXPORT_BATCH = 500
+
+
+class HistoryDB:
+    """SQLite table of history entries shared by every session in the process"""
+
+    def __init__(self, path, max_stored=None):
+        self.path = path
+        self.max_stored = max_stored
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session TEXT NOT NULL, "
+            "name TEXT, roast TEXT, loc TEXT, price REAL, rating REAL, cluster TEXT, created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS history_session ON history (session, id)")
+        self._conn.commit()
+
+    def append(self, session, entry):
+        """Stores entry; returns its id and the id of the session's previous newest entry (0 if none)"""
+        with self._lock:
+            prev_id = self._conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM history WHERE session = ?", (session,)
+            ).fetchone()[0]
+            new_id = self._conn.execute(
+                f"INSERT INTO history (session, {', '.join(FIELDS)}) VALUES (?{', ?' * len(FIELDS)})",
+                (session, *(entry[f] for f in FIELDS)),
+            ).lastrowid
+            if self.max_stored is not None:
+                self._conn.execute(
+                    "DELETE FROM history WHERE session = ? AND id IN ("
+                    "SELECT id FROM history WHERE session = ? ORDER BY id DESC LIMIT -1 OFFSET ?)",
+                    (session, session, self.max_stored),
+                )
+            self._conn.commit()
+        return new_id, prev_id
+
+    def count(self, session):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM history WHERE session = ?", (session,)).fetchone()[0]
+
+    def state(self, session):
+        """(entry count, newest id): changes whenever any tab appends to or clears the session"""
+        with self._lock:
+            return tuple(self._conn.execute(
+                "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM history WHERE session = ?", (session,)
+            ).fetchone())
+
+    def newest(self, session, limit, offset=0):
+        """Up to limit entries, newest first, skipping the offset newest"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(FIELDS)} FROM history WHERE session = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                (session, limit, offset),
+            ).fetchall()
+        return [dict(zip(FIELDS, row)) for row in rows]
+
+    def iter_oldest_first(self, session, batch=EXPORT_BATCH):
+        """Batches of rows (tuples in FIELDS order), oldest first"""
+        last_id = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT id, {', '.join(FIELDS)} FROM history WHERE session = ? AND id > ? ORDER BY id LIMIT ?",
+                    (session, last_id, batch),
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [row[1:] for row in rows]
+
+    def clear(self, session):
+        with self._lock:
+            self._conn.execute("DELETE FROM history WHERE session = ?", (session,))
+            self._conn.commit()
+
+
+class HistoryStore:
+    """One session's history: newest entries in a ring buffer, the rest (if any) in HistoryDB.
+
+    Several browser tabs can share one persisted session, so with a database the
+    ring and count are re-read whenever its state differs from what this store last saw.
+    """
+
+    def __init__(self, capacity=500, db=None, session=None):
+        if db is not None and session is None:
+            raise ValueError("a session id is needed to persist history")
+        self.capacity = capacity
+        self.db = db
+        self.session = session
+        self._ring = deque(maxlen=capacity)
+        self._count = 0
+        self._changes = 0
+        self._state = None
+        self._sync()
+
+    def _sync(self):
+        # Reload the ring when the database changed behind this store's back
+        if self.db is None:
+            return
+        state = self.db.state(self.session)
+        if state != self._state:
+            self._ring.clear()
+            self._ring.extend(reversed(self.db.newest(self.session, self.capacity)))
+            self._count, self._state = state[0], state
+
+    @property
+    def version(self):
+        """Changes whenever the history does, e.g. to key a cached export"""
+        if self.db is None:
+            return self._changes
+        self._sync()
+        return self._state
+
+    def append(self, entry):
+        entry = {f: entry.get(f) for f in FIELDS}
+        if entry["created"] is None:
+            entry["created"] = time.time()
+        self._changes += 1
+        if self.db is None:
+            self._ring.append(entry)
+            self._count = len(self._ring)
+            return
+        new_id, prev_id = self.db.append(self.session, entry)
+        if self._state is None or self._state[1] != prev_id:
+            self._state = None  # another tab wrote in between; reload on next read
+            return
+        self._ring.append(entry)
+        self._count += 1
+        if self.db.max_stored is not None:
+            self._count = min(self._count, self.db.max_stored)
+        self._state = (self._count, new_id)
+
+    def __len__(self):
+        self._sync()
+        return self._count
+
+    def page(self, page, per_page):
+        """Entries of one page, newest first (page 0 is the most recent)"""
+        self._sync()
+        start = page * per_page
+        stop = min(start + per_page, self._count)
+        if start >= stop:
+            return []
+        if stop <= len(self._ring):
+            ring = self._ring
+            return [ring[-1 - i] for i in range(start, stop)]
+        return self.db.newest(self.session, stop - start, start)
+
+    def iter_rows(self, batch=EXPORT_BATCH):
+        """Batches of rows in FIELDS order, oldest first"""
+        if self.db is not None:
+            yield from self.db.iter_oldest_first(self.session, batch)
+            return
+        rows = [tuple(e[f] for f in FIELDS) for e in self._ring]
+        for start in range(0, len(rows), batch):
+            yield rows[start:start + batch]
+
+    def iter_csv(self, batch=EXPORT_BATCH):
+        """CSV text in chunks: the header, then one chunk per batch of rows"""
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(FIELDS)
+        for rows in self.iter_rows(batch):
+            writer.writerows(rows)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+
+    def csv_file(self):
+        """The whole CSV export in one rewound BytesIO, for st.download_button.
+
+        Not memory-bounded: the download button only takes complete data, so the
+        export is held in full, up to COFFEE_HISTORY_MAX_STORED rows. Callers that
+        can stream (e.g. an HTTP handler) should write iter_csv() chunks instead.
+        """
+        f = io.BytesIO()
+        for chunk in self.iter_csv():
+            f.write(chunk.encode("utf-8"))
+        f.seek(0)
+        return f
+
+    def clear(self):
+        self._ring.clear()
+        self._count = 0
+        self._changes += 1
+        if self.db is not None:
+            self.db.clear(self.session)
+            self._state = None
+
+
+_db = None
+_db_lock = threading.Lock()
+
+def get_history_db():
+    """Process-wide history database, or None when COFFEE_HISTORY_PATH is empty"""
+    global _db
+    path = os.getenv("COFFEE_HISTORY_PATH", "")
+    if not path:
+        return None
+    if _db is None or _db.path != path:
+        with _db_lock:
+            if _db is None or _db.path != path:
+                max_stored = int(os.getenv("COFFEE_HISTORY_MAX_STORED", "10000"))
+                _db = HistoryDB(path, max_stored=max_stored if max_stored > 0 else None)
+    return _db
+
+def new_history(session=None):
+    """HistoryStore for one session, persisted when a database is configured"""
+    capacity = int(os.getenv("COFFEE_HISTORY_MAX", "500"))
+    db = get_history_db()
+    return HistoryStore(capacity, db, session if db is not None else None)
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from aggregates import AGG_DIR, update_aggregates
+from datastore import (LABELS_PATH, PCA_PATH, SOURCE_CSV, STORE_DIR, append_npy, append_rows, get_store,
+                       store_lock)
+from features import CategoricalEncoder
+from registry import registry
+from similarity import EMBEDDINGS_PATH, append_corpus_embeddings, build_corpus_embeddings
+from utils import build_text, predict_rating_batch
+
+REFIT_STATE = "models/refit_state.json"
+N_CLUSTERS = 6
+
+
+def cluster_features(df, emb, ohe_cols, scaler):
+    # Same columns as the notebook's get_dummies + scaled (price, rating), via the shared encoder
+    return CategoricalEncoder(ohe_cols, scaler, name="cluster").cluster_matrix(
+        emb, df["roast"].tolist(), df["loc_country"].tolist(), df["100g_USD"], df["rating"]
+    )
+
+def _prepare(new_rows):
+    df = new_rows.copy()
+    if "text" not in df:
+        df["text"] = build_text(df)
+    df["text"] = df["text"].fillna("")
+    if "rating" not in df:
+        df["rating"] = np.nan
+    missing = df["rating"].isna().to_numpy()
+    if missing.any():
+        df.loc[missing, "rating"] = predict_rating_batch(df[missing])
+    return df
+
+
+# ---- Incremental ----
+def ingest(new_rows, source_csv=SOURCE_CSV, pca_path=PCA_PATH, labels_path=LABELS_PATH,
+           store_dir=STORE_DIR, agg_dir=AGG_DIR, batch_size=64):
+    """Append reviews to the corpus; only the new rows are encoded, clustered and projected.
+
+    Writers are serialized by the store lock, which get_store in other processes
+    also waits on, so they never rebuild from half-appended sources.
+    Existing kmeans / PCA / scaler are reused as-is.
+    A corpus other than the default needs all of its paths passed, like get_store.
+    """
+    if len(new_rows) == 0:
+        return 0
+    paths = (source_csv, pca_path, labels_path, store_dir)
+    with store_lock(store_dir):
+        # A refit in another process may have replaced the models this process has loaded
+        registry.reload_stale()
+        old_store = get_store(*paths)
+        df = _prepare(new_rows)
+
+        emb = registry.get("sbert").encode(df["text"].tolist(), batch_size=batch_size)
+        X = cluster_features(df, emb, registry.get("ohe_cols"), registry.get("scaler_cluster"))
+        labels = registry.get("kmeans").predict(X).astype(int)
+        pca_new = registry.get("pca").transform(X)
+        df["Cluster"] = labels
+        df = df.reindex(columns=old_store.meta["columns"])
+
+        with open(source_csv, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        df.to_csv(source_csv, mode="a", header=False, index=False)
+        append_npy(pca_path, pca_new)
+        append_npy(labels_path, labels)
+        append_rows(df, pca_new, labels, store_dir, source_csv, pca_path, labels_path)
+
+        new_store = get_store(*paths)
+        # Both are keyed on the store version, so they are left alone for any other corpus
+        append_corpus_embeddings(emb, old_store, new_store)
+        update_aggregates(df, old_store, new_store, agg_dir)
+    return len(df)
+
+
+# ---- Full refit ----
+def _shared_centers(centers, ohe_cols, shared):
+    # Embedding block, the one-hot columns both fits know (by name), then scaled (price, rating)
+    n_emb = centers.shape[1] - len(ohe_cols) - 2
+    pos = {col: i for i, col in enumerate(ohe_cols)}
+    cat = centers[:, [n_emb + pos[col] for col in shared]]
+    return np.hstack([centers[:, :n_emb], cat, centers[:, -2:]])
+
+def _align_labels(new_centers, old_centers, new_cols=None, old_cols=None):
+    # Keep cluster ids stable across refits so CLUSTER_NAMES still apply
+    from scipy.optimize import linear_sum_assignment
+    from scipy.spatial.distance import cdist
+
+    if len(new_centers) != len(old_centers):
+        raise ValueError(
+            f"refit has {len(new_centers)} clusters, the current model {len(old_centers)}: "
+            "cluster ids would no longer match CLUSTER_NAMES / CLUSTER_DESCRIPTIONS"
+        )
+    if new_cols is not None and list(new_cols) != list(old_cols):
+        # New countries / roasts widen the one-hot block; compare on the columns both share
+        shared = [col for col in old_cols if col in set(new_cols)]
+        new_centers = _shared_centers(new_centers, new_cols, shared)
+        old_centers = _shared_centers(old_centers, old_cols, shared)
+    if new_centers.shape != old_centers.shape:
+        raise ValueError(f"cannot align centers of shape {new_centers.shape} with {old_centers.shape}")
+    _, order = linear_sum_assignment(cdist(old_centers, new_centers))
+    return order  # new cluster order[i] becomes id i
+
+def _dump(obj, path):
+    # Readers (registry.reload_stale in other processes) only ever see a complete pickle
+    tmp_path = path + ".tmp"
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def full_refit(source_csv=SOURCE_CSV, pca_path=PCA_PATH, labels_path=LABELS_PATH, store_dir=STORE_DIR,
+               batch_size=64, n_clusters=N_CLUSTERS, seed=42):
+    """Re-encode the whole corpus and refit scaler, KMeans and PCA.
+
+    Only this process's registry is invalidated; running app and service
+    processes pick the new files up through registry.reload_stale().
+    """
+    from sklearn.cluster import KMeans
+    from sklearn.decomposition import PCA
+    from sklearn.preprocessing import StandardScaler
+
+    # Held from the read to the last write: an ingest meanwhile waits instead of having its rows
+    # overwritten, and store rebuilds wait until models, arrays and CSV have all been replaced
+    with store_lock(store_dir):
+        df = pd.read_csv(source_csv)
+        df["text"] = df["text"].fillna("")
+        emb = registry.get("sbert").encode(df["text"].tolist(), batch_size=batch_size)
+
+        ohe_cols = pd.get_dummies(df[["loc_country", "roast"]], dtype=int).columns.tolist()
+        scaler = StandardScaler().fit(df[["100g_USD", "rating"]])
+        X = cluster_features(df, emb, ohe_cols, scaler)
+
+        kmeans = KMeans(n_clusters=n_clusters, random_state=seed, n_init="auto").fit(X)
+        order = _align_labels(kmeans.cluster_centers_, registry.get("kmeans").cluster_centers_,
+                              ohe_cols, registry.get("ohe_cols"))
+        remap = np.empty_like(order)
+        remap[order] = np.arange(len(order))
+        kmeans.cluster_centers_ = kmeans.cluster_centers_[order]
+        kmeans.labels_ = remap[kmeans.labels_]
+        labels = kmeans.labels_.astype(np.int32)
+
+        pca = PCA(n_components=2).fit(X)
+        pca_data = pca.transform(X)
+
+        # Written where the registry loads them from
+        _dump(kmeans, registry.artifacts["kmeans"][1])
+        _dump(scaler, registry.artifacts["scaler_cluster"][1])
+        _dump(ohe_cols, registry.artifacts["ohe_cols"][1])
+        _dump(pca, registry.artifacts["pca"][1])
+        np.save(pca_path, pca_data)
+        np.save(labels_path, labels)
+        df["Cluster"] = labels
+        df.to_csv(source_csv, index=False)
+    registry.invalidate(["kmeans", "scaler_cluster", "ohe_cols", "pca"])
+
+    build_corpus_embeddings(get_store(source_csv, pca_path, labels_path, store_dir), EMBEDDINGS_PATH, batch_size)
+    with open(REFIT_STATE, "w") as f:
+        json.dump({"last_refit": time.time(), "rows": len(df)}, f)
+    return len(df)
+
+def refit_due(every_days):
+    try:
+        with open(REFIT_STATE, "r") as f:
+            last = json.load(f)["last_refit"]
+    except (OSError, ValueError, KeyError):
+        return True
+    return time.time() - last >= every_days * 86400
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add reviews to the coffee corpus")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="append reviews from a CSV (coffee_analysis.csv schema)")
+    add.add_argument("csv")
+    add.add_argument("--batch-size", type=int, default=64)
+    add.add_argument("--refit-every-days", type=float, default=None,
+                     help="also run a full refit when the last one is older than this")
+    refit = sub.add_parser("refit", help="re-encode everything and refit KMeans / PCA")
+    refit.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "add":
+        n = ingest(pd.read_csv(args.csv), batch_size=args.batch_size)
+        print(f"Ingested {n} rows in {time.perf_counter() - start:.2f}s")
+        if args.refit_every_days is not None and refit_due(args.refit_every_days):
+            n = full_refit(batch_size=args.batch_size)
+            print(f"Refit {n} rows in {time.perf_counter() - start:.2f}s")
+    else:
+        n = full_refit(batch_size=args.batch_size)
+        print(f"Refit {n} rows in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,369 @@
+"""LLM flavor descriptions.
+
+Configured through the environment:
+LITELLM_TOKEN (required), LITELLM_BASE_URL, LITELLM_MODEL,
+LITELLM_TIMEOUT (seconds), LITELLM_MAX_RETRIES.
+
+Responses are cached on disk (LLM_CACHE_PATH, LLM_CACHE_TTL_DAYS,
+LLM_CACHE_MAX_ENTRIES; LLM_CACHE_PATH="" disables the cache). Fill it for the
+whole catalogue with:
+
+    python llm.py pregenerate --workers 4
+
+For offline testing run the fake endpoint and point the app at it:
+
+    python llm.py fake --port 8001
+    LITELLM_BASE_URL=http://127.0.0.1:8001/v1 LITELLM_TOKEN=fake streamlit run app.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import metrics
+from registry import registry
+
+DEFAULT_BASE_URL = "https://litellm.oit.duke.edu/v1"
+DEFAULT_MODEL = "GPT 4.1 Mini"
+
+
+def llm_settings():
+    api_key = os.getenv("LITELLM_TOKEN")
+    if not api_key:
+        raise ValueError("LITELLM_TOKEN not found. Please set it first.")
+    return {
+        "api_key": api_key,
+        "base_url": os.getenv("LITELLM_BASE_URL", DEFAULT_BASE_URL),
+        "timeout": float(os.getenv("LITELLM_TIMEOUT", "30")),
+        "max_retries": int(os.getenv("LITELLM_MAX_RETRIES", "2")),
+    }
+
+def llm_model():
+    return os.getenv("LITELLM_MODEL", DEFAULT_MODEL)
+
+
+# ---- Shared clients ----
+# One client per settings tuple: the underlying httpx pool keeps connections open between calls
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client():
+    settings = llm_settings()
+    key = tuple(sorted(settings.items()))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                import openai
+
+                client = _clients[key] = openai.OpenAI(**settings)
+    return client
+
+
+# ---- Response cache ----
+class ResponseCache:
+    """SQLite-backed response cache with TTL and least-recently-used eviction"""
+
+    def __init__(self, path, ttl_seconds=None, max_entries=None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    def get(self, key):
+        return self._get(key, count=True)
+
+    def peek(self, key):
+        """Cached response without counting a hit or miss or refreshing its LRU position"""
+        return self._get(key, count=False)
+
+    def _get(self, key, count):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if not count:
+                return None if row is None else row[0]
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            if self.max_entries is not None:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Process-wide response cache, or None when LLM_CACHE_PATH is empty"""
+    global _cache
+    path = os.getenv("LLM_CACHE_PATH", "data/llm_cache.sqlite")
+    if not path:
+        return None
+    if _cache is None or _cache.path != path:
+        with _cache_lock:
+            if _cache is None or _cache.path != path:
+                ttl_days = float(os.getenv("LLM_CACHE_TTL_DAYS", "30"))
+                _cache = ResponseCache(
+                    path,
+                    ttl_seconds=ttl_days * 86400 if ttl_days > 0 else None,
+                    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000")),
+                )
+    return _cache
+
+# Only reports once the cache has been opened; rendering metrics never creates it
+metrics.register_gauge("llm_cache", lambda: {} if _cache is None else _cache.stats())
+
+def cache_key(text, cluster_id, roast, loc, price, model=None):
+    payload = [PROMPT_VERSION, model or llm_model(), str(text), int(cluster_id), str(roast), str(loc), float(price)]
+    return hashlib.sha256(json.dumps(payload).encode("utf-8")).hexdigest()
+
+
+# ---- Prompt ----
+# Bump whenever build_prompt changes so cached responses for the old prompt are not reused
+PROMPT_VERSION = 1
+
+def build_prompt(text, cluster_id, roast, loc, price):
+    from utils import CLUSTER_NAMES
+
+    cluster_name = CLUSTER_NAMES[cluster_id]
+    keywords = registry.get("cluster_keywords")[str(cluster_id)]
+    prompt = f"""
+You are a professional coffee taster holding an SCA certification. Based on the information below, 
+generate a professional yet easy-to-understand flavor description.
+
+[User’s Original Notes]
+{text}
+
+[Cluster Name]
+{cluster_name}
+
+[Cluster Flavor Keywords]
+{', '.join(keywords)}
+
+[Coffee Parameters]
+Roast Level: {roast}
+Origin Country: {loc}
+Price (per 100g USD): {price}
+
+Please generate:
+- A 3–5 sentence tasting summary covering aroma, mouthfeel, acidity, and overall flavor structure.
+- Do NOT repeat what the user already wrote.
+- The description must sound natural, coherent, and professionally written—not like stitched machine output.
+- Respond in ENGLISH ONLY.
+"""
+    return prompt
+
+def _messages(text, cluster_id, roast, loc, price):
+    return [{"role": "user", "content": build_prompt(text, cluster_id, roast, loc, price)}]
+
+
+# ---- Generation ----
+def _cached(text, cluster_id, roast, loc, price):
+    cache = get_cache()
+    if cache is None:
+        return None, None
+    key = cache_key(text, cluster_id, roast, loc, price)
+    return cache, cache.get(key)
+
+def _store(cache, text, cluster_id, roast, loc, price, response):
+    if cache is not None and response:
+        cache.put(cache_key(text, cluster_id, roast, loc, price), response)
+
+def generate_flavor_profile(text, cluster_id, roast, loc, price):
+    cache, cached = _cached(text, cluster_id, roast, loc, price)
+    if cached is not None:
+        return cached
+    with metrics.stage("llm"):
+        response = get_client().chat.completions.create(
+            model=llm_model(),
+            messages=_messages(text, cluster_id, roast, loc, price),
+        )
+    content = response.choices[0].message.content
+    metrics.observe_size("llm_response", len(content or ""))
+    _store(cache, text, cluster_id, roast, loc, price, content)
+    return content
+
+def stream_flavor_profile(text, cluster_id, roast, loc, price):
+    """Yield the description as it is generated (for st.write_stream)"""
+    cache, cached = _cached(text, cluster_id, roast, loc, price)
+    if cached is not None:
+        yield cached
+        return
+    start = time.perf_counter()
+    stream = get_client().chat.completions.create(
+        model=llm_model(),
+        messages=_messages(text, cluster_id, roast, loc, price),
+        stream=True,
+    )
+    parts = []
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if not parts:
+                metrics.record_stage("llm_first_token", time.perf_counter() - start)
+            parts.append(chunk.choices[0].delta.content)
+            yield parts[-1]
+    metrics.record_stage("llm", time.perf_counter() - start)
+    metrics.observe_size("llm_response", sum(len(p) for p in parts))
+    _store(cache, text, cluster_id, roast, loc, price, "".join(parts))
+
+
+# ---- Pre-generation ----
+def catalogue_requests(store, limit=None):
+    """(text, cluster_id, roast, loc, price) per catalogue row, exactly as the app asks for it.
+
+    Autofilling a coffee by name fills in its corpus description, roast, origin,
+    price and rating; the cluster id is the one analyze() predicts from those,
+    which can differ from the stored notebook label.
+    """
+    from utils import analyze_batch
+
+    df = store.frame(text_cols=("text",))
+    if limit is not None:
+        df = df.head(limit)
+    texts = df["text"].fillna("").tolist()
+    roasts, locs = [str(r) for r in df["roast"]], [str(l) for l in df["loc_country"]]
+    prices = df["100g_USD"].astype(float).tolist()
+    clusters = analyze_batch(texts, roasts, locs, prices, df["rating"].astype(float))["cluster_id"]
+    return list(zip(texts, (int(c) for c in clusters), roasts, locs, prices))
+
+def pregenerate(workers=4, limit=None):
+    """Generate and cache a description for every catalogue row not cached yet.
+
+    Returns (generated, errors); a failed call is recorded as (row, error) and the run goes on.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from datastore import get_store
+
+    requests = catalogue_requests(get_store(), limit)
+    cache = get_cache()
+    # peek, so the hit / miss counters only see generate_flavor_profile's own lookups
+    todo = [(i, args) for i, args in enumerate(requests)
+            if cache is None or cache.peek(cache_key(*args)) is None]
+
+    def generate(job):
+        i, args = job
+        try:
+            generate_flavor_profile(*args)
+            return None
+        except Exception as e:
+            return i, repr(e)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        errors = [error for error in pool.map(generate, todo) if error is not None]
+    return len(todo) - len(errors), errors
+
+
+# ---- Fake endpoint ----
+FAKE_REPLY = (
+    "A fragrant cup with a clean, lively aroma. The mouthfeel is round and silky, "
+    "with a gentle, well-integrated acidity. Sweetness carries through to a long, "
+    "balanced finish."
+)
+
+def make_fake_app(reply=FAKE_REPLY, token_delay=0.02):
+    """OpenAI-compatible /v1/chat/completions that answers with a canned reply"""
+    import tornado.web
+
+    class FakeCompletions(tornado.web.RequestHandler):
+        async def post(self):
+            body = json.loads(self.request.body or b"{}")
+            model = body.get("model", DEFAULT_MODEL)
+            created = int(time.time())
+            if not body.get("stream"):
+                self.write({
+                    "id": "fake-completion",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": reply},
+                        "finish_reason": "stop",
+                    }],
+                })
+                return
+            self.set_header("Content-Type", "text/event-stream")
+            for word in reply.split(" "):
+                chunk = {
+                    "id": "fake-completion",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                }
+                self.write(f"data: {json.dumps(chunk)}\n\n")
+                await self.flush()
+                await asyncio.sleep(token_delay)
+            self.write("data: [DONE]\n\n")
+
+    return tornado.web.Application([(r"/v1/chat/completions", FakeCompletions)])
+
+async def _serve_fake(port):
+    make_fake_app().listen(port, "127.0.0.1")
+    print(f"Fake LLM endpoint on http://127.0.0.1:{port}/v1")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM helpers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fake = sub.add_parser("fake", help="run a local OpenAI-compatible endpoint for offline testing")
+    fake.add_argument("--port", type=int, default=8001)
+    pre = sub.add_parser("pregenerate", help="cache a description for every row in df_for_pca.csv")
+    pre.add_argument("--workers", type=int, default=4)
+    pre.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+    if args.command == "fake":
+        asyncio.run(_serve_fake(args.port))
+    else:
+        start = time.perf_counter()
+        n, errors = pregenerate(args.workers, args.limit)
+        print(f"Generated {n} descriptions in {time.perf_counter() - start:.1f}s; cache {get_cache().stats()}")
+        if errors:
+            print(f"{len(errors)} rows failed, first: {errors[:5]}")
+            sys.exit(1)
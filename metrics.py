@@ -0,0 +1,204 @@
+"""Per-stage timings, cache hit rates and payload sizes.
+
+Off by default; enable with COFFEE_METRICS=1 (or metrics.enable()). When off,
+stage() hands back a shared no-op context manager, so instrumented code pays
+for one flag check. COFFEE_METRICS_LOG=1 also emits one JSON log line per stage
+on the "coffee.metrics" logger. render_prometheus() gives the text exposition
+format (served at /metrics by service.py).
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("coffee.metrics")
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = os.getenv("COFFEE_METRICS", "") not in ("", "0")
+_log = os.getenv("COFFEE_METRICS_LOG", "") not in ("", "0")
+
+
+def enabled():
+    return _enabled
+
+def enable(log=None):
+    global _enabled, _log
+    _enabled = True
+    if log is not None:
+        _log = log
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+_lock = threading.Lock()
+_stage_seconds = {}
+_counters = {}
+_sizes = {}
+_gauges = {}
+_local = threading.local()
+
+
+# ---- Recording ----
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(name):
+    """Context manager timing one pipeline stage"""
+    return _Stage(name) if _enabled else _NULL_STAGE
+
+def timed(name):
+    """Decorator form of stage()"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def record_stage(name, seconds):
+    if not _enabled:
+        return
+    with _lock:
+        hist = _stage_seconds.get(name)
+        if hist is None:
+            hist = _stage_seconds[name] = _Histogram()
+        hist.observe(seconds)
+    spans = getattr(_local, "spans", None)
+    if spans is not None:
+        spans.append({"stage": name, "ms": seconds * 1000})
+    if _log:
+        logger.info(json.dumps({"event": "stage", "stage": name, "ms": round(seconds * 1000, 3)}))
+
+def count(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def observe_size(name, nbytes):
+    """Payload size in bytes (request bodies, figure JSON, LLM output, ...)"""
+    if not _enabled:
+        return
+    with _lock:
+        total, n = _sizes.get(name, (0, 0))
+        _sizes[name] = (total + nbytes, n + 1)
+    spans = getattr(_local, "spans", None)
+    if spans is not None:
+        spans.append({"stage": f"{name} (bytes)", "bytes": nbytes})
+
+def register_gauge(name, fn):
+    """fn() -> {label_value: number}; evaluated only when metrics are rendered"""
+    _gauges[name] = fn
+
+def register_lru(name, cached_fn):
+    """Expose hits/misses/size of a functools.lru_cache"""
+    def read():
+        info = cached_fn.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+    register_gauge(f"{name}_cache", read)
+
+
+@contextmanager
+def trace():
+    """Collect the stages recorded by this thread inside the block"""
+    spans = []
+    previous = getattr(_local, "spans", None)
+    _local.spans = spans
+    try:
+        yield spans
+    finally:
+        _local.spans = previous
+
+
+# ---- Exposition ----
+def _fmt(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        stages = {name: (list(h.counts), h.total, h.sum) for name, h in _stage_seconds.items()}
+        counters = dict(_counters)
+        sizes = dict(_sizes)
+
+    lines.append("# TYPE coffee_stage_seconds histogram")
+    for name, (counts, total, total_sum) in sorted(stages.items()):
+        for bound, n in zip(BUCKETS, counts):
+            lines.append(f'coffee_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {n}')
+        lines.append(f'coffee_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {total}')
+        lines.append(f'coffee_stage_seconds_sum{{stage="{name}"}} {_fmt(total_sum)}')
+        lines.append(f'coffee_stage_seconds_count{{stage="{name}"}} {total}')
+
+    lines.append("# TYPE coffee_events_total counter")
+    for name, value in sorted(counters.items()):
+        lines.append(f'coffee_events_total{{event="{name}"}} {value}')
+
+    lines.append("# TYPE coffee_payload_bytes summary")
+    for name, (total, n) in sorted(sizes.items()):
+        lines.append(f'coffee_payload_bytes_sum{{payload="{name}"}} {total}')
+        lines.append(f'coffee_payload_bytes_count{{payload="{name}"}} {n}')
+
+    for name, fn in sorted(_gauges.items()):
+        lines.append(f"# TYPE coffee_{name} gauge")
+        for label, value in fn().items():
+            lines.append(f'coffee_{name}{{kind="{label}"}} {_fmt(value)}')
+    return "\n".join(lines) + "\n"
+
+def snapshot():
+    """Per-stage count / mean / total, for the debug panel"""
+    with _lock:
+        return [
+            {"stage": name, "count": h.total, "mean_ms": h.sum / h.total * 1000, "total_ms": h.sum * 1000}
+            for name, h in sorted(_stage_seconds.items())
+        ]
+
+def reset():
+    with _lock:
+        _stage_seconds.clear()
+        _counters.clear()
+        _sizes.clear()
@@ -0,0 +1,88 @@
+import threading
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+
+from datastore import get_store
+
+NGRAM = 3
+LOOKUP_CACHE_SIZE = 1024
+
+
+def normalize(text):
+    # Case- and accent-insensitive, whitespace collapsed
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.casefold().split())
+
+def _ngrams(text, n=NGRAM):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+def _tokens(text):
+    return "".join(c if c.isalnum() else " " for c in text).split()
+
+
+class NameIndex:
+    """Trigram index over coffee names for ranked substring lookup"""
+
+    def __init__(self, names, cache_size=LOOKUP_CACHE_SIZE):
+        self.norm = [normalize(n) if isinstance(n, str) else "" for n in names]
+        self.grams = defaultdict(list)
+        for i, name in enumerate(self.norm):
+            for gram in _ngrams(name):
+                self.grams[gram].append(i)
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _candidates(self, q):
+        if len(q) >= NGRAM:
+            # Rows containing every trigram of the query, smallest posting list first
+            postings = sorted((self.grams.get(g, []) for g in _ngrams(q)), key=len)
+            rows = set(postings[0])
+            for posting in postings[1:]:
+                if not rows:
+                    break
+                rows.intersection_update(posting)
+            return rows
+        # Too short for trigrams: every name, filtered by the substring test in _lookup
+        # (same matches as the old str.contains scan; names are short and few)
+        return range(len(self.norm))
+
+    def _rank(self, q, i):
+        name = self.norm[i]
+        if name == q:
+            return 0
+        if name.startswith(q):
+            return 1
+        if any(token.startswith(q) for token in _tokens(name)):
+            return 2
+        return 3
+
+    def _lookup(self, query, k):
+        q = normalize(query)
+        if not q:
+            return ()
+        rows = [i for i in self._candidates(q) if q in self.norm[i]]
+        rows.sort(key=lambda i: (self._rank(q, i), len(self.norm[i]), i))
+        return tuple(rows[:k])
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+def get_name_index(store=None):
+    """Name index for the current store, rebuilt only when the data changes"""
+    global _index, _index_version
+    store = get_store() if store is None else store
+    if _index is None or _index_version != store.version:
+        with _index_lock:
+            if _index is None or _index_version != store.version:
+                _index = NameIndex(store.text("name"))
+                _index_version = store.version
+    return _index
+
+def lookup_coffee(query, k=5, store=None):
+    """Best k catalogue rows whose name contains the query, best match first"""
+    store = get_store() if store is None else store
+    rows = get_name_index(store).lookup(query, k)
+    return store.frame().iloc[list(rows)]
@@ -0,0 +1,141 @@
+"""PCA projection as a precomputed linear map, optionally fused with KMeans.
+
+    python projection.py check     # compare against pca.transform and the stored pca_data.npy
+
+pca.transform is (X - mean_) @ components_.T (divided by sqrt(explained_variance_)
+when whitened). PCAProjector folds all of it into one weight matrix W and one
+offset, mean_ @ W, kept as contiguous float32 arrays, so a single row or a
+batch projects with one GEMM and a subtraction.
+
+ClusterProjection goes a step further for analyze(): it lays the KMeans
+centers and W side by side, so one GEMM gives both the centroid dot products
+(see centroids.py) and the PCA coordinates. That pass stays in float64 so
+cluster labels match kmeans.predict exactly.
+"""
+import argparse
+import sys
+import threading
+
+import numpy as np
+
+from centroids import get_centroid_assigner
+from registry import registry
+
+
+def _pca_weights(pca):
+    # (n_features, n_components) map and the offset it subtracts
+    W = np.asarray(pca.components_, dtype=np.float64).T
+    if getattr(pca, "whiten", False):
+        W = W / np.sqrt(pca.explained_variance_)
+    return W, np.asarray(pca.mean_, dtype=np.float64) @ W
+
+
+class PCAProjector:
+    """pca.transform as X @ W - offset"""
+
+    def __init__(self, pca, dtype=np.float32):
+        self.pca = pca
+        self.dtype = dtype
+        W, offset = _pca_weights(pca)
+        self.weights = np.ascontiguousarray(W, dtype=dtype)
+        self.offset = offset.astype(dtype)
+        self.n_features, self.n_components = W.shape
+
+    def project(self, X):
+        """(n, n_components) coordinates for an (n, n_features) matrix or a single row"""
+        X = np.asarray(X, dtype=self.dtype)
+        X = X[None, :] if X.ndim == 1 else X
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, the PCA expects {self.n_features}")
+        out = X @ self.weights
+        out -= self.offset
+        return out
+
+
+class ClusterProjection:
+    """Centroid assignment and PCA coordinates from one GEMM"""
+
+    def __init__(self, assigner, pca):
+        self.assigner = assigner
+        self.pca = pca
+        W, self.offset = _pca_weights(pca)
+        if W.shape[0] != assigner.n_features:
+            raise ValueError("KMeans and PCA were fitted on different feature widths")
+        self.k = assigner.n_clusters
+        self.weights = np.ascontiguousarray(np.hstack([assigner.centers_t, W]))
+
+    def transform(self, X):
+        """assigner.assign(X) plus a "pca_xy" (n, n_components) array"""
+        X = np.asarray(X, dtype=np.float64)
+        out = X @ self.weights
+        result = self.assigner.assign(X, dots=out[:, :self.k])
+        result["pca_xy"] = out[:, self.k:] - self.offset
+        return result
+
+
+_projector = None
+_fused = None
+_build_lock = threading.Lock()
+
+def get_pca_projector():
+    """Projector for the currently loaded pca_2d (rebuilt after registry.invalidate)"""
+    global _projector
+    pca = registry.get("pca")
+    projector = _projector
+    if projector is None or projector.pca is not pca:
+        with _build_lock:
+            projector = _projector = PCAProjector(pca)
+    return projector
+
+def get_cluster_projection():
+    """Fused KMeans + PCA map for the currently loaded models"""
+    global _fused
+    assigner, pca = get_centroid_assigner(), registry.get("pca")
+    fused = _fused
+    if fused is None or fused.assigner is not assigner or fused.pca is not pca:
+        with _build_lock:
+            fused = _fused = ClusterProjection(assigner, pca)
+    return fused
+
+
+# ---- Parity ----
+def check_parity(store=None):
+    """Max |diff| of both projections against pca.transform and the stored pca_data.npy.
+
+    The stored points are mapped back to feature space (pca.inverse_transform) and
+    projected again, so the check needs no SBERT encode and works on any corpus size.
+    """
+    from datastore import get_store
+
+    store = get_store() if store is None else store
+    pca = registry.get("pca")
+    stored = np.asarray(store.pca_data, dtype=np.float64)
+    X = pca.inverse_transform(stored)
+    expected = pca.transform(X)
+
+    projector = get_pca_projector()
+    fused = get_cluster_projection().transform(X)
+    single = np.vstack([projector.project(x) for x in X[:100]])
+    return {
+        "rows": len(X),
+        "float32_vs_transform": float(np.abs(projector.project(X) - expected).max()),
+        "float32_vs_stored": float(np.abs(projector.project(X) - stored).max()),
+        "float32_single_vs_transform": float(np.abs(single - expected[:len(single)]).max()),
+        "fused_vs_transform": float(np.abs(fused["pca_xy"] - expected).max()),
+        "fused_label_mismatches": int((fused["label"] != registry.get("kmeans").predict(X)).sum()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PCA projection parity check")
+    parser.add_argument("command", choices=["check"])
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="for the float32 projector")
+    args = parser.parse_args()
+
+    result = check_parity()
+    print(f"{result['rows']} rows: float32 max |diff| vs pca.transform {result['float32_vs_transform']:.3g} "
+          f"(single {result['float32_single_vs_transform']:.3g}), vs stored {result['float32_vs_stored']:.3g}; "
+          f"fused {result['fused_vs_transform']:.3g}, {result['fused_label_mismatches']} label mismatches")
+    worst = max(result["float32_vs_transform"], result["float32_vs_stored"], result["float32_single_vs_transform"])
+    ok = worst <= args.tolerance and result["fused_vs_transform"] <= 1e-9 and not result["fused_label_mismatches"]
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+
+import joblib
+
+try:
+    import psutil
+except ImportError:  # memory figures are optional
+    psutil = None
+
+
+def _load_sbert(name):
+    # Backend (torch / onnx / int8) and thread count come from embeddings settings
+    from embeddings import load_embedder
+    return load_embedder(name)
+
+def _load_rating_model(path):
+    # Compiled node arrays when exported for the current rf_rating.pkl (see forest.py)
+    from forest import load_rating_model
+    return load_rating_model(path)
+
+def _load_corpus_index(path):
+    # Encodes the corpus here, at warm-up, when the saved embeddings are missing or stale (see similarity.py)
+    from similarity import get_similarity_index
+    return get_similarity_index()
+
+def _load_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+LOADERS = {
+    "joblib": joblib.load,
+    "json": _load_json,
+    "sbert": _load_sbert,
+    "forest": _load_rating_model,
+    "corpus_index": _load_corpus_index,
+}
+
+# name -> (loader, source)
+ARTIFACTS = {
+    "rf_model": ("joblib", "models/rf_rating.pkl"),
+    "rating_model": ("forest", "models/rf_compiled"),
+    "kmeans": ("joblib", "models/kmeans.pkl"),
+    "tfidf": ("joblib", "models/tfidf.pkl"),
+    "scaler_price": ("joblib", "models/rf_price_scaler.pkl"),
+    "rating_ohe_cols": ("joblib", "models/rf_cat_cols.pkl"),
+    "ohe_cols": ("joblib", "models/kmeans_ohe_cols.pkl"),
+    "scaler_cluster": ("joblib", "models/scaler.pkl"),
+    "pca": ("joblib", "models/pca_2d.pkl"),
+    "sbert": ("sbert", "all-MiniLM-L6-v2"),
+    "cluster_keywords": ("json", "data/cluster_keywords.json"),
+    # Depends on sbert and the store; listed last so warm-up loads it after them
+    "corpus_index": ("corpus_index", "models/corpus_emb.npy"),
+}
+
+
+def _signature(source):
+    # Changes whenever the artifact is rewritten (joblib.dump in place, or a directory swapped in)
+    try:
+        st = os.stat(source)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def _forest_signature(source):
+    # load_rating_model falls back to rf_rating.pkl, so a replaced pickle must count too
+    from forest import RF_PATH
+    return (_signature(source), _signature(RF_PATH))
+
+# loader kind -> signature of what it actually reads, when that is more than the source itself
+SIGNATURES = {
+    "forest": _forest_signature,
+}
+
+def _rss():
+    if psutil is None:
+        return None
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+class ModelRegistry:
+    """Process-wide, lazily loaded model artifacts shared by every session and thread"""
+
+    def __init__(self, artifacts):
+        self.artifacts = dict(artifacts)
+        self._objects = {}
+        self._stats = {}
+        self._locks = {name: threading.Lock() for name in self.artifacts}
+        self._warm_thread = None
+        self._warm_requested = set()
+        self._warm_lock = threading.Lock()
+        self._invalidate_hooks = []
+
+    def get(self, name):
+        try:
+            return self._objects[name]
+        except KeyError:
+            pass
+        if name not in self.artifacts:
+            raise KeyError(f"Unknown artifact: {name}")
+        with self._locks[name]:
+            # Another thread may have finished loading while we waited
+            if name not in self._objects:
+                self._load(name)
+        return self._objects[name]
+
+    def _signature(self, name):
+        kind, source = self.artifacts[name]
+        return SIGNATURES.get(kind, _signature)(source)
+
+    def _load(self, name):
+        kind, source = self.artifacts[name]
+        signature = self._signature(name)
+        rss_before = _rss()
+        start = time.perf_counter()
+        obj = LOADERS[kind](source)
+        seconds = time.perf_counter() - start
+        rss_after = _rss()
+        self._stats[name] = {
+            "name": name,
+            "source": source,
+            "load_seconds": seconds,
+            "file_bytes": os.path.getsize(source) if os.path.isfile(source) else None,
+            # RSS delta is approximate when other threads allocate concurrently
+            "rss_delta_bytes": None if rss_before is None else rss_after - rss_before,
+            "signature": signature,
+        }
+        self._objects[name] = obj
+
+    def invalidate(self, names=None):
+        """Drop loaded artifacts so the next get() reloads them from disk"""
+        names = list(self.artifacts) if names is None else list(names)
+        for name in names:
+            with self._locks[name]:
+                self._objects.pop(name, None)
+                self._stats.pop(name, None)
+                self._warm_requested.discard(name)
+        for hook in self._invalidate_hooks:
+            hook(set(names))
+
+    def stale(self):
+        """Loaded artifacts whose file changed on disk since they were loaded (e.g. by another process's refit)"""
+        return [
+            name for name, stats in list(self._stats.items())
+            if stats["signature"] is not None and self._signature(name) != stats["signature"]
+        ]
+
+    def reload_stale(self):
+        """Invalidate artifacts rewritten by another process; returns their names"""
+        names = self.stale()
+        if names:
+            self.invalidate(names)
+        return names
+
+    def on_invalidate(self, hook):
+        """Call hook(names) after every invalidate(), e.g. to clear results derived from those artifacts"""
+        self._invalidate_hooks.append(hook)
+
+    def is_loaded(self, name):
+        return name in self._objects
+
+    def warm_up(self, names=None, background=False):
+        """Load the given artifacts (default: all) ahead of the first request.
+
+        In the background each artifact is scheduled once (again only after invalidate),
+        so callers such as app.py can call this on every rerun.
+        """
+        names = list(self.artifacts) if names is None else list(names)
+        if not background:
+            for name in names:
+                self.get(name)
+            return None
+        with self._warm_lock:
+            names = [name for name in names if name not in self._warm_requested]
+            if not names or (self._warm_thread is not None and self._warm_thread.is_alive()):
+                return self._warm_thread
+            self._warm_requested.update(names)
+            self._warm_thread = threading.Thread(
+                target=self.warm_up, args=(names,), name="model-warm-up", daemon=True
+            )
+            self._warm_thread.start()
+            return self._warm_thread
+
+    def report(self):
+        """Load time and memory of every artifact loaded so far"""
+        return [self._stats[name] for name in self.artifacts if name in self._stats]
+
+
+registry = ModelRegistry(ARTIFACTS)
+
+
+if __name__ == "__main__":
+    registry.warm_up()
+    for row in registry.report():
+        rss = row["rss_delta_bytes"]
+        rss = "n/a" if rss is None else f"{rss / 1e6:8.1f} MB"
+        print(f"{row['name']:<18} {row['load_seconds'] * 1000:9.1f} ms  rss {rss}  ({row['source']})")
@@ -0,0 +1,298 @@
+"""Re-score a catalogue (rating + cluster) across a process pool.
+
+    python score.py data/coffee_analysis.csv --out scored.csv --workers 4 --chunk-size 256
+    python score.py reviews.parquet --out scored.parquet --threads 2
+    python score.py big_dump.csv --out scored.csv --resume   # continue an interrupted run
+
+Input is CSV or Parquet in the coffee_analysis.csv / df_for_pca.csv schema
+(text or desc_1..3, roast, loc_country, 100g_USD, optional rating); without a
+text column it is desc_1 + desc_2 + desc_3 with a missing part left out, rather
+than emptying the whole text as the notebook did. The input is
+streamed chunk by chunk and never held whole: each worker process loads the
+models once in its initializer, at most 2 x workers chunks are in flight, and
+results are written in input order as chunks complete. --threads caps BLAS /
+OpenMP / torch threads per worker so workers x threads stays within the
+machine.
+
+Rows whose price is missing or not a finite number (or whose rating is not
+numeric) are not scored: their score columns stay empty and the error column
+says why, instead of the models inventing a rating and cluster for them.
+
+For CSV output a checkpoint (<out>.progress.json) records the chunks written
+so far and the output size after them; --resume truncates any partial chunk
+and carries on from the next one.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from embeddings import BACKENDS
+
+KEEP_COLS = ("name", "roaster")
+SCORE_DTYPES = {
+    "predicted_rating": "float64",
+    "rating_used": "float64",
+    "cluster_id": "Int64",
+    "cluster_name": "object",
+    "cluster_margin": "float64",
+    "low_confidence": "boolean",
+}
+SCORE_COLS = list(SCORE_DTYPES)
+SCORING_ARTIFACTS = ["rating_model", "tfidf", "rating_ohe_cols", "sbert", "kmeans", "ohe_cols", "scaler_cluster"]
+THREAD_ENV = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def _is_parquet(path):
+    return path.lower().endswith((".parquet", ".pq"))
+
+def read_chunks(path, chunk_size, skip=0):
+    """DataFrames of chunk_size rows, starting after the first skip chunks"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+
+        batches = (b.to_pandas() for b in pq.ParquetFile(path).iter_batches(batch_size=chunk_size))
+    else:
+        batches = pd.read_csv(path, chunksize=chunk_size)
+    # Skipped chunks are parsed and dropped, never scored
+    yield from itertools.islice(batches, skip, None)
+
+
+class ChunkWriter:
+    """Appends scored chunks to a CSV or Parquet file"""
+
+    def __init__(self, path, resume_bytes=None):
+        self.path = path
+        self._parquet = None
+        self._csv = None
+        if not _is_parquet(path):
+            if resume_bytes is None:
+                self._csv = open(path, "w", newline="")
+                self._header = True
+            else:
+                # Drop whatever a crashed run wrote past the last checkpoint
+                self._csv = open(path, "r+", newline="")
+                self._csv.truncate(resume_bytes)
+                self._csv.seek(resume_bytes)
+                self._header = resume_bytes == 0
+
+    def write(self, df):
+        if self._csv is None:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        else:
+            df.to_csv(self._csv, header=self._header, index=False)
+            self._header = False
+
+    def sync(self):
+        """Flush to disk; returns the output size (CSV only)"""
+        if self._csv is None:
+            return None
+        self._csv.flush()
+        os.fsync(self._csv.fileno())
+        return self._csv.tell()
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._csv is not None:
+            self._csv.close()
+
+
+# ---- Checkpoints ----
+def _checkpoint_path(out):
+    return out + ".progress.json"
+
+def _input_stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def load_checkpoint(src, out, chunk_size):
+    """Checkpoint of an earlier run over the same input and chunk size, else None"""
+    try:
+        with open(_checkpoint_path(out), "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    same_run = state.get("input_stamp") == _input_stamp(src) and state.get("chunk_size") == chunk_size
+    if not same_run or not os.path.exists(out) or os.path.getsize(out) < state["out_bytes"]:
+        return None
+    return state
+
+def save_checkpoint(src, out, chunk_size, chunks, rows, out_bytes, complete=False):
+    state = {
+        "input": src,
+        "input_stamp": _input_stamp(src),
+        "chunk_size": chunk_size,
+        "chunks": chunks,
+        "rows": rows,
+        "out_bytes": out_bytes,
+        "complete": complete,
+    }
+    tmp_path = _checkpoint_path(out) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, _checkpoint_path(out))
+
+
+# ---- Workers ----
+_thread_limits = None
+
+@contextmanager
+def worker_env(threads):
+    """Thread caps for spawned workers, which read them before numpy / torch start their
+    thread pools; the caller's environment is put back on exit"""
+    names = (*THREAD_ENV, "TOKENIZERS_PARALLELISM")
+    saved = {name: os.environ.get(name) for name in names}
+    os.environ.update({name: str(threads) for name in THREAD_ENV}, TOKENIZERS_PARALLELISM="false")
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def init_worker(threads=None, embed_backend=None):
+    """Pool initializer: cap library threads, then load every scoring model once"""
+    global _thread_limits
+    from embeddings import configure
+
+    if threads:
+        from threadpoolctl import threadpool_limits
+        _thread_limits = threadpool_limits(threads)  # kept alive for the worker's lifetime
+    configure(embed_backend, threads)
+
+    from utils import warm_up
+    warm_up(SCORING_ARTIFACTS)
+
+def validate_chunk(df):
+    """Reason per row that cannot be scored ("" when it can): price must be a finite number,
+    rating (if given) a finite number or empty"""
+    errors = pd.Series("", index=df.index, dtype=object)
+    price = pd.to_numeric(df["100g_USD"], errors="coerce") if "100g_USD" in df else pd.Series(np.nan, index=df.index)
+    errors[~np.isfinite(price.to_numpy(dtype=float))] = "missing or non-numeric 100g_USD"
+    if "rating" in df:
+        rating = pd.to_numeric(df["rating"], errors="coerce").to_numpy(dtype=float)
+        bad_rating = df["rating"].notna().to_numpy() & ~np.isfinite(rating)
+        errors[bad_rating & (errors == "")] = "non-numeric rating"
+    return errors
+
+def score_chunk(df, batch_size=64):
+    """Scores for every row of df; rows failing validate_chunk get empty scores and an error"""
+    from utils import predict_batch
+
+    df = df.reset_index(drop=True)
+    errors = validate_chunk(df)
+    good = df[(errors == "").to_numpy()].copy()
+    scored = pd.DataFrame(index=good.index)
+    if len(good):
+        good["100g_USD"] = pd.to_numeric(good["100g_USD"])
+        if "rating" in good:
+            good["rating"] = pd.to_numeric(good["rating"], errors="coerce")
+        scored = predict_batch(good, batch_size=batch_size).set_index(good.index)
+    # Same dtypes for every chunk, so Parquet output keeps one schema
+    scored = scored.reindex(index=df.index, columns=SCORE_COLS).astype(SCORE_DTYPES)
+    scored["cluster_name"] = scored["cluster_name"].fillna("")
+    scored["error"] = errors.to_numpy()
+    keep = df[[c for c in KEEP_COLS if c in df]]
+    return pd.concat([keep, scored], axis=1)
+
+
+def score_file(src, out, workers=None, chunk_size=256, threads=None, batch_size=64,
+               embed_backend=None, progress=True, resume=False):
+    """Score src into out; returns (rows scored by this call, seconds)"""
+    workers = os.cpu_count() if workers is None else workers
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // max(workers, 1))
+    checkpoints = not _is_parquet(out)
+    if resume and not checkpoints:
+        raise ValueError("--resume needs CSV output; Parquet files cannot be appended after a crash")
+
+    state = load_checkpoint(src, out, chunk_size) if resume else None
+    if state is not None and state["complete"]:
+        return 0, 0.0
+    done_chunks = 0 if state is None else state["chunks"]
+    done_rows = 0 if state is None else state["rows"]
+    writer = ChunkWriter(out, None if state is None else state["out_bytes"])
+    rows = 0
+    start = time.perf_counter()
+
+    def emit(scored):
+        nonlocal rows, done_chunks
+        writer.write(scored)
+        rows += len(scored)
+        done_chunks += 1
+        if checkpoints:
+            save_checkpoint(src, out, chunk_size, done_chunks, done_rows + rows, writer.sync())
+        if progress:
+            elapsed = time.perf_counter() - start
+            print(f"\r{done_rows + rows} rows  {rows / elapsed:8.1f} rows/s", end="", file=sys.stderr, flush=True)
+
+    chunks = read_chunks(src, chunk_size, skip=done_chunks)
+    try:
+        if workers == 0:
+            init_worker(threads, embed_backend)
+            for chunk in chunks:
+                emit(score_chunk(chunk, batch_size))
+        else:
+            ctx = multiprocessing.get_context("spawn")
+            with worker_env(threads), ProcessPoolExecutor(workers, mp_context=ctx, initializer=init_worker,
+                                                          initargs=(threads, embed_backend)) as pool:
+                # A bounded window of in-flight chunks keeps memory flat and output in order
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(score_chunk, chunk, batch_size))
+                    if len(pending) >= 2 * workers:
+                        emit(pending.popleft().result())
+                while pending:
+                    emit(pending.popleft().result())
+        if checkpoints:
+            save_checkpoint(src, out, chunk_size, done_chunks, done_rows + rows, writer.sync(), complete=True)
+    finally:
+        writer.close()
+    if progress:
+        print(file=sys.stderr)
+    return rows, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a catalogue with the rating and cluster models")
+    parser.add_argument("input", help="CSV or Parquet file")
+    parser.add_argument("--out", required=True, help="output CSV or Parquet file")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count; 0 = in-process)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="rows per task")
+    parser.add_argument("--threads", type=int, default=None, help="library threads per worker (default: CPUs / workers)")
+    parser.add_argument("--batch-size", type=int, default=64, help="SBERT encode batch size")
+    parser.add_argument("--embed-backend", choices=BACKENDS, default=None, help="see embeddings.py")
+    parser.add_argument("--resume", action="store_true", help="continue from the last completed chunk (CSV output)")
+    args = parser.parse_args()
+
+    rows, seconds = score_file(
+        args.input, args.out,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        threads=args.threads,
+        batch_size=args.batch_size,
+        embed_backend=args.embed_backend,
+        resume=args.resume,
+    )
+    if rows == 0 and args.resume:
+        print(f"{args.out} is already complete")
+    else:
+        print(f"Scored {rows} rows in {seconds:.2f}s ({rows / seconds:.1f} rows/s) -> {args.out}")
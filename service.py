@@ -0,0 +1,298 @@
+"""Headless scoring service.
+
+    python service.py --port 8000 --max-batch 32 --max-wait-ms 10
+
+    curl -X POST localhost:8000/analyze -d '{"text": "...", "roast": "Light", "loc": "Taiwan", "price": 12.5}'
+
+Endpoints (POST, JSON body with text, roast, loc, price and optional rating):
+/rating, /cluster, /pca, /similar (optional "k"), /analyze (everything).
+Cluster answers carry the runner-up cluster, per-cluster memberships, the
+margin between the two nearest centroids and a low_confidence flag.
+GET /clusters and /clusters/<id> serve the precomputed cluster aggregates.
+GET /metrics serves Prometheus text (run with COFFEE_METRICS=1 or --metrics).
+Models rewritten on disk (ingest.py refit) are reloaded within --reload-interval.
+Concurrent requests are collected into micro-batches that share one SBERT
+encode and one RandomForest predict. When the queue is full the service
+answers 503 with Retry-After instead of queueing more work. A batch that
+fails is re-scored item by item, so only the offending request gets a 500.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tornado.ioloop
+import tornado.web
+
+import metrics
+from embeddings import BACKENDS, configure
+from aggregates import get_aggregates
+from registry import registry
+from similarity import similar_to_embedding
+from utils import analyze_batch, warm_up
+
+logger = logging.getLogger("coffee.service")
+
+SIMILAR_COLS = ["name", "roaster", "rating", "100g_USD", "similarity"]
+
+
+class MicroBatcher:
+    """Collects submitted items into batches of up to max_batch, waiting at most max_wait seconds"""
+
+    def __init__(self, fn, max_batch=32, max_wait=0.01, queue_size=256, executor=None):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue_size = queue_size
+        # One worker: batches run one after another, each on all cores via numpy/torch
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch")
+        self.queue = None
+        self._task = None
+
+    def _ensure_started(self):
+        if self._task is None:
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        """Result for item; raises asyncio.QueueFull when the service is saturated"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((item, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _score(self, items):
+        # (result, exception) per item. When the batch fails, items are re-scored
+        # one by one so a single bad row only fails its own request
+        try:
+            return [(result, None) for result in self.fn(items)]
+        except Exception as e:
+            if len(items) == 1:
+                return [(None, e)]
+        metrics.count("batch_retries")
+        outcomes = []
+        for item in items:
+            try:
+                outcomes.append((self.fn([item])[0], None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [item for item, _ in batch]
+            try:
+                outcomes = await loop.run_in_executor(self.executor, self._score, items)
+            except Exception as e:  # executor shut down
+                outcomes = [(None, e)] * len(batch)
+            for (_, future), (result, error) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+
+def _finite(payload, key):
+    value = float(payload[key])
+    if not math.isfinite(value):
+        raise ValueError(f"{key} must be a finite number")
+    return value
+
+def parse_request(payload):
+    if not isinstance(payload, dict):
+        raise ValueError("body must be a JSON object")
+    rating = payload.get("rating")
+    return {
+        "text": str(payload["text"]),
+        "roast": str(payload["roast"]),
+        "loc": str(payload["loc"]),
+        "price": _finite(payload, "price"),
+        "rating": np.nan if rating in (None, "") else _finite(payload, "rating"),
+        "k": int(payload.get("k", 0)),
+    }
+
+def score_batch(items, batch_size=64):
+    """One SBERT encode + one RF predict for the whole micro-batch"""
+    texts = [item["text"] for item in items]
+    metrics.count("batches")
+    metrics.count("batch_items", len(items))
+    sbert = registry.get("sbert")
+    with metrics.stage("sbert"):
+        emb = sbert.encode(texts, batch_size=batch_size)
+    scored = analyze_batch(
+        texts,
+        [item["roast"] for item in items],
+        [item["loc"] for item in items],
+        [item["price"] for item in items],
+        [item["rating"] for item in items],
+        batch_size=batch_size,
+        emb=emb,
+    )
+    results = []
+    for i, (item, row) in enumerate(zip(items, scored.itertuples(index=False))):
+        result = {
+            "rating": float(row.rating),
+            "cluster_id": int(row.cluster_id),
+            "cluster_name": row.cluster_name,
+            "cluster_margin": float(row.cluster_margin),
+            "low_confidence": bool(row.low_confidence),
+            "runner_up_id": int(row.runner_up_id),
+            "memberships": [float(m) for m in row.memberships],
+            "pca_xy": [float(row.pca_x), float(row.pca_y)],
+        }
+        if item["k"] > 0:
+            with metrics.stage("similar"):
+                similar = similar_to_embedding(emb[i], item["k"])[SIMILAR_COLS]
+            result["similar"] = json.loads(similar.to_json(orient="records"))
+        results.append(result)
+    return results
+
+
+CLUSTER_FIELDS = ["cluster_id", "cluster_name", "cluster_margin", "low_confidence", "runner_up_id", "memberships"]
+ENDPOINT_FIELDS = {
+    "rating": ["rating"],
+    "cluster": CLUSTER_FIELDS,
+    "pca": ["pca_xy"],
+    "similar": ["similar"],
+    "analyze": ["rating", *CLUSTER_FIELDS, "pca_xy", "similar"],
+}
+
+
+class ScoreHandler(tornado.web.RequestHandler):
+    def initialize(self, batcher, endpoint):
+        self.batcher = batcher
+        self.endpoint = endpoint
+
+    async def post(self):
+        metrics.observe_size("request_body", len(self.request.body or b""))
+        try:
+            item = parse_request(json.loads(self.request.body or b"{}"))
+        except (ValueError, KeyError, TypeError) as e:
+            self.set_status(400)
+            self.write({"error": f"bad request: {e}"})
+            return
+        if self.endpoint == "similar" and item["k"] <= 0:
+            item["k"] = 5
+        try:
+            result = await self.batcher.submit(item)
+        except asyncio.QueueFull:
+            self.set_status(503)
+            self.set_header("Retry-After", "1")
+            self.write({"error": "scoring queue is full"})
+            metrics.count("rejected")
+            return
+        except Exception as e:
+            logger.exception("scoring failed")
+            self.set_status(500)
+            self.write({"error": f"scoring failed: {e}"})
+            metrics.count("failed")
+            return
+        self.write({k: result[k] for k in ENDPOINT_FIELDS[self.endpoint] if k in result})
+
+    def on_finish(self):
+        metrics.record_stage(f"http_{self.endpoint}", self.request.request_time())
+
+
+class ClusterStatsHandler(tornado.web.RequestHandler):
+    def get(self, cluster_id=None):
+        aggregates = get_aggregates()
+        if cluster_id is None:
+            self.write({"clusters": json.loads(aggregates.stats.to_json(orient="records"))})
+            return
+        cluster_id = int(cluster_id)
+        stats = aggregates.cluster(cluster_id)
+        if stats is None:
+            self.set_status(404)
+            self.write({"error": f"unknown cluster {cluster_id}"})
+            return
+        self.write({
+            "stats": stats,
+            "countries": json.loads(aggregates.country(cluster_id).to_json(orient="records")),
+            "roasts": json.loads(aggregates.roast(cluster_id).to_json(orient="records")),
+        })
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def initialize(self, batcher):
+        self.batcher = batcher
+
+    def get(self):
+        queued = 0 if self.batcher.queue is None else self.batcher.queue.qsize()
+        self.write({"status": "ok", "queued": queued})
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(metrics.render_prometheus())
+
+
+def make_app(batcher):
+    routes = [
+        (r"/health", HealthHandler, {"batcher": batcher}),
+        (r"/metrics", MetricsHandler),
+        (r"/clusters", ClusterStatsHandler),
+        (r"/clusters/(\d+)", ClusterStatsHandler),
+    ]
+    for endpoint in ENDPOINT_FIELDS:
+        routes.append((rf"/{endpoint}", ScoreHandler, {"batcher": batcher, "endpoint": endpoint}))
+    return tornado.web.Application(routes)
+
+
+async def main(args):
+    batcher = MicroBatcher(
+        lambda items: score_batch(items, args.batch_size),
+        max_batch=args.max_batch,
+        max_wait=args.max_wait_ms / 1000.0,
+        queue_size=args.queue_size,
+    )
+    if args.metrics:
+        metrics.enable()
+    configure(args.embed_backend, args.embed_threads)
+    if args.warm_up:
+        warm_up()
+    if args.reload_interval > 0:
+        # Pick up models rewritten by `ingest.py refit` in another process
+        tornado.ioloop.PeriodicCallback(registry.reload_stale, args.reload_interval * 1000).start()
+    make_app(batcher).listen(args.port, args.host)
+    print(f"Scoring service on http://{args.host}:{args.port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coffee scoring HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=64, help="SBERT encode batch size")
+    parser.add_argument("--warm-up", action="store_true", help="load all models before serving")
+    parser.add_argument("--reload-interval", type=float, default=5.0,
+                        help="seconds between checks for models rewritten on disk (0 = never)")
+    parser.add_argument("--metrics", action="store_true", help="record per-stage timings for /metrics")
+    parser.add_argument("--embed-backend", choices=BACKENDS, default=None,
+                        help="SBERT backend (default: COFFEE_EMBED_BACKEND or torch)")
+    parser.add_argument("--embed-threads", type=int, default=None, help="SBERT intra-op threads")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from datastore import append_npy, get_store
+from embeddings import backend_name
+from registry import registry
+
+EMBEDDINGS_PATH = "models/corpus_emb.npy"
+EMBEDDINGS_META = "models/corpus_emb.json"
+
+# Above this many rows search() goes through the approximate IVF index
+APPROX_MIN_ROWS = 50000
+IVF_NPROBE = 8
+
+RESULT_COLS = ["name", "roaster", "roast", "loc_country", "rating", "100g_USD", "Cluster"]
+
+
+def _normalize(X):
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return X / norms
+
+def build_corpus_embeddings(store=None, path=None, batch_size=64):
+    """Encode every review once and save the normalized float32 matrix"""
+    store = get_store() if store is None else store
+    path = EMBEDDINGS_PATH if path is None else path
+    texts = [t or "" for t in store.text("text")]
+    emb = _normalize(registry.get("sbert").encode(texts, batch_size=batch_size))
+    np.save(path, np.ascontiguousarray(emb, dtype=np.float32))
+    _write_meta(store)
+    return emb
+
+def append_corpus_embeddings(emb, old_store, new_store):
+    """Extend the saved matrix with embeddings of newly ingested rows"""
+    if not _embeddings_current(old_store):
+        # Out of date anyway; get_similarity_index() rebuilds it on next use
+        return False
+    append_npy(EMBEDDINGS_PATH, _normalize(emb))
+    _write_meta(new_store)
+    return True
+
+def _write_meta(store):
+    with open(EMBEDDINGS_META, "w") as f:
+        json.dump({
+            "rows": store.rows,
+            "store_version": list(map(list, store.version)),
+            "embed_backend": backend_name(),
+        }, f)
+
+def _embeddings_current(store):
+    try:
+        with open(EMBEDDINGS_META, "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    # Vectors from another backend are close but not identical to the query encoder's
+    return os.path.exists(EMBEDDINGS_PATH) and meta["rows"] == store.rows \
+        and tuple(map(tuple, meta["store_version"])) == store.version \
+        and meta.get("embed_backend", "torch") == backend_name()
+
+
+class IVFIndex:
+    """Coarse-quantized inverted file index: scan only the nprobe nearest lists"""
+
+    def __init__(self, emb, nlist=None, seed=0):
+        from sklearn.cluster import MiniBatchKMeans
+
+        nlist = nlist or max(1, int(np.sqrt(len(emb))))
+        km = MiniBatchKMeans(n_clusters=nlist, random_state=seed, n_init=3).fit(emb)
+        self.centroids = _normalize(km.cluster_centers_)
+        order = np.argsort(km.labels_, kind="stable")
+        counts = np.bincount(km.labels_, minlength=nlist)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.rows = order
+
+    def candidates(self, q, nprobe=IVF_NPROBE):
+        lists = np.argsort(-(self.centroids @ q))[:nprobe]
+        return np.concatenate([self.rows[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+
+
+class SimilarityIndex:
+    def __init__(self, emb, approx=None):
+        self.emb = emb
+        if approx is None:
+            approx = len(emb) >= APPROX_MIN_ROWS
+        self.ivf = IVFIndex(np.asarray(emb)) if approx else None
+
+    def search(self, query_emb, k=5):
+        """(rows, cosine scores) of the k nearest corpus entries"""
+        q = _normalize(query_emb).ravel()
+        if self.ivf is not None:
+            rows = self.ivf.candidates(q)
+            scores = self.emb[rows] @ q
+        else:
+            rows = None
+            scores = self.emb @ q
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return (top if rows is None else rows[top]), scores[top]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+def get_similarity_index(store=None):
+    global _index, _index_version
+    store = get_store() if store is None else store
+    if _index is None or _index_version != store.version:
+        with _index_lock:
+            if _index is None or _index_version != store.version:
+                if not _embeddings_current(store):
+                    build_corpus_embeddings(store)
+                _index = SimilarityIndex(np.load(EMBEDDINGS_PATH, mmap_mode="r"))
+                _index_version = store.version
+    return _index
+
+def similar_coffees(text, k=5, store=None):
+    """The k reviewed coffees whose descriptions are closest to text"""
+    from utils import embed_text
+
+    return similar_to_embedding(embed_text(text), k, store)
+
+def similar_to_embedding(emb, k=5, store=None):
+    store = get_store() if store is None else store
+    rows, scores = get_similarity_index(store).search(emb, k)
+    result = store.frame()[RESULT_COLS].iloc[rows].copy()
+    result.insert(0, "similarity", scores)
+    return result.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    emb = build_corpus_embeddings()
+    print(f"Saved {EMBEDDINGS_PATH}: {emb.shape}")
@@ -0,0 +1,40 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Modules are flat at the repo root and load models / data by relative path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from registry import registry  # noqa: E402
+
+
+class HashEncoder:
+    """Deterministic stand-in for SBERT: a unit vector seeded by the text"""
+
+    dim = 384
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int(hashlib.md5(str(text).encode()).hexdigest()[:8], 16)
+            v = np.random.default_rng(seed).standard_normal(self.dim)
+            out[i] = v / np.linalg.norm(v)
+        return out
+
+
+@pytest.fixture
+def hash_sbert(monkeypatch):
+    """Installs HashEncoder as the registry's sbert (the real model needs the Hugging Face hub)"""
+    encoder = HashEncoder()
+    monkeypatch.setitem(registry._objects, "sbert", encoder)
+    return encoder
+
+
+def requires(*paths):
+    missing = [p for p in paths if not os.path.exists(os.path.join(ROOT, p))]
+    return pytest.mark.skipif(bool(missing), reason=f"missing {', '.join(missing)}")
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import (KEYS, QUANTILES, VALUES, Aggregates, _quantiles, merge_tables, partial_tables,
+                        update_aggregates)
+from datastore import get_store
+
+
+@pytest.fixture(scope="module")
+def reviews():
+    return get_store().frame(text_cols=())
+
+def sorted_tables(tables):
+    return {name: t.sort_values(KEYS[name]).reset_index(drop=True) for name, t in tables.items()}
+
+
+def test_quantiles_match_np_quantile():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        values = rng.choice(np.arange(80.0, 98.0), size=rng.integers(1, 12), replace=False)
+        counts = rng.integers(1, 20, size=len(values))
+        expected = np.quantile(np.repeat(values, counts), QUANTILES)
+        np.testing.assert_allclose(_quantiles(values, counts), expected, rtol=0, atol=1e-12)
+
+def test_cluster_stats_match_the_reviews(reviews):
+    stats = Aggregates(partial_tables(reviews), version=()).stats.set_index("Cluster")
+    for cluster_id, rows in reviews.groupby("Cluster"):
+        for name, col in VALUES.items():
+            values = rows[col].dropna().to_numpy(float)
+            assert stats.loc[cluster_id, f"{name}_count"] == len(values)
+            assert stats.loc[cluster_id, f"{name}_mean"] == pytest.approx(values.mean())
+            quantiles = [stats.loc[cluster_id, f"{name}_p{int(q * 100)}"] for q in QUANTILES]
+            np.testing.assert_allclose(quantiles, np.quantile(values, QUANTILES), rtol=1e-12)
+
+def test_incremental_merge_matches_a_full_recompute(reviews):
+    full = Aggregates(partial_tables(reviews), version=())
+    merged = {}
+    for part in np.array_split(np.arange(len(reviews)), 4):
+        tables = partial_tables(reviews.iloc[part])
+        merged = tables if not merged else merge_tables(merged, tables)
+    merged = Aggregates(merged, version=())
+    expected, actual = sorted_tables(full.tables), sorted_tables(merged.tables)
+    for name in KEYS:
+        pd.testing.assert_frame_equal(actual[name], expected[name], check_dtype=False, rtol=1e-12)
+    pd.testing.assert_frame_equal(merged.stats, full.stats, check_exact=False, rtol=1e-12)
+    for cluster_id in reviews["Cluster"].unique():
+        pd.testing.assert_frame_equal(
+            merged.country(cluster_id).sort_values("loc_country").reset_index(drop=True),
+            full.country(cluster_id).sort_values("loc_country").reset_index(drop=True),
+            check_exact=False, rtol=1e-12,
+        )
+
+def test_update_aggregates_refreshes_the_saved_tables(reviews, tmp_path):
+    agg_dir = str(tmp_path)
+    old, new = reviews.iloc[:-50], reviews
+    old_store, new_store = SimpleNamespace(version=((1, 1),)), SimpleNamespace(version=((2, 2),))
+    assert not update_aggregates(new.iloc[-50:], old_store, new_store, agg_dir)
+    Aggregates(partial_tables(old), old_store.version).save(agg_dir)
+    assert update_aggregates(new.iloc[-50:], old_store, new_store, agg_dir)
+    assert Aggregates.load(old_store.version, agg_dir) is None
+    refreshed = Aggregates.load(new_store.version, agg_dir)
+    pd.testing.assert_frame_equal(refreshed.stats, Aggregates(partial_tables(new), ()).stats,
+                                  check_exact=False, rtol=1e-12)
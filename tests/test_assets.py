@@ -0,0 +1,55 @@
+import os
+
+import pytest
+from PIL import Image
+
+import assets
+from assets import MISSING_IMAGE, STATIC_URL, AssetCache, image_src
+
+
+@pytest.fixture
+def source(tmp_path):
+    """A 640x480 JPEG, larger than twice the 200x150 display size"""
+    path = str(tmp_path / "light.jpg")
+    Image.new("RGB", (640, 480), (111, 78, 55)).save(path, quality=90)
+    return path
+
+@pytest.fixture
+def cache(source, tmp_path, monkeypatch):
+    """The module's cache pointed at the generated JPEG, plus an entry whose source is missing"""
+    cache = AssetCache({"light": (source, (200, 150), 80), "gone": (str(tmp_path / "gone.jpg"), (200, 150), 80)},
+                       static_dir=str(tmp_path / "static"))
+    monkeypatch.setattr(assets, "asset_cache", cache)
+    return cache
+
+
+def test_writes_a_hash_named_webp(cache):
+    path = cache.path("light")
+    name, digest, ext = os.path.basename(path).split(".")
+    assert (name, len(digest), ext) == ("light", 12, "webp")
+    with Image.open(path) as im:
+        assert im.format == "WEBP" and im.size == (400, 300)
+
+def test_second_call_reuses_the_file(cache, monkeypatch):
+    path = cache.path("light")
+    mtime = os.stat(path).st_mtime_ns
+    monkeypatch.setattr(assets, "encode_webp", lambda *args: pytest.fail("encoded twice"))
+    assert cache.path("light") == path
+    # A new process finds the file on disk instead of encoding again
+    fresh = AssetCache(cache.assets, cache.static_dir)
+    assert fresh.path("light") == path and os.stat(path).st_mtime_ns == mtime
+    assert cache.data_uri("light") is cache.data_uri("light")
+
+def test_changed_source_gets_a_new_name(cache, source):
+    path = cache.path("light")
+    Image.new("RGB", (640, 480), (247, 243, 239)).save(source)
+    assert AssetCache(cache.assets, cache.static_dir).path("light") != path
+
+def test_missing_source(cache):
+    assert cache.path("gone") is None and cache.data_uri("gone") is None
+    assert image_src("gone", static=True) is None and image_src("gone", static=False) is None
+    assert (image_src("gone") or MISSING_IMAGE) == MISSING_IMAGE
+
+def test_static_url_or_data_uri(cache):
+    assert image_src("light", static=True) == f"{STATIC_URL}/{os.path.basename(cache.path('light'))}"
+    assert image_src("light", static=False).startswith("data:image/webp;base64,")
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+from conftest import requires
+from datastore import SOURCE_CSV
+from forest import RF_PATH
+
+pytestmark = requires(RF_PATH)
+
+
+@pytest.fixture
+def rows():
+    """A slice of the corpus without its text column, with unseen categories and missing descriptions"""
+    df = pd.read_csv(SOURCE_CSV, nrows=40).drop(columns="text")
+    df.loc[1, "roast"] = "Unknown Roast"
+    df.loc[2, "loc_country"] = "Atlantis"
+    df.loc[3, ["roast", "loc_country"]] = ["Blonde", "Narnia"]
+    df.loc[4, "desc_1"] = np.nan
+    df.loc[5, ["desc_1", "desc_2", "desc_3"]] = np.nan
+    return df
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    utils.predict_rating.cache_clear()
+    utils.embed_text.cache_clear()
+
+def per_row(df):
+    texts = utils.build_text(df)
+    return list(zip(texts, df["roast"], df["loc_country"], df["100g_USD"], df["rating"]))
+
+
+def test_rating_batch_matches_per_row(rows, hash_sbert):
+    expected = [utils.predict_rating(t, r, l, p) for t, r, l, p, _ in per_row(rows)]
+    np.testing.assert_array_equal(utils.predict_rating_batch(rows), expected)
+
+def test_cluster_batch_matches_per_row(rows, hash_sbert):
+    expected = [utils.predict_cluster(t, r, l, p, y) for t, r, l, p, y in per_row(rows)]
+    np.testing.assert_array_equal(utils.predict_cluster_batch(rows), expected)
+
+def test_predict_batch_matches_per_row(rows, hash_sbert):
+    rows["rating"] = rows["rating"].astype(float)
+    rows.loc[[0, 4, 7], "rating"] = np.nan
+    out = utils.predict_batch(rows)
+    for i, (t, r, l, p, y) in enumerate(per_row(rows)):
+        predicted = utils.predict_rating(t, r, l, p)
+        used = predicted if np.isnan(y) else y
+        assert out.loc[i, "predicted_rating"] == predicted
+        assert out.loc[i, "rating_used"] == used
+        assert out.loc[i, "cluster_id"] == utils.predict_cluster(t, r, l, p, used)
+
+def test_text_column_and_arrays_match_the_frame(rows, hash_sbert):
+    texts = utils.build_text(rows)
+    with_text = rows.assign(text=texts)
+    with_text.loc[6, "text"] = np.nan
+    expected = utils.predict_batch(with_text)
+    texts = texts.tolist()
+    texts[6] = ""
+    arrays = utils.predict_batch(texts, rows["roast"], rows["loc_country"], rows["100g_USD"], rows["rating"])
+    pd.testing.assert_frame_equal(arrays, expected)
@@ -0,0 +1,35 @@
+import pytest
+
+from bench import compare, summarize
+
+
+def run(**p50_ms):
+    return {"results": {name: {"p50_ms": ms} for name, ms in p50_ms.items()}}
+
+
+def test_summarize_fixed_latencies():
+    stats = summarize([0.001, 0.002, 0.003, 0.004, 0.010], items_per_call=32)
+    assert list(stats) == ["calls", "items_per_call", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "items_per_s"]
+    assert stats["calls"] == 5 and stats["items_per_call"] == 32
+    assert stats["mean_ms"] == pytest.approx(4.0)
+    assert stats["p50_ms"] == pytest.approx(3.0)
+    assert stats["p90_ms"] == pytest.approx(7.6)
+    assert stats["p99_ms"] == pytest.approx(9.76)
+    assert stats["items_per_s"] == pytest.approx(32 * 5 / 0.020)
+
+def test_compare_flags_slowdowns_past_the_threshold(capsys):
+    baseline = run(**{"single/predict_rating": 2.0, "batch/analyze_batch/32": 10.0, "render/get_pca_figure": 0.0})
+    current = run(**{"single/predict_rating": 2.3, "batch/analyze_batch/32": 12.5, "render/get_pca_figure": 1.0,
+                     "app/app_rerun": 50.0})
+    assert compare(current, baseline, threshold=0.2) == ["batch/analyze_batch/32", "render/get_pca_figure"]
+    lines = capsys.readouterr().out.splitlines()
+    # Only names in both runs are reported, one line each
+    assert len(lines) == 3
+    assert lines[0] == f"{'single/predict_rating':<40}       2.00 ->       2.30 ms  x 1.15"
+    assert lines[1] == f"{'batch/analyze_batch/32':<40}      10.00 ->      12.50 ms  x 1.25  REGRESSION"
+    assert lines[2].endswith("x  inf  REGRESSION")  # a zero baseline counts as a regression
+
+def test_compare_against_itself_finds_nothing(capsys):
+    current = run(a=1.0, b=5.0)
+    assert compare(current, current, threshold=0.0) == []
+    assert "REGRESSION" not in capsys.readouterr().out
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from centroids import CentroidAssigner, get_centroid_assigner
+from conftest import HashEncoder
+from datastore import get_store
+from ingest import cluster_features
+from registry import registry
+
+
+@pytest.fixture(scope="module")
+def X():
+    df = get_store().frame(text_cols=("text",))
+    emb = HashEncoder().encode(df["text"].fillna("").tolist())
+    return cluster_features(df, emb, registry.get("ohe_cols"), registry.get("scaler_cluster"))
+
+
+def test_labels_match_kmeans_predict(X):
+    assert (get_centroid_assigner().assign(X)["label"] == registry.get("kmeans").predict(X)).all()
+
+def test_single_rows_match_batch(X):
+    assigner = get_centroid_assigner()
+    batch = assigner.assign(X[:50])
+    for i in range(50):
+        single = assigner.assign(X[i:i + 1])
+        assert single["label"][0] == batch["label"][i]
+        np.testing.assert_allclose(single["distances"][0], batch["distances"][i], rtol=1e-12)
+
+def test_distances_memberships_and_margin(X):
+    kmeans = registry.get("kmeans")
+    result = get_centroid_assigner().assign(X[:200])
+    expected = np.linalg.norm(X[:200, None, :] - kmeans.cluster_centers_[None], axis=2)
+    np.testing.assert_allclose(result["distances"], expected, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(result["memberships"].sum(axis=1), 1.0)
+    assert (result["memberships"].argmax(axis=1) == result["label"]).all()
+    assert ((result["margin"] >= 0) & (result["margin"] <= 1)).all()
+    assert (result["runner_up"] != result["label"]).all()
+    assert (result["low_confidence"] == (result["margin"] < 0.05)).all()
+
+def test_non_finite_rows_raise_like_kmeans(X):
+    from projection import get_cluster_projection
+
+    bad = X[:5].copy()
+    bad[3, 0] = np.nan
+    for assign in (get_centroid_assigner().assign, get_cluster_projection().transform, registry.get("kmeans").predict):
+        with pytest.raises(ValueError):
+            assign(bad)
+    bad[3, 0] = np.inf
+    with pytest.raises(ValueError):
+        get_centroid_assigner().assign(bad)
+
+def test_rebuilt_after_invalidate():
+    before = get_centroid_assigner()
+    registry.invalidate(["kmeans"])
+    after = get_centroid_assigner()
+    assert after is not before and isinstance(after, CentroidAssigner)
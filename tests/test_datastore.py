@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import datastore
+from datastore import CATEGORICAL_COLS, NUMERIC_COLS, TEXT_COLS, append_npy, get_store, store_lock
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    """Three review rows with accents, missing text and a missing category, plus matching PCA arrays"""
+    df = pd.read_csv(datastore.SOURCE_CSV, nrows=3)
+    df.loc[0, "name"] = "Café Crème “Sweety”"
+    df.loc[1, "desc_3"] = np.nan
+    df.loc[2, "roast"] = np.nan
+    paths = {
+        "source_csv": str(tmp_path / "df_for_pca.csv"),
+        "pca_path": str(tmp_path / "pca_data.npy"),
+        "labels_path": str(tmp_path / "cluster_labels.npy"),
+        "store_dir": str(tmp_path / "store"),
+    }
+    df.to_csv(paths["source_csv"], index=False)
+    np.save(paths["pca_path"], np.arange(6, dtype=np.float64).reshape(3, 2))
+    np.save(paths["labels_path"], np.array([0, 5, 2]))
+    monkeypatch.setattr(datastore, "_store", None)
+    return df, paths
+
+def values(series):
+    return [None if pd.isna(v) else v for v in series]
+
+
+def test_frame_round_trips_categories_and_text(corpus):
+    df, paths = corpus
+    store = get_store(**paths)
+    out = store.frame(text_cols=tuple(TEXT_COLS))
+    assert list(out.columns) == list(df.columns)
+    for col in CATEGORICAL_COLS:
+        assert isinstance(out[col].dtype, pd.CategoricalDtype)
+        assert values(out[col]) == values(df[col])
+    for col in NUMERIC_COLS:
+        np.testing.assert_array_equal(out[col], df[col])
+    for col in TEXT_COLS:
+        assert values(out[col]) == values(df[col])
+    assert store.text("name", rows=[0]) == ["Café Crème “Sweety”"]
+    assert store.frame().columns.difference(df.columns).empty
+    np.testing.assert_array_equal(store.pca_data, np.load(paths["pca_path"]))
+
+def test_rebuilds_when_the_source_csv_changes(corpus):
+    df, paths = corpus
+    store = get_store(**paths)
+    assert get_store(**paths) is store
+    df.loc[0, "rating"] = 100
+    df.to_csv(paths["source_csv"], index=False)
+    assert datastore.is_stale(store.meta, paths["source_csv"], paths["pca_path"], paths["labels_path"])
+    rebuilt = get_store(**paths)
+    assert rebuilt is not store
+    assert rebuilt.column("rating")[0] == 100
+    assert rebuilt.version != store.version
+
+def test_append_npy_across_header_digit_growth(tmp_path):
+    path = str(tmp_path / "rows.npy")
+    np.save(path, np.zeros((9, 2)))
+    header_len = len(open(path, "rb").read()) - 9 * 2 * 8
+    append_npy(path, np.ones((1, 2)))
+    append_npy(path, np.full((100_000, 2), 2.0))
+    out = np.load(path)
+    assert out.shape == (100_010, 2)
+    assert out[:9].sum() == 0 and (out[9] == 1).all() and (out[10:] == 2).all()
+    assert len(open(path, "rb").read()) - out.nbytes == header_len
+
+def test_append_npy_rewrites_when_the_header_length_changes(tmp_path):
+    # A header padded wider than numpy writes it cannot be rewritten in place
+    path = str(tmp_path / "rows.npy")
+    header = "{'descr': '<i8', 'fortran_order': False, 'shape': (3,), }"
+    header = header.ljust(192 - 10 - 1) + "\n"
+    with open(path, "wb") as f:
+        f.write(np.lib.format.magic(1, 0) + len(header).to_bytes(2, "little") + header.encode("latin1"))
+        f.write(np.arange(3, dtype=np.int64).tobytes())
+    assert append_npy(path, np.array([3, 4])) == (5,)
+    assert np.load(path).tolist() == [0, 1, 2, 3, 4]
+
+def test_build_rejects_sources_out_of_step(corpus):
+    df, paths = corpus
+    df.iloc[[0]].to_csv(paths["source_csv"], mode="a", header=False, index=False)
+    with pytest.raises(ValueError, match="out of step"):
+        datastore.build_store(**paths)
+
+def test_get_store_waits_for_a_writer(corpus):
+    df, paths = corpus
+    store = get_store(**paths)
+    new = df.iloc[[0]]
+    result = {}
+    with store_lock(paths["store_dir"]):
+        # Half-way through an ingest: the CSV is ahead of the .npy files and the store
+        new.to_csv(paths["source_csv"], mode="a", header=False, index=False)
+        reader = threading.Thread(target=lambda: result.update(store=get_store(**paths)))
+        reader.start()
+        reader.join(0.3)
+        assert reader.is_alive()
+        pca_new, labels_new = np.ones((1, 2)), np.array([1])
+        append_npy(paths["pca_path"], pca_new)
+        append_npy(paths["labels_path"], labels_new)
+        datastore.append_rows(new, pca_new, labels_new, paths["store_dir"],
+                              paths["source_csv"], paths["pca_path"], paths["labels_path"])
+    reader.join(5)
+    assert result["store"].rows == store.rows + 1
+    assert result["store"].text("name", rows=[3]) == ["Café Crème “Sweety”"]
@@ -0,0 +1,84 @@
+import runpy
+import sys
+import types
+
+import pytest
+
+import embeddings
+from conftest import HashEncoder
+
+
+class FakeSentenceTransformer:
+    """Records how it was built; the int8 graph encodes visibly differently"""
+
+    def __init__(self, name, device=None, backend="torch", model_kwargs=None):
+        self.name, self.device, self.backend, self.model_kwargs = name, device, backend, model_kwargs or {}
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        emb = HashEncoder().encode(texts)
+        if "file_name" in self.model_kwargs:
+            emb = HashEncoder().encode([f"int8 {t}" for t in texts])
+        return emb
+
+
+@pytest.fixture
+def fake_backends(monkeypatch):
+    """sentence_transformers / onnxruntime stand-ins (the real model needs the Hugging Face hub)"""
+    st_module = types.ModuleType("sentence_transformers")
+    st_module.SentenceTransformer = FakeSentenceTransformer
+    ort = types.ModuleType("onnxruntime")
+    ort.SessionOptions = types.SimpleNamespace
+    monkeypatch.setitem(sys.modules, "sentence_transformers", st_module)
+    monkeypatch.setitem(sys.modules, "onnxruntime", ort)
+    monkeypatch.setitem(embeddings._settings, "backend", "torch")
+    monkeypatch.setitem(embeddings._settings, "threads", None)
+    monkeypatch.delenv("COFFEE_EMBED_INT8_FILE", raising=False)
+
+
+def test_backend_dispatch(fake_backends):
+    torch_model = embeddings.load_embedder("m")
+    assert (torch_model.backend, torch_model.device, torch_model.model_kwargs) == ("torch", "cpu", {})
+
+    onnx = embeddings.load_embedder("m", "onnx", threads=2)
+    assert onnx.backend == "onnx" and "file_name" not in onnx.model_kwargs
+    assert onnx.model_kwargs["session_options"].intra_op_num_threads == 2
+
+    int8 = embeddings.load_embedder("m", "int8")
+    assert int8.backend == "onnx" and int8.model_kwargs["file_name"] == embeddings.DEFAULT_INT8_FILE
+
+    with pytest.raises(ValueError):
+        embeddings.load_embedder("m", "tpu")
+
+def test_configure_sets_the_default_backend(fake_backends, monkeypatch):
+    monkeypatch.setenv("COFFEE_EMBED_INT8_FILE", "onnx/custom.onnx")
+    embeddings.configure(backend="int8", threads=3)
+    assert embeddings.backend_name() == "int8"
+    model = embeddings.load_embedder("m")
+    assert model.model_kwargs["file_name"] == "onnx/custom.onnx"
+    assert model.model_kwargs["session_options"].intra_op_num_threads == 3
+    embeddings.configure(threads=0)
+    assert embeddings._settings["threads"] is None
+
+def test_missing_onnxruntime_names_the_extra(fake_backends, monkeypatch):
+    monkeypatch.setitem(sys.modules, "onnxruntime", None)
+    with pytest.raises(ImportError, match="optimum"):
+        embeddings.load_embedder("m", "onnx")
+
+def test_parity(fake_backends):
+    same = embeddings.check_parity("onnx")
+    assert same["changed"] == 0 and same["min_cosine"] > 0.9999
+    assert same["rows"] > 0 and 0 <= same["agree_with_stored"] <= 1
+    moved = embeddings.check_parity("int8")
+    assert moved["changed"] > 0 and len(moved["changed_rows"]) == min(moved["changed"], 20)
+
+@pytest.mark.parametrize("argv, code", [
+    (["parity", "--backend", "onnx"], 0),
+    (["parity", "--backend", "int8"], 1),
+    (["parity", "--backend", "int8", "--max-changed", "100000"], 0),
+])
+def test_parity_cli_exit_code(fake_backends, monkeypatch, capsys, argv, code):
+    monkeypatch.setattr(sys, "argv", ["embeddings.py", *argv])
+    with pytest.raises(SystemExit) as exit_info:
+        runpy.run_path(embeddings.__file__, run_name="__main__")
+    assert exit_info.value.code == code
+    assert "rows change cluster" in capsys.readouterr().out
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from datastore import SOURCE_CSV
+from features import (MAX_LOGGED_UNSEEN, CategoricalEncoder, _reference_row, check_parity, get_cluster_encoder,
+                      get_rating_featurizer)
+
+
+def test_rating_block_matches_baseline():
+    # Baseline: the original per-row one-hot loop + hstack
+    result = check_parity(n_rows=200)
+    assert result["shape_ok"]
+    assert result["batch_mismatches"] == 0
+    assert result["single_mismatches"] == 0
+
+def test_cluster_block_matches_baseline():
+    # Baseline: get_dummies + scaler.transform
+    assert check_parity(n_rows=200)["cluster_max_abs_diff"] < 1e-12
+
+def test_unseen_categories_encode_as_zeros():
+    featurizer = get_rating_featurizer()
+    X = featurizer.transform(["floral"], ["Unknown Roast"], ["Atlantis"], [0.0])
+    expected = _reference_row("floral", "Unknown Roast", "Atlantis", 0.0)
+    assert (abs(X - expected) > 0).nnz == 0
+    assert X[:, featurizer.n_text:].nnz == 0
+
+def test_cluster_single_row_matches_batch():
+    df = pd.read_csv(SOURCE_CSV, nrows=50)
+    emb = np.random.default_rng(0).standard_normal((len(df), 384))
+    encoder = get_cluster_encoder()
+    args = (df["roast"].tolist(), df["loc_country"].tolist(), df["100g_USD"], df["rating"])
+    batch = encoder.cluster_matrix(emb, *args)
+    single = np.vstack([encoder.cluster_matrix(emb[i:i + 1], *([a[i]] for a in map(list, args)))
+                        for i in range(len(df))])
+    np.testing.assert_array_equal(batch, single)
+
+def test_encoder_columns_follow_get_dummies_names():
+    encoder = CategoricalEncoder(["loc_country_Kenya", "roast_Light", "roast_Dark"])
+    block = encoder.onehot(["Dark", "Light", "Medium"], ["Kenya", "Peru", "Kenya"])
+    np.testing.assert_array_equal(block, [[1, 0, 1], [0, 1, 0], [1, 0, 0]])
+
+def test_unseen_log_is_bounded(caplog):
+    encoder = CategoricalEncoder(["roast_Light"])
+    with caplog.at_level("WARNING", logger="coffee.features"):
+        encoder.lookup("roast", ["Mystery"] * 3)
+        encoder.lookup("roast", [f"roast {i}" for i in range(2 * MAX_LOGGED_UNSEEN)])
+    assert len(encoder._logged) == MAX_LOGGED_UNSEEN
+    assert sum("Mystery" in r.message for r in caplog.records) == 1
@@ -0,0 +1,25 @@
+import os
+from types import SimpleNamespace
+
+from figures import FigureCache
+
+
+class Figure:
+    def __init__(self, version):
+        self.version = version
+
+    def to_json(self):
+        return f'{{"version": {self.version}}}'
+
+
+def test_a_new_version_prunes_other_figure_sets(tmp_path):
+    cache = FigureCache(str(tmp_path))
+    old, new = SimpleNamespace(version=((1, 1),)), SimpleNamespace(version=((2, 2),))
+    build = lambda store: Figure(store.version[0][0])
+    assert cache.get_json(old, "pca", build) == '{"version": 1}'
+    assert os.listdir(tmp_path) == [os.path.basename(cache._dir(old.version))]
+
+    assert cache.get_json(new, "pca", build) == '{"version": 2}'
+    assert os.listdir(tmp_path) == [os.path.basename(cache._dir(new.version))]
+    # The current version's files are served from disk by a fresh process
+    assert FigureCache(str(tmp_path)).get_json(new, "pca", lambda store: None) == '{"version": 2}'
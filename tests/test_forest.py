@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import requires
+from datastore import SOURCE_CSV
+from forest import RF_PATH, CompiledForest, export_forest, load_rating_model
+
+pytestmark = requires(RF_PATH)
+
+
+@pytest.fixture(scope="module")
+def rf():
+    import joblib
+    return joblib.load(RF_PATH)
+
+@pytest.fixture(scope="module")
+def X():
+    from utils import encode_for_rating_batch
+
+    df = pd.read_csv(SOURCE_CSV, nrows=300)
+    return encode_for_rating_batch(df["text"].fillna("").tolist(), df["roast"].tolist(),
+                                   df["loc_country"].tolist(), df["100g_USD"].to_numpy())
+
+@pytest.fixture(scope="module")
+def compiled(rf, tmp_path_factory):
+    out = str(tmp_path_factory.mktemp("forest") / "rf_compiled")
+    export_forest(rf, out)
+    return CompiledForest.load(out)
+
+
+def test_batch_matches_random_forest(rf, X, compiled):
+    np.testing.assert_allclose(compiled.predict(X), rf.predict(X), rtol=0, atol=1e-9)
+
+def test_single_row_matches_random_forest(rf, X, compiled):
+    expected = rf.predict(X[:20])
+    assert [compiled.predict_one(X[i]) for i in range(20)] == pytest.approx(expected, abs=1e-9)
+
+def test_rejects_wrong_width(X, compiled):
+    with pytest.raises(ValueError):
+        compiled.predict(X[:, :-1])
+
+def test_rejects_non_finite_rows(X, compiled):
+    bad = X[:2].toarray()
+    bad[1, -1] = np.nan
+    with pytest.raises(ValueError):
+        compiled.predict(bad)
+    with pytest.raises(ValueError):
+        compiled.predict_one(bad[1:])
+
+def test_falls_back_to_pickle_without_export(tmp_path):
+    from sklearn.ensemble import RandomForestRegressor
+    assert isinstance(load_rating_model(str(tmp_path / "missing")), RandomForestRegressor)
@@ -0,0 +1,88 @@
+import csv
+import io
+
+import pytest
+
+from history import FIELDS, HistoryDB, HistoryStore
+
+
+def entry(i):
+    return {"name": f"coffee {i}", "roast": "Light", "loc": "Kenya", "price": 5.0 + i, "rating": 90.0, "cluster": "x"}
+
+def names(entries):
+    return [e["name"] for e in entries]
+
+@pytest.fixture
+def db(tmp_path):
+    return HistoryDB(str(tmp_path / "history.sqlite"), max_stored=20)
+
+
+def test_memory_ring_is_bounded_and_pages_newest_first():
+    history = HistoryStore(capacity=5)
+    for i in range(8):
+        history.append(entry(i))
+    assert len(history) == 5
+    assert names(history.page(0, 2)) == ["coffee 7", "coffee 6"]
+    assert names(history.page(2, 2)) == ["coffee 3"]
+    assert history.page(3, 2) == []
+
+def test_clear():
+    history = HistoryStore(capacity=5)
+    history.append(entry(0))
+    history.clear()
+    assert len(history) == 0 and history.page(0, 10) == []
+
+def test_sqlite_pages_past_the_ring_and_survives_reload(db):
+    history = HistoryStore(capacity=3, db=db, session="a")
+    for i in range(10):
+        history.append(entry(i))
+    HistoryStore(capacity=3, db=db, session="b").append(entry(99))
+    reloaded = HistoryStore(capacity=3, db=db, session="a")
+    assert len(reloaded) == 10
+    assert names(reloaded.page(0, 4)) == ["coffee 9", "coffee 8", "coffee 7", "coffee 6"]
+    assert names(reloaded.page(2, 4)) == ["coffee 1", "coffee 0"]
+
+def test_sqlite_trims_to_max_stored(db):
+    history = HistoryStore(capacity=3, db=db, session="a")
+    for i in range(25):
+        history.append(entry(i))
+    assert len(history) == 20 == db.count("a")
+    assert names(history.page(3, 5)) == ["coffee 9", "coffee 8", "coffee 7", "coffee 6", "coffee 5"]
+
+def test_sqlite_clear_only_touches_its_session(db):
+    a, b = HistoryStore(3, db, "a"), HistoryStore(3, db, "b")
+    a.append(entry(0))
+    b.append(entry(1))
+    a.clear()
+    assert len(HistoryStore(3, db, "a")) == 0 and len(HistoryStore(3, db, "b")) == 1
+
+def test_csv_export_oldest_first_in_batches(db):
+    history = HistoryStore(capacity=3, db=db, session="a")
+    for i in range(7):
+        history.append(entry(i))
+    chunks = list(history.iter_csv(batch=3))
+    rows = list(csv.reader(io.StringIO("".join(chunks))))
+    assert rows[0] == list(FIELDS)
+    assert [r[0] for r in rows[1:]] == [f"coffee {i}" for i in range(7)]
+    assert len(chunks) == 3
+
+def test_tabs_sharing_a_session_see_each_others_entries(db):
+    one, two = HistoryStore(3, db, "a"), HistoryStore(3, db, "a")
+    for i in range(4):
+        one.append(entry(i))
+    before = two.version
+    two.append(entry(4))
+    assert len(one) == len(two) == 5
+    assert names(one.page(0, 2)) == ["coffee 4", "coffee 3"] == names(two.page(0, 2))
+    assert two.version != before and one.version == two.version
+    one.clear()
+    assert len(two) == 0 and two.page(0, 5) == []
+
+def test_version_changes_with_the_history():
+    history = HistoryStore(capacity=5)
+    versions = [history.version]
+    history.append(entry(0))
+    versions.append(history.version)
+    history.clear()
+    versions.append(history.version)
+    assert len(set(versions)) == 3
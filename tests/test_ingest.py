@@ -0,0 +1,177 @@
+import json
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import datastore
+import ingest as ingest_module
+import similarity
+from conftest import requires
+from datastore import LABELS_PATH, PCA_PATH, SOURCE_CSV, build_store, get_store
+from forest import RF_PATH
+from ingest import _align_labels, cluster_features, full_refit, ingest, refit_due
+from registry import registry
+
+REFIT_MODELS = ("kmeans", "scaler_cluster", "ohe_cols", "pca")
+
+pytestmark = requires(RF_PATH)
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    """A private copy of the corpus files, so ingest never touches the real ones"""
+    paths = {
+        "source_csv": str(tmp_path / "df_for_pca.csv"),
+        "pca_path": str(tmp_path / "pca_data.npy"),
+        "labels_path": str(tmp_path / "cluster_labels.npy"),
+        "store_dir": str(tmp_path / "store"),
+    }
+    for src, key in ((SOURCE_CSV, "source_csv"), (PCA_PATH, "pca_path"), (LABELS_PATH, "labels_path")):
+        shutil.copy(src, paths[key])
+    # Leave the process-wide store as it was for the other tests
+    monkeypatch.setattr(datastore, "_store", None)
+    return paths
+
+@pytest.fixture
+def refit_models(tmp_path, monkeypatch):
+    """Copies of the clustering models, refit state and corpus embeddings a refit may overwrite"""
+    for name in REFIT_MODELS:
+        kind, source = registry.artifacts[name]
+        path = str(tmp_path / f"{name}.pkl")
+        shutil.copy(source, path)
+        monkeypatch.setitem(registry.artifacts, name, (kind, path))
+    monkeypatch.setattr(ingest_module, "REFIT_STATE", str(tmp_path / "refit_state.json"))
+    monkeypatch.setattr(ingest_module, "EMBEDDINGS_PATH", str(tmp_path / "corpus_emb.npy"))
+    monkeypatch.setattr(similarity, "EMBEDDINGS_PATH", str(tmp_path / "corpus_emb.npy"))
+    monkeypatch.setattr(similarity, "EMBEDDINGS_META", str(tmp_path / "corpus_emb.json"))
+    registry.invalidate(REFIT_MODELS)
+    yield tmp_path
+    registry.invalidate(REFIT_MODELS)
+
+def new_rows(n=3):
+    rows = pd.read_csv("data/coffee_analysis.csv", nrows=n)
+    rows["rating"] = rows["rating"].astype(float)
+    rows.loc[0, "rating"] = np.nan
+    return rows
+
+
+def test_ingest_writes_only_to_the_given_corpus(corpus, tmp_path, hash_sbert):
+    before = {path: open(path, "rb").read() for path in (SOURCE_CSV, PCA_PATH, LABELS_PATH)}
+    rows = len(get_store(*corpus.values()).pca_data)
+    assert ingest(new_rows(), **corpus, agg_dir=str(tmp_path / "aggregates")) == 3
+    assert {path: open(path, "rb").read() for path in before} == before
+    assert len(np.load(corpus["pca_path"])) == len(np.load(corpus["labels_path"])) == rows + 3
+    assert get_store(*corpus.values()).rows == rows + 3
+
+def test_predicted_ratings_match_a_fresh_build(corpus, tmp_path, hash_sbert):
+    from aggregates import Aggregates, build_aggregates
+
+    agg_dir = str(tmp_path / "aggregates")
+    build_aggregates(get_store(*corpus.values())).save(agg_dir)
+    ingest(new_rows(), **corpus, agg_dir=agg_dir)
+    store = get_store(*corpus.values())
+    assert store.column("rating")[-3] != round(store.column("rating")[-3])  # kept the predicted float
+
+    fresh_dir = str(tmp_path / "fresh")
+    fresh = datastore.DataStore(fresh_dir, build_store(corpus["source_csv"], corpus["pca_path"],
+                                                       corpus["labels_path"], fresh_dir))
+    for col in ("100g_USD", "rating", "Cluster"):
+        # The CSV round trip can move a predicted rating by an ulp
+        np.testing.assert_allclose(store.column(col), fresh.column(col), rtol=1e-12)
+    merged = Aggregates.load(store.version, agg_dir)
+    assert merged is not None
+    pd.testing.assert_frame_equal(merged.stats, build_aggregates(fresh).stats, check_exact=False, rtol=1e-12)
+
+def test_append_npy_refuses_lossy_casts(tmp_path):
+    path = str(tmp_path / "rating.npy")
+    np.save(path, np.array([90, 91], dtype=np.int64))
+    with pytest.raises(ValueError):
+        datastore.append_npy(path, np.array([94.27]))
+    datastore.append_npy(path, np.array([92], dtype=np.int32))
+    assert np.load(path).tolist() == [90, 91, 92]
+
+def test_full_refit_keeps_labels_aligned(corpus, refit_models, hash_sbert):
+    rows = full_refit(**corpus)
+    first = np.load(corpus["labels_path"])
+    assert rows == len(first) == len(np.load(corpus["pca_path"]))
+    # A refit from another seed finds (nearly) the same clusters and keeps their ids
+    full_refit(**corpus, seed=7)
+    labels = np.load(corpus["labels_path"])
+    assert (labels == first).mean() > 0.9
+    np.testing.assert_array_equal(pd.read_csv(corpus["source_csv"])["Cluster"], labels)
+    np.testing.assert_array_equal(registry.get("kmeans").labels_, labels)
+    np.testing.assert_array_equal(get_store(*corpus.values()).column("Cluster"), labels)
+    assert not refit_due(1)
+
+def test_rows_ingested_during_a_refit_survive(corpus, refit_models, tmp_path, hash_sbert, monkeypatch):
+    rows = len(np.load(corpus["pca_path"]))
+    started, release = threading.Event(), threading.Event()
+
+    class SlowEncoder:
+        # Holds the refit inside its corpus encode until the ingest is waiting on the lock
+        def encode(self, texts, **kwargs):
+            if len(texts) == rows:
+                started.set()
+                release.wait(10)
+            return hash_sbert.encode(texts, **kwargs)
+
+    monkeypatch.setitem(registry._objects, "sbert", SlowEncoder())
+    refit = threading.Thread(target=full_refit, kwargs=corpus)
+    refit.start()
+    assert started.wait(10)
+    added = threading.Thread(target=ingest, args=(new_rows(),), kwargs={**corpus, "agg_dir": str(tmp_path / "agg")})
+    added.start()
+    added.join(0.3)
+    assert added.is_alive()
+    release.set()
+    refit.join(60)
+    added.join(60)
+
+    labels = np.load(corpus["labels_path"])
+    assert len(pd.read_csv(corpus["source_csv"])) == len(np.load(corpus["pca_path"])) == len(labels) == rows + 3
+    assert get_store(*corpus.values()).rows == rows + 3
+    np.testing.assert_array_equal(labels[:rows], registry.get("kmeans").labels_)
+    # The new rows were clustered and projected by the refit models, not the ones loaded before it
+    df = ingest_module._prepare(new_rows())
+    X = cluster_features(df, hash_sbert.encode(df["text"].tolist()), registry.get("ohe_cols"),
+                         registry.get("scaler_cluster"))
+    np.testing.assert_array_equal(labels[rows:], registry.get("kmeans").predict(X))
+    np.testing.assert_allclose(np.load(corpus["pca_path"])[rows:], registry.get("pca").transform(X))
+
+def test_align_labels_undoes_a_permutation():
+    rng = np.random.default_rng(0)
+    old = rng.standard_normal((6, 10))
+    order = np.array([3, 0, 5, 1, 4, 2])
+    new = np.empty_like(old)
+    new[order] = old + 0.01 * rng.standard_normal(old.shape)
+    assert _align_labels(new, old).tolist() == order.tolist()
+
+def test_align_labels_compares_on_shared_one_hot_columns():
+    rng = np.random.default_rng(1)
+    old_cols, new_cols = ["loc_country_Kenya", "roast_Light"], ["loc_country_Kenya", "loc_country_Peru", "roast_Light"]
+    old = rng.standard_normal((4, 5 + len(old_cols) + 2))
+    order = np.array([2, 0, 3, 1])
+    # A new country column in the middle of the one-hot block, far from every old center
+    new = np.insert(old, 6, 50 * rng.standard_normal(4), axis=1)[np.argsort(order)]
+    assert _align_labels(new, old, new_cols, old_cols).tolist() == order.tolist()
+
+def test_align_labels_refuses_a_different_cluster_count():
+    with pytest.raises(ValueError, match="clusters"):
+        _align_labels(np.zeros((5, 3)), np.zeros((6, 3)))
+    with pytest.raises(ValueError, match="shape"):
+        _align_labels(np.zeros((6, 4)), np.zeros((6, 3)))
+
+def test_refit_due(tmp_path, monkeypatch):
+    state = tmp_path / "refit_state.json"
+    monkeypatch.setattr(ingest_module, "REFIT_STATE", str(state))
+    assert refit_due(7)
+    state.write_text("not json")
+    assert refit_due(7)
+    state.write_text(json.dumps({"rows": 10}))
+    assert refit_due(7)
+    state.write_text(json.dumps({"last_refit": time.time() - 6 * 86400}))
+    assert not refit_due(7) and refit_due(5)
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+import tornado.testing
+
+import llm
+from llm import FAKE_REPLY, ResponseCache, generate_flavor_profile, make_fake_app, stream_flavor_profile
+
+ARGS = ("bright citrus and honey", 1, "Light", "Kenya", 6.5)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Settable time.time() as seen by the cache"""
+    now = [1000.0]
+    monkeypatch.setattr(llm, "time", SimpleNamespace(time=lambda: now[0], perf_counter=time.perf_counter))
+    return now
+
+
+def test_cache_counts_hits_and_misses(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("a") is None
+    cache.put("a", "reply")
+    assert cache.get("a") == "reply" and cache.get("a") == "reply"
+    assert cache.peek("a") == "reply" and cache.peek("b") is None
+    assert cache.stats() == {"hits": 2, "misses": 1, "entries": 1}
+
+def test_cache_expires_entries_after_the_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl_seconds=60)
+    cache.put("a", "reply")
+    clock[0] += 59
+    assert cache.get("a") == "reply"
+    clock[0] += 2
+    assert cache.peek("a") is None and cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 0}
+
+def test_cache_evicts_least_recently_used(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for key in ("a", "b"):
+        cache.put(key, key.upper())
+        clock[0] += 1
+    assert cache.get("a") == "A"
+    clock[0] += 1
+    cache.put("c", "C")
+    assert [cache.peek(key) for key in ("a", "b", "c")] == ["A", None, "C"]
+    # Peeking does not count as a use
+    clock[0] += 1
+    cache.peek("a")
+    cache.get("c")
+    clock[0] += 1
+    cache.put("d", "D")
+    assert [cache.peek(key) for key in ("a", "c", "d")] == [None, "C", "D"]
+
+def test_pregenerate_counts_one_miss_per_generated_row(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(llm, "_cache", None)
+    requests = [(f"note {i}", i % 6, "Light", "Kenya", 5.0 + i) for i in range(5)]
+    monkeypatch.setattr(llm, "catalogue_requests", lambda store, limit=None: requests)
+    reply = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="A cup."))])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kw: reply)))
+    monkeypatch.setattr(llm, "get_client", lambda: client)
+    llm.get_cache().put(llm.cache_key(*requests[0]), "Cached.")
+
+    assert llm.pregenerate(workers=2) == (4, [])
+    assert llm.get_cache().stats() == {"hits": 0, "misses": 4, "entries": 5}
+    assert llm.pregenerate(workers=2) == (0, [])
+    assert llm.get_cache().stats()["misses"] == 4
+
+
+class FakeEndpointTest(tornado.testing.AsyncHTTPTestCase):
+    def setUp(self):
+        super().setUp()
+        # The shared client talks to the fake app on this test's port, with no response cache
+        env = {"LITELLM_BASE_URL": self.get_url("/v1"), "LITELLM_TOKEN": "fake", "LLM_CACHE_PATH": ""}
+        self._env = mock.patch.dict(os.environ, env)
+        self._env.start()
+        self._clients = mock.patch.dict(llm._clients, clear=True)
+        self._clients.start()
+
+    def tearDown(self):
+        self._clients.stop()
+        self._env.stop()
+        super().tearDown()
+
+    def get_app(self):
+        return make_fake_app(token_delay=0)
+
+    def call(self, fn, *args):
+        # The blocking OpenAI client runs off the loop that serves the fake endpoint
+        return asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    @tornado.testing.gen_test
+    async def test_streamed_chunks_join_to_the_reply(self):
+        chunks = await self.call(lambda: list(stream_flavor_profile(*ARGS)))
+        assert len(chunks) == len(FAKE_REPLY.split(" "))
+        assert "".join(chunks).strip() == FAKE_REPLY
+
+    @tornado.testing.gen_test
+    async def test_blocking_call_returns_the_reply(self):
+        assert await self.call(generate_flavor_profile, *ARGS) == FAKE_REPLY
+
+    @tornado.testing.gen_test
+    async def test_client_is_shared(self):
+        await self.call(generate_flavor_profile, *ARGS)
+        await self.call(lambda: list(stream_flavor_profile(*ARGS)))
+        assert len(llm._clients) == 1
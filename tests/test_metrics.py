@@ -0,0 +1,62 @@
+import pytest
+
+import metrics
+import utils
+from metrics import render_prometheus, stage, timed, trace
+
+
+@pytest.fixture
+def recording():
+    """Metrics switched on with empty tables; the previous state is restored afterwards"""
+    was_enabled = metrics.enabled()
+    metrics.reset()
+    metrics.enable()
+    yield
+    metrics.reset()
+    if not was_enabled:
+        metrics.disable()
+
+@timed("decorated")
+def decorated(x):
+    return x * 2
+
+
+def test_stage_and_trace_are_no_ops_when_disabled(recording):
+    metrics.disable()
+    assert stage("sbert") is stage("kmeans")
+    with trace() as spans:
+        with stage("sbert"):
+            pass
+        assert decorated(2) == 4
+        metrics.record_stage("pca", 0.01)
+        metrics.count("figure_cache_hit")
+        metrics.observe_size("llm_response", 120)
+    assert spans == []
+    assert metrics.snapshot() == []
+    assert "stage=" not in render_prometheus() and "event=" not in render_prometheus()
+
+def test_trace_collects_this_threads_stages(recording):
+    with trace() as spans:
+        with stage("sbert"):
+            pass
+        assert decorated(2) == 4
+        metrics.observe_size("llm_response", 120)
+    assert [span["stage"] for span in spans] == ["sbert", "decorated", "llm_response (bytes)"]
+    assert {row["stage"]: row["count"] for row in metrics.snapshot()} == {"sbert": 1, "decorated": 1}
+
+def test_prometheus_text_has_stage_histograms_and_cache_gauges(recording):
+    utils.predict_rating.cache_clear()
+    for seconds in (0.002, 0.02, 3.0):
+        metrics.record_stage("random_forest", seconds)
+    metrics.count("figure_cache_hit", 2)
+    text = render_prometheus()
+    assert "# TYPE coffee_stage_seconds histogram" in text
+    assert 'coffee_stage_seconds_bucket{stage="random_forest",le="0.0025"} 1' in text
+    assert 'coffee_stage_seconds_bucket{stage="random_forest",le="0.025"} 2' in text
+    assert 'coffee_stage_seconds_bucket{stage="random_forest",le="+Inf"} 3' in text
+    assert 'coffee_stage_seconds_count{stage="random_forest"} 3' in text
+    assert 'coffee_events_total{event="figure_cache_hit"} 2' in text
+    for cache in ("rating_cache", "embedding_cache"):
+        assert f"# TYPE coffee_{cache} gauge" in text
+        assert f'coffee_{cache}{{kind="hits"}}' in text
+    assert 'coffee_rating_cache{kind="size"} 0' in text
@@ -0,0 +1,54 @@
+import random
+
+import pandas as pd
+import pytest
+
+from datastore import SOURCE_CSV
+from name_index import NameIndex, normalize
+
+
+@pytest.fixture(scope="module")
+def names():
+    """Corpus names the old scan and the index see the same way: ASCII, single-spaced"""
+    names = pd.read_csv(SOURCE_CSV)["name"].dropna()
+    names = names[names.map(lambda n: n.isascii() and " ".join(n.split()) == n)]
+    return names.reset_index(drop=True)
+
+def queries(names, n=60):
+    rng = random.Random(0)
+    out = ["a", "Ge", "o", "kona", "ESPRESSO", "Geisha ", "zzz", " "]
+    for name in rng.sample(list(names), n):
+        length = rng.randint(1, min(12, len(name)))
+        start = rng.randint(0, len(name) - length)
+        out.append(name[start:start + length])
+    return out
+
+
+def test_matches_case_insensitive_contains(names):
+    index = NameIndex(names)
+    for query in queries(names):
+        # The index trims the query; an empty one matches nothing
+        q = query.strip()
+        expected = set(names.index[names.str.contains(q, case=False, regex=False)]) if q else set()
+        assert set(index.lookup(query, len(names))) == expected, query
+
+def test_short_queries_scan_every_name(names):
+    index = NameIndex(names)
+    for query in ("e", "ge", "Z", "10"):
+        expected = set(names.index[names.str.contains(query, case=False, regex=False)])
+        assert len(query) < 3 and set(index.lookup(query, len(names))) == expected
+
+def test_accents_and_case_fold():
+    index = NameIndex(["Café Crème", "CAFE NOIR", "Ethiopia Guji", None])
+    assert normalize("  Café   Crème ") == "cafe creme"
+    assert set(index.lookup("cafe", 10)) == {0, 1}
+    assert set(index.lookup("CRÈME", 10)) == {0}
+    assert index.lookup("é", 10) == index.lookup("e", 10)
+    assert index.lookup("", 10) == ()
+
+def test_ranking():
+    names = ["Big Kona Blend", "Kona Extra Fancy", "Kona", "Bokonaut", "Konawaena Estate", "Old Kona Farm"]
+    index = NameIndex(names)
+    # exact, then prefix (shorter first), then word prefix (shorter, then earlier), then anywhere
+    assert index.lookup("kona", 10) == (2, 1, 4, 5, 0, 3)
+    assert index.lookup("kona", 2) == (2, 1)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from conftest import HashEncoder
+from datastore import get_store
+from ingest import cluster_features
+from projection import get_cluster_projection, get_pca_projector
+from registry import registry
+from similarity import EMBEDDINGS_PATH, _embeddings_current
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    """Cluster feature rows of the stored corpus, from the saved embeddings when they are current"""
+    store = get_store()
+    df = store.frame(text_cols=("text",))
+    stored = _embeddings_current(store)
+    if stored:
+        emb = np.load(EMBEDDINGS_PATH)
+    else:
+        emb = HashEncoder().encode(df["text"].fillna("").tolist())
+    X = cluster_features(df, emb, registry.get("ohe_cols"), registry.get("scaler_cluster"))
+    return X, stored
+
+
+def test_float32_projector_matches_transform(corpus):
+    X, _ = corpus
+    expected = registry.get("pca").transform(X)
+    projector = get_pca_projector()
+    np.testing.assert_allclose(projector.project(X), expected, rtol=0, atol=1e-4)
+    single = np.vstack([projector.project(x) for x in X[:50]])
+    np.testing.assert_allclose(single, expected[:50], rtol=0, atol=1e-4)
+
+def test_fused_projection_matches_transform_and_predict(corpus):
+    X, _ = corpus
+    fused = get_cluster_projection().transform(X)
+    np.testing.assert_allclose(fused["pca_xy"], registry.get("pca").transform(X), rtol=0, atol=1e-9)
+    assert (fused["label"] == registry.get("kmeans").predict(X)).all()
+
+def test_matches_stored_pca_data(corpus):
+    X, stored = corpus
+    pca_data = np.asarray(get_store().pca_data, dtype=np.float64)
+    expected = registry.get("pca").transform(X) if stored and len(X) == len(pca_data) else None
+    # pca_data.npy comes from the real SBERT vectors; other embeddings cannot reproduce it
+    if expected is None or np.abs(expected - pca_data).max() > 1e-3:
+        pytest.skip("stored embeddings do not reproduce pca_data.npy")
+    np.testing.assert_allclose(get_pca_projector().project(X), pca_data, rtol=0, atol=1e-4)
@@ -0,0 +1,73 @@
+import numpy as np
+
+import registry as registry_module
+from registry import ModelRegistry
+
+
+def test_background_warm_up_starts_once(tmp_path):
+    path = tmp_path / "keywords.json"
+    path.write_text("{}")
+    models = ModelRegistry({"keywords": ("json", str(path))})
+    first = models.warm_up(background=True)
+    first.join()
+    assert models.is_loaded("keywords")
+    assert models.warm_up(background=True) is first
+    models.invalidate(["keywords"])
+    second = models.warm_up(background=True)
+    assert second is not first
+    second.join()
+    assert models.is_loaded("keywords")
+
+def test_replaced_pickle_makes_rating_model_stale(tmp_path, monkeypatch):
+    import forest
+
+    rf_path = tmp_path / "rf_rating.pkl"
+    rf_path.write_bytes(b"old")
+    monkeypatch.setattr(forest, "RF_PATH", str(rf_path))
+    # No compiled export: the loader falls back to the pickle
+    monkeypatch.setitem(registry_module.LOADERS, "forest", lambda source: object())
+    models = ModelRegistry({"rating_model": ("forest", str(tmp_path / "rf_compiled"))})
+    models.get("rating_model")
+    assert models.stale() == []
+    rf_path.write_bytes(b"retrained")
+    assert models.reload_stale() == ["rating_model"]
+
+def test_invalidating_sbert_clears_cached_embeddings(monkeypatch):
+    import utils
+    from conftest import HashEncoder
+
+    class Shifted(HashEncoder):
+        def encode(self, texts, batch_size=32, **kwargs):
+            return super().encode(texts, batch_size) + 1.0
+
+    registry = registry_module.registry
+    utils.embed_text.cache_clear()
+    monkeypatch.setitem(registry._objects, "sbert", HashEncoder())
+    before = utils.embed_text("floral, bright")
+    registry.invalidate(["kmeans"])
+    assert utils.embed_text.cache_info().currsize == 1
+    registry.invalidate(["sbert"])
+    assert utils.embed_text.cache_info().currsize == 0
+    monkeypatch.setitem(registry._objects, "sbert", Shifted())
+    np.testing.assert_allclose(utils.embed_text("floral, bright"), before + 1.0)
+
+def test_invalidating_the_rating_model_clears_cached_ratings(monkeypatch):
+    import utils
+
+    class Constant:
+        def __init__(self, value):
+            self.value = value
+
+        def predict(self, X):
+            return np.full(X.shape[0], self.value)
+
+    registry = registry_module.registry
+    utils.predict_rating.cache_clear()
+    monkeypatch.setitem(registry._objects, "rating_model", Constant(88.0))
+    assert utils.predict_rating("floral", "Light", "Kenya", 5.0) == 88.0
+    registry.invalidate(["sbert"])
+    assert utils.predict_rating.cache_info().currsize == 1
+    registry.invalidate(["rating_model"])
+    assert utils.predict_rating.cache_info().currsize == 0
+    monkeypatch.setitem(registry._objects, "rating_model", Constant(93.0))
+    assert utils.predict_rating("floral", "Light", "Kenya", 5.0) == 93.0
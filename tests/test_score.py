@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import score
+from conftest import requires
+from datastore import SOURCE_CSV
+from forest import RF_PATH
+from score import SCORE_COLS, load_checkpoint, score_chunk, score_file, validate_chunk, worker_env
+
+
+def bad_rows():
+    df = pd.read_csv(SOURCE_CSV, nrows=6)
+    df["100g_USD"] = df["100g_USD"].astype(object)
+    df.loc[1, "100g_USD"] = np.nan
+    df.loc[2, "100g_USD"] = np.inf
+    df.loc[3, "100g_USD"] = "n/a"
+    df["rating"] = df["rating"].astype(object)
+    df.loc[4, "rating"] = "great"
+    return df
+
+
+def test_validate_flags_prices_and_ratings():
+    errors = validate_chunk(bad_rows())
+    assert (errors[[0, 5]] == "").all()
+    assert errors[[1, 2, 3]].str.contains("100g_USD").all()
+    assert "rating" in errors[4]
+    assert (validate_chunk(bad_rows().drop(columns="100g_USD")) != "").all()
+
+def test_worker_env_puts_the_environment_back(monkeypatch):
+    monkeypatch.setenv("OMP_NUM_THREADS", "8")
+    monkeypatch.delenv("MKL_NUM_THREADS", raising=False)
+    with worker_env(2):
+        assert os.environ["OMP_NUM_THREADS"] == os.environ["MKL_NUM_THREADS"] == "2"
+        assert os.environ["TOKENIZERS_PARALLELISM"] == "false"
+    assert os.environ["OMP_NUM_THREADS"] == "8" and "MKL_NUM_THREADS" not in os.environ
+
+@requires(RF_PATH)
+def test_bad_rows_get_an_error_instead_of_scores(hash_sbert):
+    out = score_chunk(bad_rows())
+    assert list(out.columns) == ["name", "roaster", *SCORE_COLS, "error"]
+    bad = out["error"] != ""
+    assert bad.tolist() == [False, True, True, True, True, False]
+    assert out.loc[bad, "cluster_id"].isna().all() and out.loc[bad, "predicted_rating"].isna().all()
+    assert out.loc[~bad, "cluster_id"].notna().all() and np.isfinite(out.loc[~bad, "predicted_rating"]).all()
+
+
+@pytest.fixture
+def catalogue(tmp_path, monkeypatch):
+    """50 corpus rows as an input CSV; score_file runs in-process without touching library threads"""
+    import embeddings
+
+    src = str(tmp_path / "in.csv")
+    pd.read_csv(SOURCE_CSV, nrows=50).to_csv(src, index=False)
+    monkeypatch.setattr(embeddings, "_settings", dict(embeddings._settings))
+    return src
+
+def crash_after(monkeypatch, n_chunks):
+    """Make the n_chunks + 1-th score_chunk call fail, like a killed run; returns the call log"""
+    calls = []
+
+    def scored(df, batch_size=64):
+        calls.append(len(df))
+        if n_chunks is not None and len(calls) > n_chunks:
+            raise KeyboardInterrupt
+        return score_chunk(df, batch_size)
+
+    monkeypatch.setattr(score, "score_chunk", scored)
+    return calls
+
+def run(src, out, **kwargs):
+    return score_file(src, out, workers=0, chunk_size=8, threads=0, progress=False, **kwargs)
+
+
+@requires(RF_PATH)
+def test_resumed_run_matches_an_uninterrupted_one(catalogue, tmp_path, monkeypatch, hash_sbert):
+    full, out = str(tmp_path / "full.csv"), str(tmp_path / "out.csv")
+    assert run(catalogue, full)[0] == 50
+
+    crash_after(monkeypatch, 3)
+    with pytest.raises(KeyboardInterrupt):
+        run(catalogue, out)
+    state = load_checkpoint(catalogue, out, 8)
+    assert (state["chunks"], state["rows"], state["complete"]) == (3, 24, False)
+    with open(out, "a") as f:
+        f.write("half of a chunk that never got check")  # torn write past the checkpoint
+
+    calls = crash_after(monkeypatch, None)
+    assert run(catalogue, out, resume=True)[0] == 26
+    assert calls == [8, 8, 8, 2]  # finished chunks are skipped, not re-scored
+    assert open(out, "rb").read() == open(full, "rb").read()
+    assert load_checkpoint(catalogue, out, 8)["complete"]
+    assert run(catalogue, out, resume=True) == (0, 0.0)
+
+@requires(RF_PATH)
+def test_checkpoint_for_a_modified_input_is_ignored(catalogue, tmp_path, monkeypatch, hash_sbert):
+    out = str(tmp_path / "out.csv")
+    crash_after(monkeypatch, 2)
+    with pytest.raises(KeyboardInterrupt):
+        run(catalogue, out)
+    assert load_checkpoint(catalogue, out, 8)["chunks"] == 2
+    assert load_checkpoint(catalogue, out, 16) is None
+
+    df = pd.read_csv(catalogue)
+    df.loc[0, "100g_USD"] = 99.99
+    df.to_csv(catalogue, index=False)
+    assert load_checkpoint(catalogue, out, 8) is None
+    calls = crash_after(monkeypatch, None)
+    assert run(catalogue, out, resume=True)[0] == 50
+    assert len(calls) == 7
+    fresh = str(tmp_path / "fresh.csv")
+    run(catalogue, fresh)
+    assert open(out, "rb").read() == open(fresh, "rb").read()
@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import pytest
+import tornado.testing
+
+from conftest import HashEncoder
+from registry import registry
+from service import MicroBatcher, make_app, parse_request, score_batch
+
+GOOD = {"text": "bright citrus and honey", "roast": "Light", "loc": "Kenya", "price": 6.5, "rating": 93}
+
+
+def test_parse_request_rejects_non_finite_and_non_objects():
+    assert parse_request(GOOD)["price"] == 6.5
+    for body in ([GOOD], "text", 3):
+        with pytest.raises(ValueError):
+            parse_request(body)
+    for key, value in (("price", "nan"), ("price", "inf"), ("rating", "-inf"), ("rating", float("nan"))):
+        with pytest.raises(ValueError):
+            parse_request(dict(GOOD, **{key: value}))
+
+
+class ServiceTest(tornado.testing.AsyncHTTPTestCase):
+    def setUp(self):
+        self._sbert = registry._objects.get("sbert")
+        registry._objects["sbert"] = HashEncoder()
+        self.batches = []
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        if self._sbert is None:
+            registry._objects.pop("sbert", None)
+        else:
+            registry._objects["sbert"] = self._sbert
+
+    def get_app(self):
+        def score(items):
+            self.batches.append(len(items))
+            if any(item["text"] == "boom" for item in items):
+                raise RuntimeError("bad row")
+            return score_batch(items)
+
+        self.batcher = MicroBatcher(score, max_batch=16, max_wait=0.05)
+        return make_app(self.batcher)
+
+    def post(self, endpoint, body):
+        data = body if isinstance(body, str) else json.dumps(body)
+        return self.http_client.fetch(self.get_url(f"/{endpoint}"), method="POST", body=data, raise_error=False)
+
+    @tornado.testing.gen_test
+    async def test_cluster_fields(self):
+        response = await self.post("cluster", GOOD)
+        assert response.code == 200
+        result = json.loads(response.body)
+        assert set(result) == {"cluster_id", "cluster_name", "cluster_margin", "low_confidence",
+                               "runner_up_id", "memberships"}
+        assert abs(sum(result["memberships"]) - 1) < 1e-9
+
+    @tornado.testing.gen_test
+    async def test_validation(self):
+        for body in ("not json", json.dumps([GOOD]), json.dumps("x"), json.dumps(dict(GOOD, price="nan")),
+                     json.dumps(dict(GOOD, rating="inf")), json.dumps({"text": "no price"})):
+            response = await self.post("analyze", body)
+            assert response.code == 400, body
+        assert self.batches == []
+
+    @tornado.testing.gen_test
+    async def test_concurrent_requests_share_a_batch(self):
+        bodies = [dict(GOOD, text=f"coffee {i}", price=5 + i) for i in range(8)]
+        responses = await asyncio.gather(*(self.post("analyze", b) for b in bodies))
+        assert [r.code for r in responses] == [200] * 8
+        assert max(self.batches) > 1
+
+    @tornado.testing.gen_test
+    async def test_bad_row_fails_alone(self):
+        bodies = [dict(GOOD, text=f"coffee {i}") for i in range(4)] + [dict(GOOD, text="boom")]
+        responses = await asyncio.gather(*(self.post("analyze", b) for b in bodies))
+        assert [r.code for r in responses] == [200, 200, 200, 200, 500]
+        assert "bad row" in json.loads(responses[-1].body)["error"]
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import datastore
+import similarity
+from datastore import get_store
+from registry import ARTIFACTS, ModelRegistry
+from similarity import SimilarityIndex, _normalize, get_similarity_index
+
+# Share of the exact top 10 the IVF path must return on clustered data
+IVF_MIN_RECALL = 0.9
+
+
+@pytest.fixture
+def clustered():
+    """Unit vectors scattered around 200 topics, and queries drawn the same way"""
+    rng = np.random.default_rng(0)
+    topics = rng.standard_normal((200, 64))
+    emb = _normalize(topics[rng.integers(0, 200, 20000)] + 0.6 * rng.standard_normal((20000, 64)))
+    queries = topics[rng.integers(0, 200, 50)] + 0.6 * rng.standard_normal((50, 64))
+    return emb, queries
+
+@pytest.fixture
+def saved(tmp_path, monkeypatch):
+    """Embedding files and the cached index kept away from the real corpus"""
+    monkeypatch.setattr(similarity, "EMBEDDINGS_PATH", str(tmp_path / "corpus_emb.npy"))
+    monkeypatch.setattr(similarity, "EMBEDDINGS_META", str(tmp_path / "corpus_emb.json"))
+    monkeypatch.setattr(similarity, "_index", None)
+    monkeypatch.setattr(similarity, "_index_version", None)
+    return tmp_path
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    """A five-row corpus the test may rewrite"""
+    paths = {
+        "source_csv": str(tmp_path / "df_for_pca.csv"),
+        "pca_path": str(tmp_path / "pca_data.npy"),
+        "labels_path": str(tmp_path / "cluster_labels.npy"),
+        "store_dir": str(tmp_path / "store"),
+    }
+    pd.read_csv(datastore.SOURCE_CSV, nrows=5).to_csv(paths["source_csv"], index=False)
+    np.save(paths["pca_path"], np.zeros((5, 2)))
+    np.save(paths["labels_path"], np.zeros(5, dtype=np.int64))
+    monkeypatch.setattr(datastore, "_store", None)
+    return paths
+
+
+def test_exact_search_matches_brute_force():
+    rng = np.random.default_rng(1)
+    emb = _normalize(rng.standard_normal((3000, 48)))
+    index = SimilarityIndex(emb, approx=False)
+    for q in rng.standard_normal((20, 48)):
+        rows, scores = index.search(q, k=7)
+        cosine = emb @ q / np.linalg.norm(q)
+        expected = np.argsort(-cosine, kind="stable")[:7]
+        assert rows.tolist() == expected.tolist()
+        np.testing.assert_allclose(scores, cosine[expected], rtol=1e-5)
+    assert len(index.search(emb[0], k=5000)[0]) == 3000
+
+def test_ivf_recall(clustered):
+    emb, queries = clustered
+    index = SimilarityIndex(emb, approx=True)
+    recall = []
+    for q in queries:
+        exact = np.argsort(-(emb @ _normalize(q)))[:10]
+        rows, scores = index.search(q, k=10)
+        assert (np.diff(scores) <= 0).all()
+        recall.append(len(set(exact) & set(rows)) / 10)
+    assert np.mean(recall) >= IVF_MIN_RECALL
+
+def test_rebuilds_embeddings_when_the_store_changes(corpus, saved, hash_sbert):
+    store = get_store(**corpus)
+    index = get_similarity_index(store)
+    assert similarity._embeddings_current(store)
+    assert get_similarity_index(store) is index
+
+    df = pd.read_csv(corpus["source_csv"])
+    df.loc[0, "text"] = "smoky, tobacco, dark chocolate"
+    df.to_csv(corpus["source_csv"], index=False)
+    changed = get_store(**corpus)
+    assert changed.version != store.version
+    assert not similarity._embeddings_current(changed)
+    rebuilt = get_similarity_index(changed)
+    assert rebuilt is not index and similarity._embeddings_current(changed)
+    rows, scores = rebuilt.search(hash_sbert.encode(["smoky, tobacco, dark chocolate"])[0], k=1)
+    assert rows[0] == 0 and scores[0] == pytest.approx(1.0)
+
+def test_warm_up_builds_the_corpus_embeddings(saved, hash_sbert):
+    models = ModelRegistry({"corpus_index": ARTIFACTS["corpus_index"]})
+    models.warm_up()
+    assert isinstance(models.get("corpus_index"), SimilarityIndex)
+    assert similarity._embeddings_current(get_store())
+    assert get_similarity_index() is models.get("corpus_index")
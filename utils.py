@@ -1,66 +1,147 @@
-import joblib
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from scipy.sparse import csr_matrix, hstack
-import os
-from openai import OpenAI
-import plotly.express as px
-
-# Load models
-rf_model = joblib.load("models/rf_rating.pkl")
-kmeans = joblib.load("models/kmeans.pkl")
-tfidf = joblib.load("models/tfidf.pkl")
-
-# Load preprocessors
-scaler_price = joblib.load("models/rf_price_scaler.pkl")
-rating_ohe_cols = joblib.load("models/rf_cat_cols.pkl")
-ohe_cols = joblib.load("models/kmeans_ohe_cols.pkl")
-scaler_cluster = joblib.load("models/scaler.pkl")
-
-# SBERT
-sbert = SentenceTransformer("all-MiniLM-L6-v2")
+import pandas as pd
+from functools import lru_cache
 
-# ---- Rating Features ----
-def encode_for_rating(text, roast, loc, price):
-    text_vec = tfidf.transform([text])
+import metrics
+from centroids import get_centroid_assigner
+from features import get_cluster_encoder, get_rating_featurizer
+from metrics import stage, timed
+from projection import get_cluster_projection, get_pca_projector
+from registry import registry, ARTIFACTS
 
-    # One-hot
-    ohe = np.zeros(len(rating_ohe_cols))
-    for i, col in enumerate(rating_ohe_cols):
-        if col == f"roast_{roast}" or col == f"loc_country_{loc}":
-            ohe[i] = 1
-    ohe = ohe.reshape(1, -1)
+# Models, preprocessors and SBERT are loaded lazily through the shared registry.
+# utils.rf_model, utils.sbert, ... still resolve to the loaded objects.
+def __getattr__(name):
+    if name in ARTIFACTS:
+        return registry.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    # Numeric
-    price_arr = csr_matrix([[price]])
+def warm_up(names=None, background=False):
+    if names is None:
+        # rating_model falls back to rf_model itself when no compiled forest is exported
+        names = [name for name in ARTIFACTS if name != "rf_model"]
+    return registry.warm_up(names, background)
 
-    # Combine
-    X = hstack([text_vec, ohe, price_arr])
-    return X
+# ---- Rating Features ----
+def encode_for_rating(text, roast, loc, price):
+    # 1-row CSR: tfidf | roast/country one-hot | raw price (see features.py)
+    return get_rating_featurizer().transform([text], [roast], [loc], [price])
 
+RATING_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=RATING_CACHE_SIZE)
 def predict_rating(text, roast, loc, price):
     X = encode_for_rating(text, roast, loc, price)
-    rating = rf_model.predict(X)[0]
+    rating_model = registry.get("rating_model")
+    with stage("random_forest"):
+        rating = rating_model.predict(X)[0]
     return float(rating)
 
 
 # ---- Cluster Features ----
+EMBED_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=EMBED_CACHE_SIZE)
+def embed_text(text):
+    # Keyed on the description itself, so a repeated description skips the encoder
+    sbert = registry.get("sbert")
+    with stage("sbert"):
+        emb = sbert.encode([text])[0]
+    emb.flags.writeable = False
+    return emb
+
+metrics.register_lru("rating", predict_rating)
+metrics.register_lru("embedding", embed_text)
+
+# Cached predictions are only valid for the models that produced them
+RATING_INPUTS = {"rating_model", "rf_model", "tfidf", "rating_ohe_cols"}
+
+def _clear_caches(names):
+    if names & RATING_INPUTS:
+        predict_rating.cache_clear()
+    if "sbert" in names:
+        embed_text.cache_clear()
+
+registry.on_invalidate(_clear_caches)
+
 def encode_for_cluster(text, roast, loc, price, rating):
-    emb = sbert.encode([text])[0]
-    ohe = np.zeros(len(ohe_cols))
-    for i, col in enumerate(ohe_cols):
-        if col == roast or col == loc:
-            ohe[i] = 1
-    # numeric = (price, rating) — scaled together
-    nums_scaled = scaler_cluster.transform([[price, rating]])[0]
+    # embedding | roast/country one-hot | (price, rating) scaled together (see features.py)
+    emb = embed_text(text)
+    return get_cluster_encoder().cluster_matrix(emb[None, :], [roast], [loc], [price], [rating])
 
-    X = np.hstack([emb, ohe, nums_scaled])
-    return X.reshape(1, -1)
+@timed("kmeans")
+def assign_clusters(X):
+    # Nearest centroid per row with distances, memberships and margin (see centroids.py)
+    return get_centroid_assigner().assign(X)
 
 def predict_cluster(text, roast, loc, price, rating):
     X = encode_for_cluster(text, roast, loc, price, rating)
-    cluster_id = int(kmeans.predict(X)[0])
-    return cluster_id
+    return int(assign_clusters(X)["label"][0])
+
+# ---- Batch Prediction ----
+def build_text(df):
+    # desc_1 + desc_2 + desc_3 with a missing part treated as empty. Deliberately unlike the
+    # notebook's plain concatenation, where any missing part made the whole text NaN and then ""
+    return df["desc_1"].fillna("") + " " + df["desc_2"].fillna("") + " " + df["desc_3"].fillna("")
+
+def _batch_columns(data, roasts=None, locs=None, prices=None, ratings=None):
+    # Accept either a DataFrame in the df_for_pca.csv / coffee_analysis.csv schema or column arrays
+    if isinstance(data, pd.DataFrame):
+        texts = data["text"].fillna("") if "text" in data else build_text(data)
+        roasts = data["roast"]
+        locs = data["loc_country"]
+        prices = data["100g_USD"]
+        if ratings is None and "rating" in data:
+            ratings = data["rating"]
+    else:
+        texts = data
+    texts = [str(t) for t in texts]
+    prices = np.asarray(prices, dtype=float)
+    if ratings is not None:
+        ratings = np.asarray(ratings, dtype=float)
+    return texts, list(roasts), list(locs), prices, ratings
+
+def encode_for_rating_batch(texts, roasts, locs, prices):
+    return get_rating_featurizer().transform(texts, roasts, locs, prices)
+
+def predict_rating_batch(data, roasts=None, locs=None, prices=None):
+    texts, roasts, locs, prices, _ = _batch_columns(data, roasts, locs, prices)
+    X = encode_for_rating_batch(texts, roasts, locs, prices)
+    rating_model = registry.get("rating_model")
+    with stage("random_forest"):
+        return rating_model.predict(X).astype(float)
+
+def encode_for_cluster_batch(texts, roasts, locs, prices, ratings, batch_size=64, emb=None):
+    if emb is None:
+        sbert = registry.get("sbert")
+        with stage("sbert"):
+            emb = sbert.encode(texts, batch_size=batch_size)
+    return get_cluster_encoder().cluster_matrix(emb, roasts, locs, prices, ratings)
+
+def predict_cluster_batch(data, roasts=None, locs=None, prices=None, ratings=None, batch_size=64):
+    texts, roasts, locs, prices, ratings = _batch_columns(data, roasts, locs, prices, ratings)
+    X = encode_for_cluster_batch(texts, roasts, locs, prices, ratings, batch_size)
+    return assign_clusters(X)["label"]
+
+def predict_batch(data, roasts=None, locs=None, prices=None, ratings=None, batch_size=64):
+    """Score many coffees at once; missing ratings are filled in by the rating model"""
+    texts, roasts, locs, prices, ratings = _batch_columns(data, roasts, locs, prices, ratings)
+    predicted = predict_rating_batch(texts, roasts, locs, prices)
+    if ratings is None:
+        ratings = predicted
+    else:
+        ratings = np.where(np.isnan(ratings), predicted, ratings)
+    X = encode_for_cluster_batch(texts, roasts, locs, prices, ratings, batch_size)
+    assigned = assign_clusters(X)
+    cluster_ids = assigned["label"]
+    return pd.DataFrame({
+        "predicted_rating": predicted,
+        "rating_used": ratings,
+        "cluster_id": cluster_ids,
+        "cluster_name": [CLUSTER_NAMES[c] for c in cluster_ids],
+        "cluster_margin": assigned["margin"],
+        "low_confidence": assigned["low_confidence"],
+    })
 
 # Cluster Data
 CLUSTER_NAMES = {
@@ -82,24 +163,79 @@ CLUSTER_DESCRIPTIONS = {
 }
 
 
-def get_user_pca_point(text, roast, loc, price, rating):
-    pca = joblib.load("models/pca_2d.pkl")
-    X = encode_for_cluster(text, roast, loc, price, rating)  
-    pca_xy = pca.transform(X)  
+def _xy(pca_xy):
+    # First row as an (x, y) point; a 1-component PCA is drawn on the x axis
     if pca_xy.shape[1] == 1:
         return np.array([pca_xy[0, 0], 0.0])
-    return pca_xy[0]
+    return pca_xy[0].astype(np.float64)
+
+def _pca_point(X):
+    # Precomputed float32 projection instead of pca.transform (see projection.py)
+    projector = get_pca_projector()
+    with stage("pca"):
+        pca_xy = projector.project(X)
+    return _xy(pca_xy)
+
+@timed("kmeans_pca")
+def assign_and_project(X):
+    # Centroid distances and PCA coordinates from one GEMM
+    return get_cluster_projection().transform(X)
+
+def analyze_batch(data, roasts=None, locs=None, prices=None, ratings=None, batch_size=64, emb=None):
+    """analyze() for many rows: one RF predict for the missing ratings, one SBERT encode"""
+    texts, roasts, locs, prices, ratings = _batch_columns(data, roasts, locs, prices, ratings)
+    ratings = np.full(len(texts), np.nan) if ratings is None else ratings.copy()
+    missing = np.isnan(ratings)
+    if missing.any():
+        idx = np.nonzero(missing)[0]
+        ratings[idx] = predict_rating_batch(
+            [texts[i] for i in idx], [roasts[i] for i in idx], [locs[i] for i in idx], prices[idx]
+        )
+    X = encode_for_cluster_batch(texts, roasts, locs, prices, ratings, batch_size, emb)
+    assigned = assign_and_project(X)
+    cluster_ids = assigned["label"]
+    pca_xy = assigned["pca_xy"]
+    return pd.DataFrame({
+        "rating": ratings,
+        "cluster_id": cluster_ids,
+        "cluster_name": [CLUSTER_NAMES[c] for c in cluster_ids],
+        "runner_up_id": assigned["runner_up"],
+        "cluster_margin": assigned["margin"],
+        "low_confidence": assigned["low_confidence"],
+        "memberships": list(assigned["memberships"]),
+        "pca_x": pca_xy[:, 0],
+        "pca_y": pca_xy[:, 1] if pca_xy.shape[1] > 1 else 0.0,
+    })
+
+def get_user_pca_point(text, roast, loc, price, rating):
+    X = encode_for_cluster(text, roast, loc, price, rating)
+    return _pca_point(X)
+
+def analyze(text, roast, loc, price, rating=None):
+    """Rating, cluster (with confidence) and PCA point from a single cluster feature vector"""
+    if rating is None:
+        rating = predict_rating(text, roast, loc, price)
+    X = encode_for_cluster(text, roast, loc, price, rating)
+    assigned = assign_and_project(X)
+    cluster_id = int(assigned["label"][0])
+    return {
+        "rating": float(rating),
+        "cluster_id": cluster_id,
+        "cluster_name": CLUSTER_NAMES[cluster_id],
+        "runner_up_id": int(assigned["runner_up"][0]),
+        "cluster_margin": float(assigned["margin"][0]),
+        "low_confidence": bool(assigned["low_confidence"][0]),
+        "memberships": assigned["memberships"][0].tolist(),
+        "pca_xy": _xy(assigned["pca_xy"]),
+    }
   
-def plot_pca_interactive(pca_data, cluster_labels, df, CLUSTER_NAMES, user_xy=None):
+# Above this many points the scatter switches from SVG to WebGL rendering
+WEBGL_MIN_POINTS = 5000
+
+def build_pca_base_figure(pca_data, cluster_labels, df, CLUSTER_NAMES):
     import plotly.express as px
-    import plotly.graph_objects as go
-    import pandas as pd
-    print("DEBUG SHAPES:",
-      pca_data.shape,
-      cluster_labels.shape,
-      len(df))
 
-    cluster_labels = cluster_labels.astype(int)
+    cluster_labels = np.asarray(cluster_labels).astype(int)
     df_plot = pd.DataFrame({
         "PC1": pca_data[:, 0],
         "PC2": pca_data[:, 1],
@@ -120,75 +256,43 @@ def plot_pca_interactive(pca_data, cluster_labels, df, CLUSTER_NAMES, user_xy=No
         hover_data=["Roast", "Origin", "Price", "Rating", "Roaster"],
         title="PCA Visualization of Coffee Clusters",
         opacity=0.75,
-        render_mode="svg"
+        render_mode="webgl" if len(df_plot) >= WEBGL_MIN_POINTS else "svg"
     )
-
-    if user_xy is not None:
-        fig.add_trace(go.Scatter(
-            x=[user_xy[0]],
-            y=[user_xy[1]],
-            mode="markers+text",
-            marker=dict(
-                size=10,
-                color="black",
-                line=dict(width=2, color="yellow")  
-            ),
-            text=["Your Coffee"],
-            textposition="top center",
-            name="Your Coffee",  
-            showlegend=True,
-        ))
     fig.update_layout(
         legend_title_text="Cluster Name",
         showlegend=True
     )
     return fig
 
+def add_user_point(fig, user_xy):
+    import plotly.graph_objects as go
 
-# ---- LLM Description ----
-import json
-cluster_keywords = json.load(open("data/cluster_keywords.json", "r"))
-
-def generate_flavor_profile(text, cluster_id, roast, loc, price):
-    api_key = os.getenv("LITELLM_TOKEN")
-    if not api_key:
-        raise ValueError("LITELLM_TOKEN not found. Please set it first.")
-
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://litellm.oit.duke.edu/v1"
-    )
-
-    cluster_name = CLUSTER_NAMES[cluster_id]
-    keywords = cluster_keywords[str(cluster_id)]
-    prompt = f"""
-You are a professional coffee taster holding an SCA certification. Based on the information below, 
-generate a professional yet easy-to-understand flavor description.
-
-[User’s Original Notes]
-{text}
-
-[Cluster Name]
-{cluster_name}
-
-[Cluster Flavor Keywords]
-{', '.join(keywords)}
+    fig.add_trace(go.Scatter(
+        x=[user_xy[0]],
+        y=[user_xy[1]],
+        mode="markers+text",
+        marker=dict(
+            size=10,
+            color="black",
+            line=dict(width=2, color="yellow")
+        ),
+        text=["Your Coffee"],
+        textposition="top center",
+        name="Your Coffee",
+        showlegend=True,
+    ))
+    return fig
 
-[Coffee Parameters]
-Roast Level: {roast}
-Origin Country: {loc}
-Price (per 100g USD): {price}
+def plot_pca_interactive(pca_data, cluster_labels, df, CLUSTER_NAMES, user_xy=None):
+    with stage("plot"):
+        fig = build_pca_base_figure(pca_data, cluster_labels, df, CLUSTER_NAMES)
+        if user_xy is not None:
+            add_user_point(fig, user_xy)
+    return fig
 
-Please generate:
-- A 3–5 sentence tasting summary covering aroma, mouthfeel, acidity, and overall flavor structure.
-- Do NOT repeat what the user already wrote.
-- The description must sound natural, coherent, and professionally written—not like stitched machine output.
-- Respond in ENGLISH ONLY.
-"""
 
-    response = client.chat.completions.create(
-        model="GPT 4.1 Mini",   
-        messages=[{"role": "user", "content": prompt}]
-    )
+# ---- LLM Description ----
+def generate_flavor_profile(text, cluster_id, roast, loc, price):
+    from llm import generate_flavor_profile as generate
 
-    return response.choices[0].message.content
\ No newline at end of file
+    return generate(text, cluster_id, roast, loc, price)